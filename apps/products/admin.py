@@ -1,3 +1,203 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.functional import cached_property
+
+from . import pagination
+from .models import Customer, LineItem, Order, Product
+from .search import search_customers
+
+# query string parameter of the next page link
+CURSOR_VAR = "cursor"
+
+# customers matched by a name search, best matches first
+SEARCH_RESULTS_LIMIT = 1000
+
+
+def estimated_count(queryset):
+    """
+    Return `(count, label)` for a changelist. A whole PostgreSQL table uses the
+    planner's row estimate, anything else is counted up to ADMIN_COUNT_LIMIT
+    rows so the count stops early instead of scanning every match. Cached for
+    ADMIN_COUNT_TIMEOUT seconds.
+    """
+    limit = settings.ADMIN_COUNT_LIMIT
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, "0"
+    key = "admin_count:" + hashlib.md5(f"{queryset.db} {sql} {params}".encode()).hexdigest()
+    counted = cache.get(key)
+    if counted is None:
+        counted = None, False
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            if row and row[0] >= limit:
+                counted = row[0], True
+        if counted[0] is None:
+            counted = queryset.order_by()[: limit + 1].count(), False
+        cache.set(key, counted, settings.ADMIN_COUNT_TIMEOUT)
+    count, estimated = counted
+    if estimated:
+        return count, f"~{count:,}"
+    if count > limit:
+        return limit, f"{limit:,}+"
+    return count, f"{count:,}"
+
+
+class EstimatedCountPaginator(Paginator):
+    """Pages over a bounded count, used by autocomplete lookups."""
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)[0]
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages with a cursor on the admin's ordering instead of ?p=N, every page
+    seeks into the index in the same time and nothing counts the whole result.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_ordering(self, request, queryset):
+        # column sorting would need an index per column
+        return list(self.model_admin.get_ordering(request))
+
+    def get_results(self, request):
+        cursor = self.params.get(CURSOR_VAR)
+        try:
+            queryset = self.model_admin.keyset_filter(self.queryset, cursor)
+        except pagination.InvalidCursor:
+            raise IncorrectLookupParameters
+        # one extra row tells whether there is a next page
+        rows = list(queryset[: self.list_per_page + 1])
+        self.next_cursor = None
+        if len(rows) > self.list_per_page:
+            rows = rows[: self.list_per_page]
+            self.next_cursor = self.model_admin.encode_cursor(rows[-1])
+        if self.model_admin.list_prefetch_related:
+            prefetch_related_objects(rows, *self.model_admin.list_prefetch_related)
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count, self.count_label = estimated_count(self.queryset)
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = bool(cursor or self.next_cursor)
+        self.first_page_url = self.get_query_string(remove=[CURSOR_VAR]) if cursor else None
+        self.next_page_url = self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    change_list_template = "admin/keyset_change_list.html"
+    list_per_page = 100
+    show_full_result_count = False
+    sortable_by = ()
+    ordering = ("-id",)
+    paginator = EstimatedCountPaginator
+    # applied to the rows of a changelist page only
+    list_prefetch_related = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def keyset_filter(self, queryset, cursor):
+        queryset = queryset.order_by("-id")
+        if cursor:
+            try:
+                queryset = queryset.filter(id__lt=int(cursor))
+            except ValueError:
+                raise pagination.InvalidCursor(cursor)
+        return queryset
+
+    def encode_cursor(self, obj):
+        return str(obj.pk)
+
+
+@admin.register(Customer)
+class CustomerAdmin(KeysetAdmin):
+    list_display = ("id", "first_name", "last_name", "email", "city", "postcode")
+    search_fields = ("=email",)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if "@" in search_term:
+            return queryset.filter(email=search_term), False
+        # the name index ranks matches, the changelist still shows them newest first
+        customers, _ = search_customers(name=search_term, page_size=SEARCH_RESULTS_LIMIT)
+        return queryset.filter(pk__in=[customer.pk for customer in customers]), False
+
+
+@admin.register(Product)
+class ProductAdmin(KeysetAdmin):
+    list_display = ("id", "name", "price")
+    search_fields = ("name",)
+
+
+class LineItemInline(admin.TabularInline):
+    model = LineItem
+    autocomplete_fields = ("product",)
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("product")
+
+
+@admin.register(Order)
+class OrderAdmin(KeysetAdmin):
+    list_display = ("id", "order_date", "customer", "coupon_code", "shipped_date", "delivered_date", "line_items")
+    list_select_related = ("customer",)
+    list_prefetch_related = (Prefetch("lineitem_set", queryset=LineItem.objects.select_related("product")),)
+    ordering = ("-order_date", "-id")
+    date_hierarchy = "order_date"
+    search_fields = ("=id", "=coupon_code")
+    autocomplete_fields = ("customer",)
+    readonly_fields = ("version",)
+    inlines = (LineItemInline,)
+
+    def keyset_filter(self, queryset, cursor):
+        return pagination.keyset_filter(queryset, cursor)
+
+    def encode_cursor(self, obj):
+        return pagination.encode_cursor(obj.order_date, obj.pk)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # an icontains over both columns would scan the table
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return queryset.filter(coupon_code=search_term), False
+
+    @admin.display(description="Line items")
+    def line_items(self, order):
+        return ", ".join(f"{item.quantity} x {item.product}" for item in order.lineitem_set.all())
+
 
-# Register your models here.
+@admin.register(LineItem)
+class LineItemAdmin(KeysetAdmin):
+    list_display = ("id", "order", "product", "quantity")
+    list_select_related = ("order", "product")
+    autocomplete_fields = ("order", "product")
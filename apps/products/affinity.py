@@ -0,0 +1,199 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .archive import sources
+from .models import LineItem, ProductCooccurrence, ProductNeighbour, Watermark
+
+AFFINITY_WATERMARK = "product_affinity"
+# orders holding at least one line item counted so far
+AFFINITY_ORDERS = "product_affinity_orders"
+
+# a pair of product ids packed into one int64 key, `product << 32 | other`
+KEY_SHIFT = 32
+
+
+def numpy():
+    try:
+        # imported here, it would add tens of milliseconds to every process start
+        import numpy
+    except ImportError:
+        raise RuntimeError("Product affinities require numpy.")
+    return numpy
+
+
+def count_pairs(order_ids, product_ids):
+    """
+    Co-occurrences of the `(order_id, product_id)` line item columns, as
+    sorted pair keys, their counts and the number of orders. Each order
+    counts once per pair of products, the diagonal once per product,
+    however many lines or units it holds.
+    """
+    np = numpy()
+    order_ids = np.asarray(order_ids, dtype=np.int64)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    # sorted by order then product, repeated lines of a product dropped
+    by_order = np.lexsort((product_ids, order_ids))
+    order_ids, product_ids = order_ids[by_order], product_ids[by_order]
+    repeated = np.zeros(len(order_ids), dtype=bool)
+    repeated[1:] = (order_ids[1:] == order_ids[:-1]) & (product_ids[1:] == product_ids[:-1])
+    order_ids, product_ids = order_ids[~repeated], product_ids[~repeated]
+
+    starts = np.flatnonzero(np.diff(order_ids, prepend=-1))
+    sizes = np.diff(np.append(starts, len(order_ids)))
+    # every line pairs with itself and with the lines after it in its order
+    partners = np.repeat(starts + sizes, sizes) - np.arange(len(order_ids))
+    left = np.repeat(np.arange(len(order_ids)), partners)
+    right = left + np.arange(len(left)) - np.repeat(np.cumsum(partners) - partners, partners)
+    keys, counts = np.unique((product_ids[left] << KEY_SHIFT) | product_ids[right], return_counts=True)
+    return keys, counts, len(starts)
+
+
+def merge_counts(*parts):
+    """Add up `(keys, counts)` pairs into one with sorted, unique keys."""
+    np = numpy()
+    keys = np.concatenate([keys for keys, _ in parts])
+    keys, positions = np.unique(keys, return_inverse=True)
+    counts = np.bincount(positions, weights=np.concatenate([counts for _, counts in parts]), minlength=len(keys))
+    return keys, counts.astype(np.int64)
+
+
+def stream_counts(line_item_models, after_order_id=0, until_order_id=None, chunk_size=50000):
+    """
+    Count the line items of orders in `(after_order_id, until_order_id]`,
+    reading windows of `chunk_size` order ids from the `(order, product)`
+    index so no order is split between two chunks.
+    """
+    np = numpy()
+    totals = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    orders = 0
+    for model in line_item_models:
+        line_items = model.objects.filter(order_id__gt=after_order_id)
+        if until_order_id is not None:
+            line_items = line_items.filter(order_id__lte=until_order_id)
+        last_id = line_items.aggregate(last_id=Max("order_id"))["last_id"]
+        start = after_order_id
+        while last_id is not None and start < last_id:
+            rows = line_items.filter(order_id__gt=start, order_id__lte=start + chunk_size).order_by().values_list("order_id", "product_id")
+            columns = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+            if len(columns):
+                keys, counts, chunk_orders = count_pairs(columns[:, 0], columns[:, 1])
+                totals = merge_counts(totals, (keys, counts))
+                orders += chunk_orders
+            start += chunk_size
+    return totals, orders
+
+
+def rank_neighbours(keys, counts, orders, top_k, min_orders):
+    """
+    The `top_k` neighbours of every product by lift, how much more often the
+    pair shares an order than if they were bought independently: `orders *
+    pair orders / (product orders * other orders)`. Pairs seen in fewer than
+    `min_orders` orders are left out. Returns `(product, neighbour, rank,
+    pair orders, lift)` columns.
+    """
+    np = numpy()
+    products, others = keys >> KEY_SHIFT, keys & ((1 << KEY_SHIFT) - 1)
+    diagonal = products == others
+    product_ids, product_orders = products[diagonal], counts[diagonal]
+    pairs = ~diagonal & (counts >= min_orders)
+    products, others, counts = products[pairs], others[pairs], counts[pairs]
+    lift = counts * orders / (product_orders[np.searchsorted(product_ids, products)] * product_orders[np.searchsorted(product_ids, others)])
+
+    # both directions of each pair, then best first within each product
+    products, others = np.concatenate([products, others]), np.concatenate([others, products])
+    counts, lift = np.concatenate([counts, counts]), np.concatenate([lift, lift])
+    best_first = np.lexsort((others, -counts, -lift, products))
+    products, others, counts, lift = products[best_first], others[best_first], counts[best_first], lift[best_first]
+    starts = np.flatnonzero(np.diff(products, prepend=-1))
+    ranks = np.arange(len(products)) - np.repeat(starts, np.diff(np.append(starts, len(products))))
+    top = ranks < top_k
+    return products[top], others[top], ranks[top], counts[top], lift[top]
+
+
+def unpack(key):
+    return int(key >> KEY_SHIFT), int(key & ((1 << KEY_SHIFT) - 1))
+
+
+def stored_counts():
+    """The saved co-occurrences as sorted keys, counts and row ids."""
+    np = numpy()
+    rows = ProductCooccurrence.objects.values_list("product_id", "other_id", "orders", "id").iterator(chunk_size=50000)
+    rows = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+    keys = (rows[:, 0] << KEY_SHIFT) | rows[:, 1]
+    by_key = np.argsort(keys)
+    return keys[by_key], rows[by_key, 2], rows[by_key, 3]
+
+
+def save_counts(keys, counts, stored_keys, stored_ids):
+    """Update the saved rows of `keys` with `counts` and insert the others."""
+    np = numpy()
+    positions = np.searchsorted(stored_keys, keys)
+    found = np.zeros(len(keys), dtype=bool)
+    inside = positions < len(stored_keys)
+    found[inside] = stored_keys[positions[inside]] == keys[inside]
+    rows = []
+    for key, count, was_found, position in zip(keys, counts, found, positions):
+        product_id, other_id = unpack(key)
+        rows.append(
+            ProductCooccurrence(id=int(stored_ids[position]) if was_found else None, product_id=product_id, other_id=other_id, orders=int(count))
+        )
+    ProductCooccurrence.objects.bulk_update([row for row in rows if row.id], ["orders"], batch_size=1000)
+    ProductCooccurrence.objects.bulk_create([row for row in rows if not row.id], batch_size=5000)
+
+
+def build_product_affinity(full=False, top_k=None, min_orders=None, chunk_size=50000):
+    """
+    Count the products bought together in orders added since the previous
+    run, or in every hot and archived order with `full` or on the first run,
+    then rewrite the top neighbours of every product. Only the new line
+    items are read on an incremental run, the saved counts are added to.
+    Raises RuntimeError when another run saved its counts in the meantime.
+    Returns `(orders counted, neighbours saved)`.
+    """
+    np = numpy()
+    top_k = top_k or settings.PRODUCT_AFFINITY_TOP_K
+    min_orders = min_orders or settings.PRODUCT_AFFINITY_MIN_ORDERS
+    watermark, _ = Watermark.objects.get_or_create(name=AFFINITY_WATERMARK)
+    counted, _ = Watermark.objects.get_or_create(name=AFFINITY_ORDERS)
+    started_at = watermark.value
+    # nothing to add to yet, archived orders are only read by a full count
+    full = full or not started_at or not ProductCooccurrence.objects.exists()
+
+    if full:
+        models = [line_items for _, line_items in sources(include_archive=True)]
+        after_id = 0
+        stored_keys, stored_ids = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    else:
+        # orders are added to the hot table only
+        models = [LineItem]
+        after_id = started_at
+        stored_keys, stored_totals, stored_ids = stored_counts()
+    # orders written while this runs are left to the next one
+    last_id = max(model.objects.aggregate(last_id=Max("order_id"))["last_id"] or 0 for model in models)
+    (new_keys, new_counts), orders = stream_counts(models, after_order_id=after_id, until_order_id=last_id, chunk_size=chunk_size)
+    total_orders = orders if full else counted.value + orders
+    keys, counts = (new_keys, new_counts) if full else merge_counts((stored_keys, stored_totals), (new_keys, new_counts))
+
+    products, neighbours, ranks, pair_orders, lift = rank_neighbours(keys, counts, total_orders, top_k, min_orders)
+    with transaction.atomic():
+        # moving the watermark first takes the write lock, a concurrent run that counted the same orders finds it moved
+        moved = Watermark.objects.filter(name=AFFINITY_WATERMARK, value=started_at).update(value=max(started_at, last_id))
+        if not moved:
+            raise RuntimeError("Another product affinity run saved its counts first, run it again.")
+        if full:
+            ProductCooccurrence.objects.all().delete()
+        # only the pairs of the new orders changed
+        changed = np.isin(keys, new_keys)
+        save_counts(keys[changed], counts[changed], stored_keys, stored_ids)
+        ProductNeighbour.objects.all().delete()
+        ProductNeighbour.objects.bulk_create(
+            [
+                ProductNeighbour(product_id=int(product), neighbour_id=int(neighbour), rank=int(rank), orders=int(count), lift=float(value))
+                for product, neighbour, rank, count, value in zip(products, neighbours, ranks, pair_orders, lift)
+            ],
+            batch_size=5000,
+        )
+        counted.value = total_orders
+        counted.save(update_fields=["value"])
+    return orders, len(products)
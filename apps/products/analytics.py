@@ -0,0 +1,241 @@
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from utils.db import atomic_snapshot
+
+from .affinity import numpy
+from .archive import sources
+from .models import Product
+
+# one row per order, sorted by customer then order date
+SNAPSHOT_COLUMNS = ("customer", "day", "amount")
+
+# the file naming the snapshot version to read, replaced atomically
+CURRENT = "CURRENT"
+
+# customers younger than this are valued over this many days, not their first few
+MIN_TENURE_DAYS = 30
+
+
+def read_columns(chunk_size=50000):
+    """
+    The customer, date and line item total of every hot and archived order,
+    read in windows of `chunk_size` order ids as NumPy columns.
+    """
+    np = numpy()
+    # one snapshot of both tables, an archive run in between would move orders past the windows
+    with atomic_snapshot():
+        products = np.array(list(Product.objects.order_by("id").values_list("id", "price")), dtype=np.int64).reshape(-1, 2)
+        product_ids, prices = products[:, 0], products[:, 1]
+        parts = []
+        for orders, line_items in sources(include_archive=True):
+            last_id = 0
+            while True:
+                rows = list(orders.objects.filter(id__gt=last_id).order_by("id").values_list("id", "customer_id", "order_date")[:chunk_size])
+                if not rows:
+                    break
+                ids, customers, days = zip(*rows)
+                ids = np.array(ids, dtype=np.int64)
+                lines = (
+                    line_items.objects.filter(order_id__gt=last_id, order_id__lte=ids[-1])
+                    .order_by()
+                    .values_list("order_id", "product_id", "quantity")
+                )
+                lines = np.array(list(lines), dtype=np.int64).reshape(-1, 3)
+                amounts = lines[:, 2] * prices[np.searchsorted(product_ids, lines[:, 1])]
+                parts.append(
+                    (
+                        np.array(customers, dtype=np.int64),
+                        np.array(days, dtype="datetime64[D]"),
+                        np.bincount(np.searchsorted(ids, lines[:, 0]), weights=amounts, minlength=len(ids)).astype(np.int64),
+                    )
+                )
+                last_id = int(ids[-1])
+    if not parts:
+        return {"customer": np.zeros(0, dtype=np.int64), "day": np.zeros(0, dtype="datetime64[D]"), "amount": np.zeros(0, dtype=np.int64)}
+    customer, day, amount = (np.concatenate(column) for column in zip(*parts))
+    by_customer = np.lexsort((day, customer))
+    return {"customer": customer[by_customer], "day": day[by_customer], "amount": amount[by_customer]}
+
+
+def write_snapshot(columns, directory=None, as_of=None):
+    """
+    Save `columns` as `.npy` files in a new version directory, then point
+    CURRENT at it. Versions before the previous one are removed, processes
+    that mapped them keep reading their pages until they reload.
+    """
+    np = numpy()
+    directory = Path(directory or settings.ANALYTICS_SNAPSHOT_DIR)
+    version = str(time.time_ns())
+    path = directory / version
+    path.mkdir(parents=True)
+    for name in SNAPSHOT_COLUMNS:
+        np.save(path / f"{name}.npy", columns[name])
+    meta = {"as_of": str(as_of or timezone.now().date()), "orders": len(columns["customer"]), "customers": len(np.unique(columns["customer"]))}
+    (path / "meta.json").write_text(json.dumps(meta))
+    pointer = directory / f"{CURRENT}.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, directory / CURRENT)
+    # the previous version stays for readers that read CURRENT just before it moved
+    versions = sorted((path for path in directory.iterdir() if path.is_dir()), key=lambda path: int(path.name))
+    for old in versions[:-2]:
+        shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+
+def refresh_snapshot(chunk_size=50000, directory=None):
+    """Rebuild the customer snapshot from the database, returns its meta data."""
+    return write_snapshot(read_columns(chunk_size), directory)
+
+
+class Snapshot:
+    """
+    The columns of one snapshot version, memory mapped read only so worker
+    processes share the pages of the OS cache instead of each holding a copy.
+    """
+
+    def __init__(self, path):
+        np = numpy()
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.as_of = np.datetime64(self.meta["as_of"], "D")
+        for name in SNAPSHOT_COLUMNS:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+        self.results = {}
+
+    def cached(self, key, compute):
+        # snapshots never change, their results can be kept with them
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+
+class SnapshotCache:
+    """Process local snapshot, reloaded when CURRENT names another version."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def get(self):
+        """The current snapshot, None until one is written."""
+        directory = Path(self.directory or settings.ANALYTICS_SNAPSHOT_DIR)
+        try:
+            version = (directory / CURRENT).read_text()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if self.snapshot is None or self.snapshot.path != directory / version:
+                self.snapshot = Snapshot(directory / version)
+            return self.snapshot
+
+
+snapshots = SnapshotCache()
+
+
+def quintiles(values):
+    """Scores 1 to 5 by quintile, a value only scores above the edges it exceeds."""
+    np = numpy()
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    edges = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+    return 1 + np.searchsorted(edges, values, side="left")
+
+
+def group_starts(customer):
+    np = numpy()
+    starts = np.flatnonzero(np.diff(customer, prepend=-1))
+    return starts, np.diff(np.append(starts, len(customer)))
+
+
+def customer_metrics(snapshot, as_of=None):
+    """
+    Recency in days, frequency and monetary value of every customer with an
+    order, their RFM quintile scores and a lifetime value projecting their
+    yearly spend so far over `ANALYTICS_CLV_YEARS`. Returns columns by name,
+    sorted by customer id.
+    """
+    np = numpy()
+    as_of = np.datetime64(as_of, "D") if as_of else snapshot.as_of
+    starts, orders = group_starts(snapshot.customer)
+    ends = starts + orders - 1
+    recency = (as_of - snapshot.day[ends]).astype(np.int64)
+    tenure = np.maximum((as_of - snapshot.day[starts]).astype(np.int64), MIN_TENURE_DAYS)
+    monetary = np.add.reduceat(snapshot.amount, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+    return {
+        "customer": np.asarray(snapshot.customer[starts]),
+        "first_order": np.asarray(snapshot.day[starts]),
+        "recency": recency,
+        "frequency": orders,
+        "monetary": monetary,
+        "r": quintiles(-recency),
+        "f": quintiles(orders),
+        "m": quintiles(monetary),
+        "clv": monetary * 365.25 / tenure * settings.ANALYTICS_CLV_YEARS,
+    }
+
+
+def rfm_segments(metrics):
+    """Customers, revenue and mean lifetime value per `(r, f, m)` score, best first."""
+    np = numpy()
+    codes, positions, customers = np.unique(metrics["r"] * 100 + metrics["f"] * 10 + metrics["m"], return_inverse=True, return_counts=True)
+    revenue = np.bincount(positions, weights=metrics["monetary"], minlength=len(codes))
+    clv = np.bincount(positions, weights=metrics["clv"], minlength=len(codes))
+    return [
+        {"r": int(code // 100), "f": int(code // 10 % 10), "m": int(code % 10), "customers": int(count), "revenue": int(total), "clv": value / count}
+        for code, count, total, value in zip(codes[::-1], customers[::-1], revenue[::-1], clv[::-1])
+    ]
+
+
+def customer_row(metrics, customer_id):
+    """The metrics of one customer, None when they have no orders."""
+    np = numpy()
+    position = np.searchsorted(metrics["customer"], customer_id)
+    if position == len(metrics["customer"]) or metrics["customer"][position] != customer_id:
+        return None
+    row = {name: column[position].item() for name, column in metrics.items()}
+    row["first_order"] = str(metrics["first_order"][position])
+    return row
+
+
+def cohort_retention(snapshot, months=12, as_of=None):
+    """
+    Customers grouped by the month of their first order, with the share of
+    them ordering in each of their first `months` months and the cumulative
+    revenue per cohort customer by then. Months after `as_of` are left out.
+    """
+    np = numpy()
+    as_of = np.datetime64(as_of, "D") if as_of else snapshot.as_of
+    starts, orders = group_starts(snapshot.customer)
+    order_month = snapshot.day.astype("datetime64[M]")
+    first_month = order_month[starts]
+    offset = (order_month - np.repeat(first_month, orders)).astype(np.int64)
+    cohorts, cohort_of, customers = np.unique(first_month, return_inverse=True, return_counts=True)
+    order_cohort = np.repeat(cohort_of, orders)
+    within = offset < months
+    cells = len(cohorts) * months
+
+    # a customer is active once per month however many orders they placed
+    active = np.unique(np.repeat(np.arange(len(starts)), orders)[within] * months + offset[within])
+    active = np.bincount(cohort_of[active // months] * months + active % months, minlength=cells).reshape(-1, months)
+    revenue = np.bincount(order_cohort[within] * months + offset[within], weights=snapshot.amount[within], minlength=cells).reshape(-1, months)
+    value = np.cumsum(revenue, axis=1) / customers[:, None]
+    retention = active / customers[:, None]
+    elapsed = np.minimum((as_of.astype("datetime64[M]") - cohorts).astype(np.int64) + 1, months)
+    return [
+        {
+            "cohort": str(cohort),
+            "customers": int(count),
+            "retention": retention[index, :length].round(4).tolist(),
+            "value": value[index, :length].round(2).tolist(),
+        }
+        for index, (cohort, count, length) in enumerate(zip(cohorts, customers, elapsed))
+    ]
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def generation_key(prefix):
+    return f"{prefix}:generation"
+
+
+def invalidate(prefix):
+    # a new generation orphans every cached page at once, the backend expires them
+    cache.set(generation_key(prefix), time.time_ns(), None)
+
+
+def make_etag(data):
+    payload = json.dumps(data, sort_keys=True, default=str).encode()
+    return f'"{hashlib.md5(payload).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class CachedResponseMixin:
+    """
+    Cache `list` and `retrieve` payloads and answer `If-None-Match` with a 304.
+    Cached entries are versioned by a generation number which `invalidate()`
+    bumps, so a write drops every cached page and detail of the resource.
+    """
+
+    cache_prefix = None
+
+    def get_cache_key(self, request):
+        generation = cache.get_or_set(generation_key(self.cache_prefix), time.time_ns, None)
+        query = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.lists()))
+        return f"{self.cache_prefix}:{generation}:{request.accepted_renderer.format}:{request.path}?{query}"
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = {"etag": make_etag(response.data), "data": response.data}
+            cache.set(key, entry, settings.API_CACHE_TIMEOUT)
+
+        headers = {"ETag": entry["etag"]}
+        if etag_matches(request, entry["etag"]):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(entry["data"], headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
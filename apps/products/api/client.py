@@ -0,0 +1,46 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+
+# one pooled client per event loop: under ASGI that is a single client for the
+# whole process, while loops created per call (WSGI, tests) never share sockets
+# and close their client when they finish
+_clients = weakref.WeakKeyDictionary()
+
+
+async def close_with_loop(client):
+    # asyncio.run and asgiref finalise the async generators of a loop before closing it
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_http_client():
+    # imported on first use, only the upstream views need it and it is slow to import
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client, _ = _clients.get(loop, (None, None))
+    if client is None or client.is_closed:
+        config = settings.UPSTREAM_HTTP_CLIENT
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config["TIMEOUT"]),
+            limits=httpx.Limits(
+                max_connections=config["MAX_CONNECTIONS"],
+                max_keepalive_connections=config["MAX_KEEPALIVE_CONNECTIONS"],
+                keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+            ),
+        )
+        # the loop only holds its async generators weakly
+        lifetime = close_with_loop(client)
+        _clients[loop] = (client, lifetime)
+        await lifetime.__anext__()
+    return client
+
+
+async def close_http_client():
+    _, lifetime = _clients.pop(asyncio.get_running_loop(), (None, None))
+    if lifetime is not None:
+        await lifetime.aclose()
@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from products.models import Customer
 from rest_framework import serializers
 
 User = get_user_model()
@@ -7,4 +9,61 @@ User = get_user_model()
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = "__all__"
+        fields = ["id", "username", "email", "first_name", "last_name", "date_joined", "password"]
+        extra_kwargs = {"password": {"write_only": True}}
+
+    def validate_password(self, value):
+        # stored hashed on create and update, like User.set_password
+        return make_password(value)
+
+
+class CustomerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Customer
+        fields = ["id", "first_name", "last_name", "email", "address", "city", "postcode"]
+
+
+class CustomerSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, min_length=3)
+    email = serializers.CharField(required=False)
+    city = serializers.CharField(required=False)
+    postcode = serializers.CharField(required=False)
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate(self, data):
+        if not data.keys() & {"q", "email", "city", "postcode"}:
+            raise serializers.ValidationError("Search by q, email, city or postcode.")
+        return data
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    period = serializers.ChoiceField(choices=["day", "week"], default="day")
+    by = serializers.ChoiceField(choices=["units", "revenue"], default="revenue")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class CustomerAnalyticsQuerySerializer(serializers.Serializer):
+    customer = serializers.IntegerField(min_value=1, required=False)
+    months = serializers.IntegerField(min_value=1, max_value=60, default=12)
+
+
+class LineItemIngestSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class OrderIngestSerializer(serializers.Serializer):
+    customer = serializers.IntegerField(min_value=1)
+    order_date = serializers.DateField()
+    shipped_date = serializers.DateField(required=False, allow_null=True)
+    delivered_date = serializers.DateField(required=False, allow_null=True)
+    coupon_code = serializers.CharField(max_length=50, required=False, allow_null=True, allow_blank=True)
+    line_items = LineItemIngestSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        if data.get("delivered_date") and not data.get("shipped_date"):
+            raise serializers.ValidationError({"delivered_date": ["An order can't be delivered before it is shipped."]})
+        return data
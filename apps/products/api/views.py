@@ -1,43 +1,300 @@
 import asyncio
-import concurrent.futures
+from urllib.parse import urlencode
 
-import requests
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import F, Sum
+from django.db.models.functions import TruncWeek
+from django.http import JsonResponse
+from products.analytics import (
+    cohort_retention,
+    customer_metrics,
+    customer_row,
+    rfm_segments,
+    snapshots,
+)
+from products.catalog import catalog
+from products.fulfilment import queue_stats
+from products.ingest import create_orders, validate_orders
+from products.models import DailyCouponSales, DailyProductSales, ProductNeighbour
+from products.search import search_customers
+from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.views import APIView
+from rest_framework.viewsets import ModelViewSet, ViewSet
 
-from .serializers import UserSerializer
+from .caching import CachedResponseMixin
+from .client import get_http_client
+from .parsers import NDJSONParser
+from .serializers import (
+    CustomerAnalyticsQuerySerializer,
+    CustomerSearchSerializer,
+    CustomerSerializer,
+    OrderIngestSerializer,
+    SalesQuerySerializer,
+    UserSerializer,
+)
 
 User = get_user_model()
 
 
 async def fetch_ip():
-    await asyncio.sleep(3)
-    return "123.42.941"
+    client = await get_http_client()
+    response = await client.get(settings.UPSTREAM_IP_URL)
+    response.raise_for_status()
+    return response.json()["origin"]
 
 
-def fetch_headers():
-    response = requests.get("http://httpbin.org/headers")
-    print(response.status_code)
+async def fetch_headers():
+    client = await get_http_client()
+    response = await client.get(settings.UPSTREAM_HEADERS_URL)
+    response.raise_for_status()
     return response.json()
 
 
-class UserViewSet(ModelViewSet):
+def upstream_error(exc):
+    import httpx
+
+    if isinstance(exc, httpx.TimeoutException):
+        return JsonResponse({"detail": "Upstream timed out"}, status=504)
+    return JsonResponse({"detail": "Upstream request failed"}, status=502)
+
+
+async def user_ip(request):
+    import httpx
+
+    try:
+        ip = await fetch_ip()
+    except httpx.HTTPError as exc:
+        return upstream_error(exc)
+    return JsonResponse({"result": ip})
+
+
+async def user_headers(request):
+    import httpx
+
+    try:
+        await asyncio.gather(*(fetch_headers() for _ in range(2)))
+    except httpx.HTTPError as exc:
+        return upstream_error(exc)
+    return JsonResponse({"result": "ok"})
+
+
+class UserViewSet(CachedResponseMixin, ModelViewSet):
     serializer_class = UserSerializer
-    queryset = User.objects.all()
+    queryset = User.objects.order_by("id")
+    cache_prefix = "users"
+
+
+class SalesAnalyticsViewSet(ViewSet):
+    """
+    Read-only sales reports served from the daily rollup tables, which are
+    kept up to date by the `refresh_sales_rollups` command.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get_query(self, request):
+        serializer = SalesQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def filter_days(self, queryset, query):
+        if "start" in query:
+            queryset = queryset.filter(day__gte=query["start"])
+        if "end" in query:
+            queryset = queryset.filter(day__lte=query["end"])
+        return queryset
+
+    @action(detail=False, methods=["get"])
+    def revenue(self, request):
+        query = self.get_query(request)
+        period = TruncWeek("day") if query["period"] == "week" else F("day")
+        rows = (
+            self.filter_days(DailyCouponSales.objects.all(), query)
+            .values(period=period)
+            .annotate(orders=Sum("orders"), units=Sum("units"), revenue=Sum("revenue"))
+            .order_by("period")
+        )
+        return Response(list(rows))
+
+    @action(detail=False, methods=["get"], url_path="top-products")
+    def top_products(self, request):
+        query = self.get_query(request)
+        rows = list(
+            self.filter_days(DailyProductSales.objects.all(), query)
+            .values("product_id")
+            .annotate(units=Sum("units"), revenue=Sum("revenue"))
+            .order_by(f"-{query['by']}", "product_id")[: query["limit"]]
+        )
+        products = catalog.get_many(row["product_id"] for row in rows)
+        for row in rows:
+            product = products.get(row["product_id"])
+            row["name"] = product.name if product else None
+        return Response(rows)
+
+    @action(detail=False, methods=["get"])
+    def coupons(self, request):
+        query = self.get_query(request)
+        rows = (
+            self.filter_days(DailyCouponSales.objects.all(), query)
+            .values("coupon_code")
+            .annotate(orders=Sum("orders"), units=Sum("units"), revenue=Sum("revenue"))
+            .order_by("coupon_code")
+        )
+
+        results = []
+        baseline = None
+        for row in rows:
+            row["average_order_value"] = row["revenue"] / row["orders"] if row["orders"] else 0
+            if not row["coupon_code"]:
+                baseline = row["average_order_value"]
+            results.append(row)
+        # uplift of the average order value against orders without a coupon
+        for row in results:
+            row["uplift"] = row["average_order_value"] / baseline - 1 if baseline else None
+        return Response(results)
+
+
+class CustomerAnalyticsViewSet(ViewSet):
+    """
+    Read-only customer RFM scores, lifetime values and monthly cohorts
+    computed from the order snapshot of the `customer_analytics` command.
+    Results are kept with the snapshot until the next refresh.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get_query(self, request):
+        serializer = CustomerAnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_snapshot(self):
+        snapshot = snapshots.get()
+        if snapshot is None:
+            return None, Response({"detail": "The customer snapshot hasn't been built yet."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return snapshot, None
 
     @action(detail=False, methods=["get"])
-    def ip(self, request):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        ip = loop.run_until_complete(fetch_ip())
-        return Response({"result": ip})
+    def rfm(self, request):
+        query = self.get_query(request)
+        snapshot, error = self.get_snapshot()
+        if error:
+            return error
+        metrics = snapshot.cached("metrics", lambda: customer_metrics(snapshot))
+        if "customer" in query:
+            row = customer_row(metrics, query["customer"])
+            if row is None:
+                return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"as_of": str(snapshot.as_of), **row})
+        segments = snapshot.cached("segments", lambda: rfm_segments(metrics))
+        return Response({"as_of": str(snapshot.as_of), "results": segments})
 
     @action(detail=False, methods=["get"])
-    def headers(self, request):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(fetch_headers) for _ in range(2)]
-            for future in concurrent.futures.as_completed(futures):
-                future.result()
-        return Response({"result": "ok"})
+    def cohorts(self, request):
+        query = self.get_query(request)
+        snapshot, error = self.get_snapshot()
+        if error:
+            return error
+        cohorts = snapshot.cached(("cohorts", query["months"]), lambda: cohort_retention(snapshot, months=query["months"]))
+        return Response({"as_of": str(snapshot.as_of), "results": cohorts})
+
+
+class OrderBatchView(APIView):
+    """
+    Create a batch of orders with their line items, posted as a JSON list or
+    as NDJSON. Valid records are written with bulk inserts in one transaction
+    and invalid ones are reported by index; `?all_or_nothing=1` rejects the
+    whole batch when any record is invalid.
+    """
+
+    parser_classes = [JSONParser, NDJSONParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        records = request.data
+        if not isinstance(records, list):
+            return Response({"detail": "Expected a list of orders."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(records) > settings.ORDERS_INGEST_MAX_BATCH:
+            return Response({"detail": f"Batches are limited to {settings.ORDERS_INGEST_MAX_BATCH} orders."}, status=status.HTTP_400_BAD_REQUEST)
+
+        valid, errors = validate_orders(records, OrderIngestSerializer())
+        if errors and request.query_params.get("all_or_nothing") in ("1", "true"):
+            return Response({"created": 0, "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        orders = create_orders(valid) if valid else []
+        return Response(
+            {"created": len(orders), "ids": [order.id for order in orders], "errors": errors},
+            status=status.HTTP_201_CREATED if orders or not errors else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+class CustomerSearchView(APIView):
+    """
+    Support lookups of customers: `q` finds names containing its words,
+    falling back to typo tolerant matching, best matches first; `email`,
+    `city` and `postcode` match exactly. Paginated with `page`/`page_size`.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = CustomerSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        customers, has_next = search_customers(
+            name=query.get("q"),
+            email=query.get("email"),
+            city=query.get("city"),
+            postcode=query.get("postcode"),
+            page=query["page"],
+            page_size=query["page_size"],
+        )
+        return Response(
+            {
+                "page": query["page"],
+                "next": request.build_absolute_uri(f"?{urlencode({**request.query_params.dict(), 'page': query['page'] + 1})}") if has_next else None,
+                "results": CustomerSerializer(customers, many=True).data,
+            }
+        )
+
+
+class FulfilmentStatsView(APIView):
+    """Depth, lag and throughput of the fulfilment job queue."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(queue_stats())
+
+
+class ProductNeighboursView(APIView):
+    """
+    Products frequently bought together with a product, best first, as
+    precomputed by the `build_product_affinity` command.
+    """
+
+    def get(self, request, pk):
+        neighbours = list(ProductNeighbour.objects.filter(product_id=pk).order_by("rank").values("neighbour_id", "orders", "lift"))
+        products = catalog.get_many([pk, *(row["neighbour_id"] for row in neighbours)])
+        if pk not in products:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        results = []
+        for row in neighbours:
+            product = products.get(row["neighbour_id"])
+            if product:
+                results.append({"id": product.id, "name": product.name, "price": product.price, "orders": row["orders"], "lift": row["lift"]})
+        return Response({"product": pk, "results": results})
+
+
+class CatalogStatsView(APIView):
+    """Size and hit/miss counters of this process's product catalog."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(catalog.stats())
@@ -0,0 +1,156 @@
+import gzip
+import os
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from utils.db import atomic_write
+
+from .export import iter_chunks, iter_ndjson, write_parquet
+from .models import ArchivedLineItem, ArchivedOrder, LineItem, Order
+
+PARTITION_SUFFIXES = {"ndjson": ".ndjson.gz", "parquet": ".parquet"}
+
+
+def sources(include_archive=False):
+    """The `(orders, line items)` models to read, the hot tables first."""
+    pairs = [(Order, LineItem)]
+    if include_archive:
+        pairs.append((ArchivedOrder, ArchivedLineItem))
+    return pairs
+
+
+def union_values(models, fields, filters):
+    querysets = [model.objects.filter(**filters).values(*fields).order_by() for model in models]
+    return querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+
+
+def read_orders(*fields, include_archive=False, **filters):
+    """
+    `values()` of the orders matching `filters`, from the hot table or from
+    the hot and archive tables. Fields and filters may follow the relations
+    both tables share (customer, lineitem, lineitem__product). The union
+    can be ordered by and sliced, not filtered further.
+    """
+    return union_values([orders for orders, _ in sources(include_archive)], fields, filters)
+
+
+def read_line_items(*fields, include_archive=False, **filters):
+    """`values()` of line items, like `read_orders`."""
+    return union_values([line_items for _, line_items in sources(include_archive)], fields, filters)
+
+
+def default_cutoff(today=None):
+    return (today or date.today()) - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+
+def columns(model):
+    return ", ".join(connections[router.db_for_write(model)].ops.quote_name(field.column) for field in model._meta.concrete_fields)
+
+
+def copy_rows(cursor, source, target, key, ids):
+    cursor.execute(
+        f"INSERT INTO {target._meta.db_table} ({columns(target)}) SELECT {columns(target)} FROM {source._meta.db_table} WHERE {key} IN ({placeholders(ids)})",
+        ids,
+    )
+    return cursor.rowcount
+
+
+def placeholders(ids):
+    return ", ".join(["%s"] * len(ids))
+
+
+def archive_chunk(cutoff, chunk_size):
+    """
+    Move up to `chunk_size` orders delivered before `cutoff` and their line
+    items into the archive tables in one transaction. Returns the months
+    of the orders moved with how many, and the number of line items moved.
+    """
+    using = router.db_for_write(Order)
+    with atomic_write(using=using):
+        # oldest deliveries first, through the partial index on delivered_date
+        rows = list(
+            Order.objects.using(using).filter(delivered_date__lt=cutoff).order_by("delivered_date", "id").values_list("id", "order_date")[:chunk_size]
+        )
+        if not rows:
+            return {}, 0
+        ids = [id for id, _ in rows]
+        with connections[using].cursor() as cursor:
+            copy_rows(cursor, Order, ArchivedOrder, "id", ids)
+            line_items = copy_rows(cursor, LineItem, ArchivedLineItem, "order_id", ids)
+            # deleted in SQL, the ORM would send the line item signals that refresh one order summary per row
+            cursor.execute(f"DELETE FROM {LineItem._meta.db_table} WHERE order_id IN ({placeholders(ids)})", ids)
+        # cascades to the summaries and fulfilment jobs of the moved orders
+        Order.objects.using(using).filter(id__in=ids).delete()
+        months = Counter(order_date.replace(day=1) for _, order_date in rows)
+        transaction.on_commit(lambda: discard_partitions(months), using=using)
+    return months, line_items
+
+
+def archive_orders(cutoff=None, chunk_size=1000, max_chunks=None):
+    """
+    Move orders delivered before `cutoff` into the archive, one transaction
+    per chunk so an interrupted run loses nothing and the next run resumes
+    where it stopped. Returns `(orders, line items, months)` moved.
+    """
+    cutoff = cutoff or default_cutoff()
+    orders = line_items = chunks = 0
+    months = set()
+    while max_chunks is None or chunks < max_chunks:
+        moved, items = archive_chunk(cutoff, chunk_size)
+        if not moved:
+            break
+        orders += sum(moved.values())
+        line_items += items
+        months.update(moved)
+        chunks += 1
+    return orders, line_items, sorted(months)
+
+
+def partition_path(directory, month, format):
+    return Path(directory) / f"orders-{month:%Y-%m}{PARTITION_SUFFIXES[format]}"
+
+
+def discard_partitions(months):
+    # a partition that lacks rows archived since it was written is rewritten by the next export
+    for month in months:
+        for format in PARTITION_SUFFIXES:
+            partition_path(settings.ARCHIVE_EXPORT_DIR, month, format).unlink(missing_ok=True)
+
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def export_partitions(format="ndjson", chunk_size=5000):
+    """
+    Write one compressed file per month of archived orders that doesn't have
+    one yet: gzipped NDJSON, or zstd Parquet with pyarrow. Each partition is
+    written whole from the archive tables, so months archived over several
+    runs still end up in a single file. Returns the paths written.
+    """
+    directory = Path(settings.ARCHIVE_EXPORT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    dates = ArchivedOrder.objects.values_list("order_date", flat=True)
+    first, last = dates.order_by("order_date").first(), dates.order_by("-order_date").first()
+    written = []
+    month = first and first.replace(day=1)
+    while month and month <= last:
+        path = partition_path(directory, month, format)
+        orders = ArchivedOrder.objects.filter(order_date__gte=month, order_date__lt=next_month(month))
+        if not path.exists() and orders.exists():
+            partial = path.with_name(f".{path.name}.{os.getpid()}")
+            chunks = iter_chunks(orders, chunk_size, line_item_model=ArchivedLineItem)
+            if format == "parquet":
+                write_parquet(chunks, partial)
+            else:
+                with gzip.open(partial, "wt") as output:
+                    for data in iter_ndjson(chunks):
+                        output.write(data)
+            os.replace(partial, path)
+            written.append(path)
+        month = next_month(month)
+    return written
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+VERSION_KEY = "products:catalog:version"
+
+
+def current_version():
+    # starts from the clock so a flushed cache never repeats a version a process already loaded
+    return cache.get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def bump_version():
+    current_version()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # evicted in between
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+class ProductCatalog:
+    """
+    Process local products keyed by id and name, reloaded when the catalog
+    version in the shared cache moves (see `bump_version`). Without
+    `max_size` the whole table is loaded at once and lookups never query;
+    with it, products are loaded on demand and the least recently used ones
+    are evicted. The returned instances are shared, treat them as read only.
+    The version has to live in a cache shared by every worker, which the prod
+    profile requires; writes that must not trust a stale copy query the table.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.version = None
+        self.by_id = OrderedDict()
+        self.by_name = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def check_version(self):
+        version = current_version()
+        if version == self.version:
+            return
+        if self.max_size is None:
+            products = list(Product.objects.order_by("id"))
+            by_id = OrderedDict((product.id, product) for product in products)
+            by_name = {product.name: product.id for product in products}
+        else:
+            by_id, by_name = OrderedDict(), {}
+        with self.lock:
+            self.version, self.by_id, self.by_name = version, by_id, by_name
+            self.reloads += 1
+
+    def remember(self, products):
+        with self.lock:
+            for product in products:
+                self.by_id[product.id] = product
+                self.by_name[product.name] = product.id
+            while len(self.by_id) > self.max_size:
+                _, evicted = self.by_id.popitem(last=False)
+                self.by_name.pop(evicted.name, None)
+                self.evictions += 1
+
+    def lookup(self, product_ids):
+        found = {}
+        with self.lock:
+            for product_id in product_ids:
+                product = self.by_id.get(product_id)
+                if product is None:
+                    continue
+                found[product_id] = product
+                if self.max_size is not None:
+                    self.by_id.move_to_end(product_id)
+            self.hits += len(found)
+            self.misses += len(product_ids) - len(found)
+        return found
+
+    def get_many(self, product_ids):
+        """Map the ids that exist to their products."""
+        self.check_version()
+        product_ids = set(product_ids)
+        found = self.lookup(product_ids)
+        missing = product_ids - found.keys()
+        if missing and self.max_size is not None:
+            loaded = list(Product.objects.filter(id__in=missing))
+            self.remember(loaded)
+            found.update((product.id, product) for product in loaded)
+        return found
+
+    def get(self, product_id):
+        return self.get_many([product_id]).get(product_id)
+
+    def get_by_name(self, name):
+        self.check_version()
+        product_id = self.by_name.get(name)
+        if product_id is not None:
+            found = self.lookup([product_id])
+            if found:
+                return found[product_id]
+        else:
+            with self.lock:
+                self.misses += 1
+        if self.max_size is None:
+            return None
+        product = Product.objects.filter(name=name).first()
+        if product is not None:
+            self.remember([product])
+        return product
+
+    def stats(self):
+        with self.lock:
+            return {
+                "version": self.version,
+                "size": len(self.by_id),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+            }
+
+
+catalog = ProductCatalog(settings.PRODUCT_CATALOG_MAX_SIZE)
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from .models import LineItem, Order
+
+ORDER_FIELDS = [
+    "id",
+    "order_date",
+    "shipped_date",
+    "delivered_date",
+    "coupon_code",
+    "customer_id",
+    "customer__first_name",
+    "customer__last_name",
+    "customer__email",
+]
+LINE_ITEM_FIELDS = ["order_id", "id", "product_id", "product__name", "product__price", "quantity"]
+
+COLUMNS = [
+    "order_id",
+    "order_date",
+    "shipped_date",
+    "delivered_date",
+    "coupon_code",
+    "customer_id",
+    "customer_first_name",
+    "customer_last_name",
+    "customer_email",
+    "line_item_id",
+    "product_id",
+    "product_name",
+    "price",
+    "quantity",
+]
+
+STATUSES = {
+    "pending": {"shipped_date__isnull": True},
+    "shipped": {"shipped_date__isnull": False, "delivered_date__isnull": True},
+    "delivered": {"delivered_date__isnull": False},
+}
+
+
+def filter_orders(since=None, until=None, status=None):
+    orders = Order.objects.all()
+    if since:
+        orders = orders.filter(order_date__gte=since)
+    if until:
+        orders = orders.filter(order_date__lte=until)
+    if status:
+        orders = orders.filter(**STATUSES[status])
+    return orders
+
+
+def iter_chunks(orders, chunk_size=5000, line_item_model=LineItem):
+    """
+    Yield lists of `(order, line_items)` pairs. Orders are read through a
+    single streaming cursor (server side on Postgres) and the line items of
+    each chunk are fetched with one query, so memory only ever holds a chunk.
+    Archived orders are read with `line_item_model=ArchivedLineItem`.
+    """
+    rows = orders.order_by("id").values_list(*ORDER_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        line_items = {}
+        items = line_item_model.objects.filter(order_id__in=[row[0] for row in chunk]).order_by("order_id", "id").values_list(*LINE_ITEM_FIELDS)
+        for order_id, *item in items:
+            line_items.setdefault(order_id, []).append(item)
+        yield [(row, line_items.get(row[0], [])) for row in chunk]
+
+
+def flat_rows(chunk):
+    for order, line_items in chunk:
+        # orders without line items still get one row
+        for item in line_items or [[None] * (len(LINE_ITEM_FIELDS) - 1)]:
+            yield (*order, *item)
+
+
+def iter_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(flat_rows(chunk))
+        yield buffer.getvalue()
+
+
+def iter_ndjson(chunks):
+    order_keys = COLUMNS[:9]
+    item_keys = COLUMNS[9:]
+    for chunk in chunks:
+        lines = []
+        for order, line_items in chunk:
+            record = dict(zip(order_keys, order))
+            record["line_items"] = [dict(zip(item_keys, item)) for item in line_items]
+            lines.append(json.dumps(record, default=str))
+        yield "\n".join(lines) + "\n"
+
+
+def write_parquet(chunks, path):
+    """Write one Parquet row group per chunk, requires pyarrow."""
+    try:
+        # imported here, it would add tens of milliseconds to every process start
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet exports require pyarrow.")
+
+    schema = pyarrow.schema(
+        [
+            ("order_id", pyarrow.int64()),
+            ("order_date", pyarrow.date32()),
+            ("shipped_date", pyarrow.date32()),
+            ("delivered_date", pyarrow.date32()),
+            ("coupon_code", pyarrow.string()),
+            ("customer_id", pyarrow.int64()),
+            ("customer_first_name", pyarrow.string()),
+            ("customer_last_name", pyarrow.string()),
+            ("customer_email", pyarrow.string()),
+            ("line_item_id", pyarrow.int64()),
+            ("product_id", pyarrow.int64()),
+            ("product_name", pyarrow.string()),
+            ("price", pyarrow.int64()),
+            ("quantity", pyarrow.int64()),
+        ]
+    )
+    with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*flat_rows(chunk)))
+            writer.write_table(
+                pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+            )
+
+
+WRITERS = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+}
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
@@ -0,0 +1,144 @@
+import json
+import logging
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import router
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from utils.db import atomic_write
+
+from .models import FulfilmentJob, Order
+
+logger = logging.getLogger(__name__)
+
+# transition: (orders it applies to, date it sets)
+TRANSITIONS = {
+    "ship": ({"shipped_date__isnull": True}, "shipped_date"),
+    "deliver": ({"shipped_date__isnull": False, "delivered_date__isnull": True}, "delivered_date"),
+}
+
+
+def enqueue(order_ids, transition):
+    # the partial unique constraint drops orders that already have an open job
+    FulfilmentJob.objects.bulk_create([FulfilmentJob(order_id=order_id, transition=transition) for order_id in order_ids], ignore_conflicts=True)
+
+
+def enqueue_due(chunk_size=10000):
+    """Queue a job for every order still waiting to be shipped or delivered."""
+    for transition, (filters, _) in TRANSITIONS.items():
+        ids = Order.objects.filter(**filters).order_by("id").values_list("id", flat=True).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(ids, chunk_size))
+            if not chunk:
+                break
+            enqueue(chunk, transition)
+
+
+def claim_jobs(worker, batch_size, using=None):
+    """
+    Mark up to `batch_size` pending jobs, or jobs whose worker went silent for
+    FULFILMENT_CLAIM_TIMEOUT, as claimed by `worker`. The rows are read with
+    `FOR UPDATE SKIP LOCKED` so concurrent workers claim disjoint batches; on
+    SQLite the claim transaction holds the database write lock instead.
+    """
+    using = using or router.db_for_write(FulfilmentJob)
+    now = timezone.now()
+    claimable = Q(status=FulfilmentJob.PENDING) | Q(
+        status=FulfilmentJob.CLAIMED, claimed_at__lt=now - timedelta(seconds=settings.FULFILMENT_CLAIM_TIMEOUT)
+    )
+    jobs = FulfilmentJob.objects.using(using)
+    with atomic_write(using=using):
+        claimed = list(
+            jobs.filter(claimable)
+            .select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", "order_id", "transition", "created_at")[:batch_size]
+        )
+        jobs.filter(id__in=[job[0] for job in claimed]).update(status=FulfilmentJob.CLAIMED, worker=worker, claimed_at=now)
+    return claimed, now
+
+
+def process_batch(worker, batch_size, using=None):
+    """
+    Claim a batch and apply it with one UPDATE per transition. Jobs whose
+    order ends up with the date set are done, the rest (say delivering an
+    order that never shipped) failed. Returns None when the queue is empty.
+    """
+    using = using or router.db_for_write(FulfilmentJob)
+    claimed, claimed_at = claim_jobs(worker, batch_size, using=using)
+    if not claimed:
+        return None
+
+    by_transition = {}
+    for job_id, order_id, transition, _ in claimed:
+        by_transition.setdefault(transition, []).append((job_id, order_id))
+
+    done = []
+    failed = []
+    today = timezone.localdate()
+    orders = Order.objects.using(using)
+    with atomic_write(using=using):
+        for transition, jobs in by_transition.items():
+            filters, field = TRANSITIONS[transition]
+            order_ids = [order_id for _, order_id in jobs]
+            orders.filter(id__in=order_ids, **filters).update(**{field: today}, version=F("version") + 1)
+            applied = set(orders.filter(id__in=order_ids, **{f"{field}__isnull": False}).values_list("id", flat=True))
+            for job_id, order_id in jobs:
+                (done if order_id in applied else failed).append(job_id)
+
+        # a job reclaimed from us after a timeout is no longer ours to finish
+        mine = FulfilmentJob.objects.using(using).filter(status=FulfilmentJob.CLAIMED, worker=worker)
+        finished_at = timezone.now()
+        mine.filter(id__in=done).update(status=FulfilmentJob.DONE, finished_at=finished_at)
+        mine.filter(id__in=failed).update(status=FulfilmentJob.FAILED, finished_at=finished_at)
+
+    lags = [(claimed_at - created_at).total_seconds() for *_, created_at in claimed]
+    return {"jobs": len(claimed), "done": len(done), "failed": len(failed), "max_lag": max(lags), "mean_lag": sum(lags) / len(lags)}
+
+
+def run_worker(worker, batch_size, poll_interval=1.0, until_empty=False):
+    """
+    Process batches until the queue is empty (`until_empty`) or forever,
+    polling every `poll_interval` seconds when idle. A worker killed mid batch
+    rolls back, its claimed jobs are picked up again after the claim timeout.
+    """
+    totals = {"jobs": 0, "done": 0, "failed": 0, "batches": 0, "max_lag": 0.0}
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        stats = process_batch(worker, batch_size)
+        if stats is None:
+            if until_empty:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        elapsed = time.perf_counter() - batch_started
+        totals["batches"] += 1
+        totals["max_lag"] = max(totals["max_lag"], stats["max_lag"])
+        for key in ("jobs", "done", "failed"):
+            totals[key] += stats[key]
+        logger.info(
+            "Fulfilment batch %s",
+            json.dumps({"worker": worker, **stats, "duration": round(elapsed, 4), "throughput": round(stats["jobs"] / elapsed, 1)}),
+        )
+    totals["elapsed"] = time.perf_counter() - started
+    return totals
+
+
+def queue_stats(using=None):
+    """Depth, lag of the oldest pending job and jobs finished per second over the last minute."""
+    jobs = FulfilmentJob.objects.using(using or router.db_for_read(FulfilmentJob))
+    now = timezone.now()
+    counts = dict(jobs.values_list("status").annotate(count=Count("id")).order_by())
+    oldest = jobs.filter(status=FulfilmentJob.PENDING).order_by("id").values_list("created_at", flat=True).first()
+    finished = jobs.filter(finished_at__gte=now - timedelta(minutes=1)).count()
+    return {
+        **{status: counts.get(status, 0) for status, _ in FulfilmentJob.STATUSES},
+        "lag": (now - oldest).total_seconds() if oldest else 0.0,
+        "throughput": finished / 60,
+    }
@@ -0,0 +1,93 @@
+from django.db import connection
+from django.db.models import Max
+from rest_framework.exceptions import ValidationError
+
+from utils.db import atomic_write
+
+from .models import ArchivedOrder, Customer, LineItem, Order, Product, Watermark
+from .summaries import build_order_summaries
+
+
+def existing_ids(model, ids):
+    return set(model.objects.filter(id__in=ids).values_list("id", flat=True))
+
+
+def allocate_ids(model, count, shared=()):
+    """
+    Reserve `count` consecutive primary keys, for backends whose bulk inserts
+    can't return the new ids. The `Watermark` counter keeps the last reserved
+    id, rows created one by one can be above it, as can rows moved to the
+    `shared` tables that keep their ids. Must run inside `atomic_write`.
+    """
+    # locks the row on PostgreSQL, on SQLite atomic_write already holds the write lock
+    watermark, _ = Watermark.objects.select_for_update().get_or_create(name=f"{model._meta.db_table}_ids")
+    last = max([watermark.value] + [table.objects.aggregate(max_id=Max("id"))["max_id"] or 0 for table in (model, *shared)])
+    watermark.value = last + count
+    watermark.save(update_fields=["value"])
+    if connection.vendor == "postgresql":
+        # rows created one by one take their ids from the sequence, it must not hand out the reserved ones
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [model._meta.db_table, last + count])
+    return range(last + 1, last + count + 1)
+
+
+def validate_orders(records, serializer):
+    """
+    Validate every record and resolve all referenced customers and products
+    with one query each. Returns the valid records and the per-record errors.
+    """
+    valid = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            valid.append((index, serializer.run_validation(record)))
+        except ValidationError as exc:
+            errors.append({"index": index, "errors": exc.detail})
+
+    customers = existing_ids(Customer, {data["customer"] for _, data in valid})
+    # from the database, a worker's catalog may not have seen a product added or deleted elsewhere yet
+    products = existing_ids(Product, {item["product"] for _, data in valid for item in data["line_items"]})
+
+    resolved = []
+    for index, data in valid:
+        missing = {}
+        if data["customer"] not in customers:
+            missing["customer"] = [f"Customer {data['customer']} does not exist."]
+        unknown = sorted({item["product"] for item in data["line_items"]} - products)
+        if unknown:
+            missing["line_items"] = [f"Product {product} does not exist." for product in unknown]
+        if missing:
+            errors.append({"index": index, "errors": missing})
+        else:
+            resolved.append(data)
+    errors.sort(key=lambda error: error["index"])
+    return resolved, errors
+
+
+def create_orders(records, batch_size=1000):
+    orders = [
+        Order(
+            customer_id=data["customer"],
+            order_date=data["order_date"],
+            shipped_date=data.get("shipped_date"),
+            delivered_date=data.get("delivered_date"),
+            coupon_code=data.get("coupon_code"),
+        )
+        for data in records
+    ]
+
+    with atomic_write():
+        if not connection.features.can_return_rows_from_bulk_insert:
+            for order, pk in zip(orders, allocate_ids(Order, len(orders), shared=[ArchivedOrder])):
+                order.id = pk
+        Order.objects.bulk_create(orders, batch_size=batch_size)
+        LineItem.objects.bulk_create(
+            (
+                LineItem(order_id=order.id, product_id=item["product"], quantity=item["quantity"])
+                for order, data in zip(orders, records)
+                for item in data["line_items"]
+            ),
+            batch_size=batch_size,
+        )
+        build_order_summaries([order.id for order in orders])
+    return orders
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from products.archive import (
+    PARTITION_SUFFIXES,
+    archive_orders,
+    default_cutoff,
+    export_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = "Move delivered orders and their line items into the archive tables, then optionally export archived months"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before", type=parse_date, default=None, help="Archive orders delivered before this date (YYYY-MM-DD), default ARCHIVE_AFTER_DAYS ago"
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Orders per transaction")
+        parser.add_argument("--max-chunks", type=int, default=None, help="Stop after this many chunks, the next run resumes")
+        parser.add_argument("--export", action="store_true", help="Write the archived months missing from ARCHIVE_EXPORT_DIR")
+        parser.add_argument("--format", choices=list(PARTITION_SUFFIXES), default="ndjson")
+
+    def handle(self, *args, **options):
+        cutoff = options["before"] or default_cutoff()
+        started = time.perf_counter()
+        orders, line_items, _ = archive_orders(cutoff, chunk_size=options["chunk_size"], max_chunks=options["max_chunks"])
+        elapsed = time.perf_counter() - started
+        rate = orders / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {orders} orders and {line_items} line items delivered before {cutoff} in {elapsed:.2f}s ({rate:,.0f} orders/s)"
+            )
+        )
+
+        if options["export"]:
+            try:
+                written = export_partitions(format=options["format"])
+            except RuntimeError as exc:
+                raise CommandError(exc)
+            self.stdout.write(self.style.SUCCESS(f"Exported {len(written)} monthly partitions"))
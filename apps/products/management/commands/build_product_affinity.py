@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products.affinity import build_product_affinity
+
+
+class Command(BaseCommand):
+    help = "Count the products bought together in orders and save the top neighbours of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recount every hot and archived order instead of the new ones")
+        parser.add_argument("--top-k", type=int, default=None, help="Neighbours kept per product, default PRODUCT_AFFINITY_TOP_K")
+        parser.add_argument("--min-orders", type=int, default=None, help="Orders a pair needs, default PRODUCT_AFFINITY_MIN_ORDERS")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Order ids per query")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            orders, neighbours = build_product_affinity(
+                full=options["full"], top_k=options["top_k"], min_orders=options["min_orders"], chunk_size=options["chunk_size"]
+            )
+        except RuntimeError as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+        rate = orders / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Counted {orders} orders and saved {neighbours} neighbours in {elapsed:.2f}s ({rate:,.0f} orders/s)"))
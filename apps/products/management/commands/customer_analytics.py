@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products.analytics import (
+    cohort_retention,
+    customer_metrics,
+    refresh_snapshot,
+    rfm_segments,
+    snapshots,
+)
+
+
+class Command(BaseCommand):
+    help = "Refresh the customer order snapshot and print RFM segments and monthly cohort retention from it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--refresh", action="store_true", help="Rebuild the snapshot from the hot and archived orders first")
+        parser.add_argument(
+            "--report", choices=["rfm", "cohorts"], action="append", help="Reports to print (default: none with --refresh, else both)"
+        )
+        parser.add_argument("--months", type=int, default=12, help="Months after their first order each cohort is followed")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Orders per query")
+
+    def handle(self, *args, **options):
+        try:
+            if options["refresh"]:
+                started = time.perf_counter()
+                meta = refresh_snapshot(chunk_size=options["chunk_size"])
+                elapsed = time.perf_counter() - started
+                rate = meta["orders"] / elapsed if elapsed else 0
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Snapshot of {meta['orders']} orders by {meta['customers']} customers written in {elapsed:.2f}s ({rate:,.0f} orders/s)"
+                    )
+                )
+            snapshot = snapshots.get()
+        except RuntimeError as exc:
+            raise CommandError(exc)
+        if snapshot is None:
+            raise CommandError("No customer snapshot yet, run with --refresh.")
+
+        reports = options["report"] or ([] if options["refresh"] else ["rfm", "cohorts"])
+        if "rfm" in reports:
+            self.stdout.write(f"RFM segments as of {snapshot.as_of}")
+            self.stdout.write(f"{'R':>2} {'F':>2} {'M':>2} {'customers':>10} {'revenue':>14} {'clv':>12}")
+            for row in rfm_segments(customer_metrics(snapshot)):
+                self.stdout.write(f"{row['r']:>2} {row['f']:>2} {row['m']:>2} {row['customers']:>10} {row['revenue']:>14} {row['clv']:>12.2f}")
+        if "cohorts" in reports:
+            self.stdout.write(f"Monthly cohort retention as of {snapshot.as_of}")
+            for row in cohort_retention(snapshot, months=options["months"]):
+                retention = " ".join(f"{share:>4.0%}" for share in row["retention"])
+                self.stdout.write(f"{row['cohort']} {row['customers']:>8} {retention}")
@@ -0,0 +1,56 @@
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from products.export import STATUSES, WRITERS, filter_orders, iter_chunks, write_parquet
+
+
+class CountingChunks:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.orders = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.orders += len(chunk)
+            yield chunk
+
+
+class Command(BaseCommand):
+    help = "Stream orders joined to their customer, line items and products as CSV, NDJSON or Parquet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=[*WRITERS, "parquet"], default="csv")
+        parser.add_argument("--output", default="-", help="File to write to, '-' for stdout")
+        parser.add_argument("--since", type=parse_date, default=None, help="First order date (YYYY-MM-DD)")
+        parser.add_argument("--until", type=parse_date, default=None, help="Last order date (YYYY-MM-DD)")
+        parser.add_argument("--status", choices=list(STATUSES), default=None)
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Orders per round trip")
+
+    def handle(self, *args, **options):
+        orders = filter_orders(options["since"], options["until"], options["status"])
+        chunks = CountingChunks(iter_chunks(orders, options["chunk_size"]))
+        output = options["output"]
+
+        started = time.perf_counter()
+        if options["format"] == "parquet":
+            if output == "-":
+                raise CommandError("Parquet exports need an --output file.")
+            try:
+                write_parquet(chunks, output)
+            except RuntimeError as exc:
+                raise CommandError(exc)
+        else:
+            with ExitStack() as stack:
+                if output == "-":
+                    write = partial(self.stdout.write, ending="")
+                else:
+                    write = stack.enter_context(open(output, "w", newline="")).write
+                for data in WRITERS[options["format"]](chunks):
+                    write(data)
+
+        elapsed = time.perf_counter() - started
+        rate = chunks.orders / elapsed if elapsed else 0
+        self.stderr.write(f"Exported {chunks.orders} orders in {elapsed:.2f}s ({rate:,.0f} orders/s)")
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Customer
+from products.purge import count_purge, purge_customers
+
+
+def format_counts(counts):
+    return ", ".join(f"{count} {label}" for label, count in sorted(counts.items()))
+
+
+class Command(BaseCommand):
+    help = "Delete customers with their orders, line items and archived orders through set based deletes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*", type=int, help="Customer ids")
+        parser.add_argument("--ids-file", default=None, help="File of customer ids, one per line")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Customers per transaction")
+        parser.add_argument("--pause", type=float, default=0, help="Seconds to sleep between chunks")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+
+    def handle(self, *args, **options):
+        ids = list(options["ids"])
+        if options["ids_file"]:
+            with open(options["ids_file"]) as lines:
+                ids += [int(line) for line in lines if line.strip()]
+        if not ids:
+            raise CommandError("Give customer ids or an --ids-file.")
+        customers = Customer.objects.filter(id__in=ids)
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would delete {format_counts(count_purge(customers))}")
+            return
+
+        total = customers.count()
+
+        def progress(purged, deleted):
+            self.stdout.write(f"{purged}/{total} customers: {format_counts(deleted)}")
+
+        started = time.perf_counter()
+        deleted = purge_customers(customers, chunk_size=options["chunk_size"], pause=options["pause"], progress=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Purged {total} customers in {elapsed:.2f}s: {format_counts(deleted)}"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from products.summaries import rebuild_order_summaries, rebuild_stale_order_summaries
+
+
+class Command(BaseCommand):
+    help = "Backfill the OrderSummary table from line items"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Orders per transaction")
+        parser.add_argument("--stale", action="store_true", help="Only the summaries marked stale by a product price change")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuild = rebuild_stale_order_summaries if options["stale"] else rebuild_order_summaries
+        rebuilt = rebuild(chunk_size=options["chunk_size"])
+        elapsed = time.perf_counter() - started
+        rate = rebuilt / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} order summaries in {elapsed:.2f}s ({rate:,.0f} rows/s)"))
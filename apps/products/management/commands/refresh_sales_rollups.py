@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from products.rollups import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Refresh the daily product and coupon sales rollups behind the analytics API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=parse_date, default=None, help="Recompute days from this date (YYYY-MM-DD)")
+        parser.add_argument("--until", type=parse_date, default=None, help="Recompute days up to this date (YYYY-MM-DD)")
+        parser.add_argument("--full", action="store_true", help="Recompute every day")
+        parser.add_argument("--chunk-days", type=int, default=31, help="Days per transaction")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        days = refresh_sales_rollups(since=options["since"], until=options["until"], full=options["full"], chunk_days=options["chunk_days"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {days} days of sales rollups in {elapsed:.2f}s"))
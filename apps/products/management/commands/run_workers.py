@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from products.fulfilment import enqueue_due, queue_stats, run_worker
+
+
+def run_worker_process(task):
+    worker, batch_size, poll_interval, until_empty = task
+    return run_worker(f"{worker}:{os.getpid()}", batch_size, poll_interval=poll_interval, until_empty=until_empty)
+
+
+class Command(BaseCommand):
+    help = "Ship and deliver orders from the fulfilment job queue with a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+        parser.add_argument("--batch-size", type=int, default=settings.FULFILMENT_BATCH_SIZE, help="Jobs claimed per transaction")
+        parser.add_argument("--poll-interval", type=float, default=settings.FULFILMENT_POLL_INTERVAL, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--until-empty", action="store_true", help="Exit once the queue is drained")
+        parser.add_argument("--enqueue", action="store_true", help="First queue jobs for every order waiting to ship or be delivered")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be at least 1.")
+
+        if options["enqueue"]:
+            enqueue_due()
+        stats = queue_stats()
+        self.stdout.write(f"{stats['pending']} pending jobs, oldest waiting {stats['lag']:.1f}s")
+
+        started = time.perf_counter()
+        tasks = [
+            (f"{socket.gethostname()}-{index}", options["batch_size"], options["poll_interval"], options["until_empty"])
+            for index in range(options["workers"])
+        ]
+        if options["workers"] > 1:
+            # forked workers must open their own connections
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(options["workers"]) as pool:
+                results = pool.map(run_worker_process, tasks)
+        else:
+            results = [run_worker_process(tasks[0])]
+
+        elapsed = time.perf_counter() - started
+        jobs = sum(result["jobs"] for result in results)
+        done = sum(result["done"] for result in results)
+        lag = max(result["max_lag"] for result in results)
+        rate = jobs / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {jobs} jobs ({done} done, {jobs - done} failed) in {elapsed:.2f}s ({rate:,.0f} jobs/s), max lag {lag:.1f}s"
+            )
+        )
@@ -1,85 +1,210 @@
+import multiprocessing
 import random
+import time
+from array import array
+from datetime import date
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
 from faker import Faker
-from products.models import Customer, LineItem, Order, Product
-
-fake = Faker()
-
-
-def add_customers():
-    for _ in range(100):
-        customer = Customer(
-            first_name=fake.first_name(),
-            last_name=fake.last_name(),
-            address=fake.street_address(),
-            city=fake.city(),
-            postcode=fake.postcode(),
-            email=fake.email(),
-        )
-        print(f"New customer: {customer}")
-        customer.save()
-
-
-def add_orders():
-    customers = Customer.objects.all()
-
-    for _ in range(500):
-        # choose a random customer
-        customer = random.choice(customers)
-
-        ordered_date = fake.date_time_this_year()
-        shipped_date = random.choices([None, fake.date_time_between(start_date=ordered_date)], [10, 90])[0]
-
-        # choose either random None or random date for delivered and shipped
+from products.catalog import bump_version
+from products.ingest import allocate_ids
+from products.models import ArchivedOrder, Customer, LineItem, Order, Product
+from products.search import index_customers
+from products.summaries import build_order_summaries
+
+from utils.db import atomic_write
+
+COUPON_CODES = [None, "50OFF", "FREESHIPPING", "BUYONEGETONE"]
+COUPON_WEIGHTS = [80, 10, 5, 5]
+
+# ids shared with the generator processes, see `init_generator`
+_customer_ids = array("q")
+_product_ids = []
+_max_line_items = 3
+
+
+def init_generator(customer_ids, product_ids, max_line_items):
+    global _customer_ids, _product_ids, _max_line_items
+    _customer_ids = customer_ids
+    _product_ids = product_ids
+    _max_line_items = max_line_items
+
+
+def make_generators(seed, kind, index):
+    # every chunk gets its own derived seed, so the output is identical whether
+    # the chunks are generated serially or spread over a pool of processes
+    chunk_seed = None if seed is None else f"{seed}:{kind}:{index}"
+    rng = random.Random(chunk_seed)
+    fake = Faker()
+    fake.seed_instance(chunk_seed)
+    return rng, fake
+
+
+def generate_customer_rows(task):
+    seed, index, first_seq, count = task
+    _, fake = make_generators(seed, "customers", index)
+    rows = []
+    for seq in range(first_seq, first_seq + count):
+        first_name = fake.first_name()
+        last_name = fake.last_name()
+        # the sequence number keeps emails unique at any scale
+        email = f"{first_name}.{last_name}{seq}@{fake.free_email_domain()}".lower()
+        rows.append((first_name, last_name, fake.street_address(), fake.city(), fake.postcode(), email))
+    return rows
+
+
+def generate_order_rows(task):
+    seed, index, first_id, count, today = task
+    rng, fake = make_generators(seed, "orders", index)
+    orders = []
+    line_items = []
+    for order_id in range(first_id, first_id + count):
+        order_date = fake.date_between_dates(date_start=date(today.year, 1, 1), date_end=today)
+        shipped_date = None
         delivered_date = None
-        if shipped_date:
-            delivered_date = random.choices([None, fake.date_time_between(start_date=shipped_date)], [50, 50])[0]
-
-        # choose either random None or one of three coupon codes
-        coupon_code = random.choices([None, "50OFF", "FREESHIPPING", "BUYONEGETONE"], [80, 10, 5, 5])[0]
-
-        order = Order(
-            customer_id=customer.id,
-            order_date=ordered_date,
-            shipped_date=shipped_date,
-            delivered_date=delivered_date,
-            coupon_code=coupon_code,
-        )
-        print(f"New order: {order}")
-        order.save()
-
-
-def add_products():
-    for _ in range(10):
-        product = Product(name=fake.catch_phrase(), price=random.randint(10, 100))
-        print(f"New product: {product}")
-        product.save()
-
-
-def add_order_products():
-    orders = Order.objects.all()
-    products = Product.objects.all()
-
-    for order in orders:
-        # select random k
-        k = random.randint(1, 3)
-        # select random products
-        purchased_products = random.sample(list(products), k)
-        # order.products.add(*purchased_products)
-        for product in purchased_products:
-            line_item = LineItem(order=order, product=product, quantity=random.randint(1, 5))
-            print(f"New line item: {line_item}")
-            line_item.save()
-
-
-def create_random_data():
-    add_customers()
-    add_orders()
-    add_products()
-    add_order_products()
+        # choose either random None or random date for delivered and shipped
+        if rng.random() < 0.9:
+            shipped_date = fake.date_between_dates(date_start=order_date, date_end=today)
+            if rng.random() < 0.5:
+                delivered_date = fake.date_between_dates(date_start=shipped_date, date_end=today)
+        coupon_code = rng.choices(COUPON_CODES, COUPON_WEIGHTS)[0]
+        orders.append((order_id, rng.choice(_customer_ids), order_date, shipped_date, delivered_date, coupon_code))
+
+        k = rng.randint(1, min(_max_line_items, len(_product_ids)))
+        for product_id in rng.sample(_product_ids, k):
+            line_items.append((order_id, product_id, rng.randint(1, 5)))
+    return orders, line_items
+
+
+def chunked_tasks(total, chunk_size, start):
+    for index, offset in enumerate(range(0, total, chunk_size)):
+        yield index, start + offset, min(chunk_size, total - offset)
+
+
+def generate(func, tasks, workers, initargs):
+    if workers > 1:
+        # fork so the workers don't have to set up Django again, they only run Faker
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(workers, initializer=init_generator, initargs=initargs) as pool:
+            yield from pool.imap(func, tasks)
+    else:
+        init_generator(*initargs)
+        yield from map(func, tasks)
+
+
+def add_products(count, seed=None):
+    rng, fake = make_generators(seed, "products", 0)
+    names = set(Product.objects.values_list("name", flat=True))
+    products = []
+    for _ in range(count):
+        name = fake.catch_phrase()[:40]
+        if name in names:
+            name = f"{name} {len(names)}"
+        names.add(name)
+        products.append(Product(name=name, price=rng.randint(10, 100)))
+
+    with transaction.atomic():
+        Product.objects.bulk_create(products)
+        # bulk_create skips the signal that invalidates the catalog
+        transaction.on_commit(bump_version)
+    return count
+
+
+def add_customers(count, seed=None, batch_size=1000, chunk_size=10000, workers=1):
+    # seeded emails end in their row's id - 1, numbering from the highest id never repeats one, even after deletes
+    last_id = Customer.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+    tasks = ((seed, index, first, size) for index, first, size in chunked_tasks(count, chunk_size, last_id))
+    fields = ["first_name", "last_name", "address", "city", "postcode", "email"]
+
+    created = 0
+    for rows in generate(generate_customer_rows, tasks, workers, (array("q"), [], 0)):
+        with transaction.atomic():
+            Customer.objects.bulk_create([Customer(**dict(zip(fields, row))) for row in rows], batch_size=batch_size)
+        created += len(rows)
+
+    # bulk_create skips the signal that maintains the search index
+    with transaction.atomic():
+        index_customers(Customer.objects.filter(id__gt=last_id), chunk_size=chunk_size)
+    return created
+
+
+def add_orders(count, seed=None, line_items_per_order=3, batch_size=1000, chunk_size=10000, workers=1):
+    if not count:
+        return 0, 0
+
+    # only ids are sampled, model instances are never loaded
+    customer_ids = array("q", Customer.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=chunk_size))
+    product_ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+    if not customer_ids or not product_ids:
+        raise CommandError("Orders need at least one customer and one product.")
+
+    # orders get explicit ids so their line items can be built without reading them back
+    with atomic_write():
+        first_id = allocate_ids(Order, count, shared=[ArchivedOrder])[0]
+    today = date.today()
+    tasks = ((seed, index, first, size, today) for index, first, size in chunked_tasks(count, chunk_size, first_id))
+
+    orders_created = 0
+    line_items_created = 0
+    initargs = (customer_ids, product_ids, line_items_per_order)
+    for orders, line_items in generate(generate_order_rows, tasks, workers, initargs):
+        with transaction.atomic():
+            Order.objects.bulk_create(
+                [
+                    Order(id=id, customer_id=customer_id, order_date=order_date, shipped_date=shipped, delivered_date=delivered, coupon_code=coupon)
+                    for id, customer_id, order_date, shipped, delivered, coupon in orders
+                ],
+                batch_size=batch_size,
+            )
+            LineItem.objects.bulk_create(
+                [LineItem(order_id=order_id, product_id=product_id, quantity=quantity) for order_id, product_id, quantity in line_items],
+                batch_size=batch_size,
+            )
+            # bulk_create skips the LineItem signals, so the summaries are built per chunk
+            build_order_summaries([order[0] for order in orders])
+        orders_created += len(orders)
+        line_items_created += len(line_items)
+
+    return orders_created, line_items_created
 
 
 class Command(BaseCommand):
+    help = "Populate the products app with random customers, products, orders and line items"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=100)
+        parser.add_argument("--orders", type=int, default=500)
+        parser.add_argument("--products", type=int, default=10)
+        parser.add_argument("--line-items-per-order", type=int, default=3, help="Maximum number of line items per order")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for deterministic output")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per INSERT statement")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Rows per transaction")
+        parser.add_argument("--workers", type=int, default=1, help="Processes used to generate rows")
+
     def handle(self, *args, **options):
-        create_random_data()
+        for option in ("line_items_per_order", "batch_size", "chunk_size", "workers"):
+            if options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be at least 1.")
+
+        seed = options["seed"]
+        sizes = {"batch_size": options["batch_size"], "chunk_size": options["chunk_size"], "workers": options["workers"]}
+
+        started = time.perf_counter()
+        created = add_products(options["products"], seed=seed)
+        self.report("products", created, started)
+
+        started = time.perf_counter()
+        created = add_customers(options["customers"], seed=seed, **sizes)
+        self.report("customers", created, started)
+
+        started = time.perf_counter()
+        orders, line_items = add_orders(options["orders"], seed=seed, line_items_per_order=options["line_items_per_order"], **sizes)
+        self.report("orders", orders, started)
+        self.report("line items", line_items, started)
+
+    def report(self, label, rows, started):
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Created {rows} {label} in {elapsed:.2f}s ({rate:,.0f} rows/s)"))
@@ -0,0 +1,172 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 is SQLite only, other backends search without an index
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE products_customer_search USING fts5(name, tokenize='trigram')")
+    schema_editor.execute(
+        "INSERT INTO products_customer_search (rowid, name) SELECT id, first_name || ' ' || last_name FROM products_customer"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE products_customer_search")
+
+
+class Migration(migrations.Migration):
+
+    replaces = [('products', '0001_initial'), ('products', '0002_auto_20230130_0306'), ('products', '0003_ordersummary'), ('products', '0004_order_lineitem_indexes'), ('products', '0005_sales_rollups'), ('products', '0006_order_version'), ('products', '0007_fulfilment_jobs'), ('products', '0008_customer_search')]
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    # fields, indexes and constraints are folded into CreateModel, SQLite
+    # rebuilds the whole table for every AddField and AddConstraint
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(blank=True, max_length=50)),
+                ('last_name', models.CharField(blank=True, max_length=50)),
+                ('address', models.CharField(blank=True, max_length=500)),
+                ('city', models.CharField(blank=True, max_length=50)),
+                ('postcode', models.CharField(blank=True, max_length=50)),
+                ('email', models.CharField(blank=True, max_length=50, unique=True)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['city', 'postcode'], name='customer_city_postcode_idx'),
+                    models.Index(fields=['postcode'], name='customer_postcode_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=50, unique=True)),
+                ('price', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_date', models.DateField()),
+                ('shipped_date', models.DateField(null=True)),
+                ('delivered_date', models.DateField(null=True)),
+                ('coupon_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.customer')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['order_date', 'id'], name='order_date_id_idx'),
+                    models.Index(fields=['shipped_date'], name='order_shipped_date_idx'),
+                    models.Index(condition=models.Q(('delivered_date__isnull', False)), fields=['delivered_date'], name='order_delivered_date_idx'),
+                    models.Index(condition=models.Q(('coupon_code__isnull', False)), fields=['coupon_code', 'order_date'], name='order_coupon_date_idx'),
+                    models.Index(condition=models.Q(('delivered_date__isnull', True)), fields=['order_date'], name='order_undelivered_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='LineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['order', 'product'], name='lineitem_order_product_idx'),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(through='products.LineItem', to='products.Product'),
+        ),
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='products.order')),
+                ('total_amount', models.BigIntegerField(default=0)),
+                ('item_count', models.IntegerField(default=0)),
+                ('distinct_products', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCouponSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('coupon_code', models.CharField(blank=True, max_length=50)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('day', 'coupon_code'), name='daily_coupon_sales_unique'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('day', 'product'), name='daily_product_sales_unique'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='FulfilmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transition', models.CharField(choices=[('ship', 'Ship'), ('deliver', 'Deliver')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('claimed', 'Claimed'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fulfilment_jobs', to='products.order')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['status', 'id'], name='fulfilmentjob_status_idx'),
+                    models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['finished_at'], name='fulfilmentjob_finished_idx'),
+                ],
+                'constraints': [
+                    models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'claimed'])), fields=('order', 'transition'), name='fulfilmentjob_open_unique'),
+                ],
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_auto_20230130_0306'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='products.order')),
+                ('total_amount', models.BigIntegerField(default=0)),
+                ('item_count', models.IntegerField(default=0)),
+                ('distinct_products', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
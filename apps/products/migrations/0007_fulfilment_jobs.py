@@ -0,0 +1,39 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_order_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FulfilmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transition', models.CharField(choices=[('ship', 'Ship'), ('deliver', 'Deliver')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('claimed', 'Claimed'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fulfilment_jobs', to='products.order')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='fulfilmentjob',
+            index=models.Index(fields=['status', 'id'], name='fulfilmentjob_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fulfilmentjob',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['finished_at'], name='fulfilmentjob_finished_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='fulfilmentjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'claimed'])), fields=('order', 'transition'), name='fulfilmentjob_open_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:29
+
+from django.db import migrations, models
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 is SQLite only, other backends search without an index
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE products_customer_search USING fts5(name, tokenize='trigram')")
+    schema_editor.execute(
+        "INSERT INTO products_customer_search (rowid, name) SELECT id, first_name || ' ' || last_name FROM products_customer"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE products_customer_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_fulfilment_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['city', 'postcode'], name='customer_city_postcode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['postcode'], name='customer_postcode_idx'),
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
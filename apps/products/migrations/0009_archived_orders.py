@@ -0,0 +1,43 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_squashed_0008_customer_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_date', models.DateField()),
+                ('shipped_date', models.DateField(null=True)),
+                ('delivered_date', models.DateField(null=True)),
+                ('coupon_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='products.customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedLineItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineitem_set', related_query_name='lineitem', to='products.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_line_items', to='products.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['order_date', 'id'], name='archivedorder_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedlineitem',
+            index=models.Index(fields=['order', 'product'], name='archivedlineitem_order_idx'),
+        ),
+    ]
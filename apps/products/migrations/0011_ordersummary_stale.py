@@ -0,0 +1,22 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_affinity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordersummary',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='ordersummary',
+            index=models.Index(condition=models.Q(('stale', True)), fields=['order'], name='ordersummary_stale_idx'),
+        ),
+    ]
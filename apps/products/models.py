@@ -9,6 +9,13 @@ class Customer(models.Model):
     postcode = models.CharField(max_length=50, blank=True, null=False)
     email = models.CharField(max_length=50, blank=True, null=False, unique=True)
 
+    # names are searched through products.search
+    class Meta:
+        indexes = [
+            models.Index(fields=["city", "postcode"], name="customer_city_postcode_idx"),
+            models.Index(fields=["postcode"], name="customer_postcode_idx"),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -32,6 +39,17 @@ class Order(models.Model):
     coupon_code = models.CharField(max_length=50, blank=True, null=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=False)
     products = models.ManyToManyField(Product, through="LineItem")
+    # bumped by every update, see products.updates
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["order_date", "id"], name="order_date_id_idx"),
+            models.Index(fields=["shipped_date"], name="order_shipped_date_idx"),
+            models.Index(fields=["delivered_date"], name="order_delivered_date_idx", condition=models.Q(delivered_date__isnull=False)),
+            models.Index(fields=["coupon_code", "order_date"], name="order_coupon_date_idx", condition=models.Q(coupon_code__isnull=False)),
+            models.Index(fields=["order_date"], name="order_undelivered_idx", condition=models.Q(delivered_date__isnull=True)),
+        ]
 
     def __str__(self):
         return f"Order#: {self.pk}"
@@ -42,5 +60,171 @@ class LineItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, null=False)
     quantity = models.IntegerField(null=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["order", "product"], name="lineitem_order_product_idx"),
+        ]
+
     def __str__(self):
         return f"Line Item #:{self.pk}"
+
+
+class ArchivedOrder(models.Model):
+    """An `Order` moved out of the hot table by products.archive, same columns and id."""
+
+    id = models.BigIntegerField(primary_key=True)
+    order_date = models.DateField(null=False)
+    shipped_date = models.DateField(null=True)
+    delivered_date = models.DateField(null=True)
+    coupon_code = models.CharField(max_length=50, blank=True, null=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=False, related_name="archived_orders")
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["order_date", "id"], name="archivedorder_date_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archived Order#: {self.pk}"
+
+
+class ArchivedLineItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    # the same reverse names as LineItem, so lookups work on both order tables
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, null=False, related_name="lineitem_set", related_query_name="lineitem")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=False, related_name="archived_line_items")
+    quantity = models.IntegerField(null=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["order", "product"], name="archivedlineitem_order_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archived Line Item #:{self.pk}"
+
+
+class OrderSummary(models.Model):
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name="summary")
+    total_amount = models.BigIntegerField(default=0)
+    item_count = models.IntegerField(default=0)
+    distinct_products = models.IntegerField(default=0)
+    # set when a product price changes, until the totals are recomputed
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["order"], name="ordersummary_stale_idx", condition=models.Q(stale=True))]
+
+    def __str__(self):
+        return f"Summary for Order#: {self.order_id}"
+
+
+class Watermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.BigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "product"], name="daily_product_sales_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}"
+
+
+class DailyCouponSales(models.Model):
+    day = models.DateField()
+    # empty for orders without a coupon
+    coupon_code = models.CharField(max_length=50, blank=True)
+    orders = models.IntegerField(default=0)
+    units = models.BigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "coupon_code"], name="daily_coupon_sales_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.coupon_code or '-'}"
+
+
+class ProductCooccurrence(models.Model):
+    """
+    Orders containing both products, kept by products.affinity with
+    `product_id <= other_id`; on the diagonal, the orders of one product.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "other"], name="product_cooccurrence_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} & {self.other_id}: {self.orders}"
+
+
+class ProductNeighbour(models.Model):
+    """The products most often bought together with `product`, best first."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    orders = models.IntegerField()
+    lift = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="product_neighbour_rank_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.rank}: {self.neighbour_id}"
+
+
+class FulfilmentJob(models.Model):
+    PENDING = "pending"
+    CLAIMED = "claimed"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (CLAIMED, "Claimed"), (DONE, "Done"), (FAILED, "Failed")]
+    TRANSITIONS = [("ship", "Ship"), ("deliver", "Deliver")]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="fulfilment_jobs")
+    transition = models.CharField(max_length=10, choices=TRANSITIONS)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"], name="fulfilmentjob_status_idx"),
+            models.Index(fields=["finished_at"], name="fulfilmentjob_finished_idx", condition=models.Q(finished_at__isnull=False)),
+        ]
+        constraints = [
+            # at most one open job per order and transition
+            models.UniqueConstraint(
+                fields=["order", "transition"], condition=models.Q(status__in=["pending", "claimed"]), name="fulfilmentjob_open_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.transition} Order#: {self.order_id} ({self.status})"
@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order_date, pk):
+    return f"{order_date.isoformat()}_{pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        order_date, pk = cursor.split("_")
+        return date.fromisoformat(order_date), int(pk)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def keyset_filter(queryset, cursor=None):
+    queryset = queryset.order_by("-order_date", "-id")
+    if cursor:
+        order_date, pk = decode_cursor(cursor)
+        # the bare range on order_date lets the planner seek into the index
+        queryset = queryset.filter(order_date__lte=order_date).filter(Q(order_date__lt=order_date) | Q(id__lt=pk))
+    return queryset
+
+
+def keyset_page(queryset, cursor=None, page_size=50, chunk_size=2000):
+    """
+    Return one page of `queryset` ordered by newest `(order_date, id)` first, plus
+    the cursor of the next page. Pages start from the cursor through the index
+    instead of counting past an OFFSET, so every page costs the same.
+    """
+    queryset = keyset_filter(queryset, cursor)
+    # one extra row tells whether there is a next page
+    rows = list(queryset[: page_size + 1].iterator(chunk_size=chunk_size))
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].order_date, rows[-1].pk)
+    return rows, next_cursor
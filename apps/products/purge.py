@@ -0,0 +1,92 @@
+import time
+from collections import Counter
+
+from django.db import connections, models, router, transaction
+
+from .archive import discard_partitions
+from .models import ArchivedOrder, Customer
+from .search import unindex_customers
+
+
+def cascade_steps(model, rows):
+    """
+    The deletes that deleting `rows` of `model` cascades to, as `(model,
+    column, subquery)` with the deepest children first. Each subquery selects
+    the ids of the parent rows, nested down from `rows`.
+    """
+    steps = []
+    # the relations Django's collector follows, including the hidden ones of many to many tables
+    relations = [
+        field
+        for field in model._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete and (field.one_to_one or field.one_to_many)
+    ]
+    for relation in relations:
+        if relation.on_delete is models.DO_NOTHING:
+            continue
+        if relation.on_delete is not models.CASCADE:
+            # SET_NULL, PROTECT and friends need the collector
+            raise ValueError(f"{relation.related_model._meta.label}.{relation.field.name} doesn't cascade")
+        related = relation.related_model
+        children = related._base_manager.filter(**{f"{relation.field.name}__in": rows}).values(related._meta.pk.name)
+        steps += cascade_steps(related, children)
+        steps.append((related, relation.field.column, rows))
+    return steps
+
+
+def purge_steps(customer_ids):
+    customers = Customer._base_manager.filter(id__in=customer_ids).values("id")
+    return [*cascade_steps(Customer, customers), (Customer, "id", customers)]
+
+
+def count_purge(customers):
+    """What purging the `customers` queryset would delete, per model label."""
+    counts = Counter()
+    for model, column, rows in purge_steps(customers.values("id")):
+        counts[model._meta.label] += model._base_manager.filter(**{f"{column}__in": rows}).count()
+    return counts
+
+
+def purge_chunk(customer_ids, using):
+    deleted = Counter()
+    # exported partitions holding the purged orders are rewritten without them by the next export
+    months = {
+        order_date.replace(day=1)
+        for order_date in ArchivedOrder.objects.using(using).filter(customer_id__in=customer_ids).values_list("order_date", flat=True)
+    }
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for model, column, rows in purge_steps(customer_ids):
+            sql, params = rows.query.sql_with_params()
+            cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE {column} IN ({sql})", params)
+            deleted[model._meta.label] += cursor.rowcount
+        # the post_delete receiver of Customer, which a set based delete doesn't send
+        unindex_customers(customer_ids)
+        transaction.on_commit(lambda: discard_partitions(months), using=using)
+    return deleted
+
+
+def purge_customers(customers, chunk_size=500, pause=0, progress=None):
+    """
+    Delete the `customers` queryset with everything cascading from it, like
+    `customers.delete()` but without loading the related rows: each chunk of
+    `chunk_size` customers is one transaction of `DELETE ... WHERE ... IN
+    (subquery)` statements, children first. `pause` seconds between chunks
+    let other writers in, `progress(customers, deleted)` is called after
+    each. Returns the rows deleted per model label, like `delete()`.
+    """
+    using = router.db_for_write(Customer)
+    ids = customers.order_by("id").values_list("id", flat=True)
+    deleted = Counter()
+    purged = 0
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return deleted
+        deleted += purge_chunk(chunk, using)
+        purged += len(chunk)
+        last_id = chunk[-1]
+        if progress:
+            progress(purged, deleted)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .archive import sources
+from .models import DailyCouponSales, DailyProductSales, Order, Watermark
+from .summaries import rebuild_stale_order_summaries
+
+SALES_WATERMARK = "sales_rollups"
+
+
+def add_rows(totals, rows, key, fields):
+    # an order is either hot or archived, so per table totals simply add up
+    for row in rows:
+        total = totals.setdefault(tuple(row[name] for name in key), dict.fromkeys(fields, 0))
+        for field in fields:
+            total[field] += row[field]
+
+
+def rollup_days(days):
+    product_totals = {}
+    coupon_totals = {}
+    for orders, line_items in sources(include_archive=True):
+        product_rows = (
+            line_items.objects.filter(order__order_date__in=days)
+            .values("product_id", day=F("order__order_date"))
+            .annotate(
+                units=Sum("quantity"),
+                revenue=Sum(F("quantity") * F("product__price")),
+                orders=Count("order_id", distinct=True),
+            )
+            .order_by()
+        )
+        add_rows(product_totals, product_rows, ("day", "product_id"), ("units", "revenue", "orders"))
+        if orders is Order:
+            totals = {"units": Coalesce(Sum("summary__item_count"), 0), "revenue": Coalesce(Sum("summary__total_amount"), 0)}
+        else:
+            # archived orders have no summaries, their line items are few
+            totals = {
+                "units": Coalesce(Sum("lineitem__quantity"), 0),
+                "revenue": Coalesce(Sum(F("lineitem__quantity") * F("lineitem__product__price")), 0),
+            }
+        coupon_rows = (
+            orders.objects.filter(order_date__in=days)
+            .values(day=F("order_date"), coupon=Coalesce("coupon_code", Value("")))
+            .annotate(orders=Count("id", distinct=True), **totals)
+            .order_by()
+        )
+        add_rows(coupon_totals, coupon_rows, ("day", "coupon"), ("orders", "units", "revenue"))
+
+    with transaction.atomic():
+        DailyProductSales.objects.filter(day__in=days).delete()
+        DailyCouponSales.objects.filter(day__in=days).delete()
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(day=day, product_id=product_id, **totals) for (day, product_id), totals in product_totals.items()
+        )
+        DailyCouponSales.objects.bulk_create(
+            DailyCouponSales(day=day, coupon_code=coupon, **totals) for (day, coupon), totals in coupon_totals.items()
+        )
+
+
+def refresh_sales_rollups(since=None, until=None, full=False, chunk_days=31):
+    """
+    Recompute the daily rollups. By default only the days of orders created
+    since the previous run are touched; `since`/`until` recompute a date range
+    (e.g. after backdated edits) and `full` recomputes every day.
+    """
+    # the coupon totals are read from the order summaries
+    rebuild_stale_order_summaries()
+    watermark, _ = Watermark.objects.get_or_create(name=SALES_WATERMARK)
+    last_id = Order.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+
+    orders = Order.objects.all()
+    if since or until:
+        if since:
+            orders = orders.filter(order_date__gte=since)
+        if until:
+            orders = orders.filter(order_date__lte=until)
+    elif not full:
+        orders = orders.filter(id__gt=watermark.value, id__lte=last_id)
+
+    days = sorted(orders.order_by().values_list("order_date", flat=True).distinct())
+    for start in range(0, len(days), chunk_days):
+        rollup_days(days[start : start + chunk_days])
+
+    if not (since or until):
+        watermark.value = last_id
+        watermark.save(update_fields=["value"])
+    return len(days)
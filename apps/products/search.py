@@ -0,0 +1,119 @@
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from .models import Customer
+
+# FTS5 table of customer names with the trigram tokenizer, rowid is the customer id
+SEARCH_TABLE = "products_customer_search"
+
+
+def has_search_index(using):
+    return connections[using].vendor == "sqlite"
+
+
+def index_names(rows):
+    """(Re)index `(id, first_name, last_name)` rows."""
+    using = router.db_for_write(Customer)
+    if not has_search_index(using):
+        return
+    with connections[using].cursor() as cursor:
+        # FTS5 has no upsert, a replaced row is deleted first
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {SEARCH_TABLE} (rowid, name) VALUES (%s, %s)", [(id, f"{first} {last}") for id, first, last in rows])
+
+
+def index_customers(customers, chunk_size=5000):
+    """(Re)index the `customers` queryset, returns how many."""
+    if not has_search_index(router.db_for_write(Customer)):
+        return 0
+    rows = customers.order_by("id").values_list("id", "first_name", "last_name").iterator(chunk_size=chunk_size)
+    indexed = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return indexed
+        index_names(chunk)
+        indexed += len(chunk)
+
+
+def unindex_customers(customer_ids):
+    using = router.db_for_write(Customer)
+    if has_search_index(using):
+        with connections[using].cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(id,) for id in customer_ids])
+
+
+def rebuild_search_index(chunk_size=5000):
+    using = router.db_for_write(Customer)
+    if not has_search_index(using):
+        return 0
+    # searches keep seeing the old index until the new one is committed
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        indexed = index_customers(Customer.objects.all(), chunk_size=chunk_size)
+    with connections[using].cursor() as cursor:
+        # merge the index segments written chunk by chunk
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def name_queries(text):
+    """
+    The FTS5 query matching names containing every word of `text`, then a
+    looser one matching any trigram of it, which tolerates typos and ranks
+    names sharing more trigrams first. Words under 3 characters are ignored,
+    trigrams can't match them.
+    """
+    words = [word for word in text.lower().split() if len(word) >= 3]
+    trigrams = dict.fromkeys(word[index : index + 3] for word in words for index in range(len(word) - 2))
+    return " AND ".join(map(quote, words)), " OR ".join(map(quote, trigrams))
+
+
+def ranked_ids(match, filters, limit, offset, using):
+    sql = f"SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE}"
+    where = [f"{SEARCH_TABLE} MATCH %s"]
+    params = [match]
+    if filters:
+        sql += f" JOIN {Customer._meta.db_table} customer ON customer.id = {SEARCH_TABLE}.rowid"
+        for field, value in filters.items():
+            where.append(f"customer.{field} = %s")
+            params.append(value)
+    sql += f" WHERE {' AND '.join(where)} ORDER BY rank LIMIT %s OFFSET %s"
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [*params, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_customers(name=None, email=None, city=None, postcode=None, page=1, page_size=20):
+    """
+    Return one page of matching customers, best matches first when searching
+    by name, and whether there is a next page. Emails match exactly, city and
+    postcode are exact filters.
+    """
+    filters = {field: value for field, value in (("email", email), ("city", city), ("postcode", postcode)) if value}
+    offset = (page - 1) * page_size
+    using = router.db_for_read(Customer)
+
+    exact, fuzzy = name_queries(name or "")
+    if not name:
+        customers = list(Customer.objects.filter(**filters).order_by("id")[offset : offset + page_size + 1])
+    elif exact and has_search_index(using):
+        ids = ranked_ids(exact, filters, page_size + 1, offset, using)
+        # typo tolerant only when nothing contains the words, on every page
+        if not ids and (page == 1 or not ranked_ids(exact, filters, 1, 0, using)):
+            ids = ranked_ids(fuzzy, filters, page_size + 1, offset, using)
+        customers = Customer.objects.in_bulk(ids)
+        customers = [customers[id] for id in ids if id in customers]
+    else:
+        # no search index on this backend or only short words, a scan that only handles substrings
+        words = Q()
+        for word in name.split():
+            words &= Q(first_name__icontains=word) | Q(last_name__icontains=word)
+        customers = list(Customer.objects.filter(words, **filters).order_by("id")[offset : offset + page_size + 1])
+    return customers[:page_size], len(customers) > page_size
@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .api.caching import invalidate
+from .catalog import bump_version
+from .models import Customer, LineItem, Product
+from .search import index_names, unindex_customers
+from .summaries import mark_order_summaries_stale, refresh_order_summary
+
+
+@receiver(pre_save, sender=LineItem)
+def remember_line_item_order(sender, instance, **kwargs):
+    instance._previous_order_id = None
+    if instance.pk:
+        instance._previous_order_id = LineItem.objects.filter(pk=instance.pk).values_list("order_id", flat=True).first()
+
+
+@receiver(post_save, sender=LineItem)
+def update_order_summary(sender, instance, **kwargs):
+    refresh_order_summary(instance.order_id)
+    previous_order_id = getattr(instance, "_previous_order_id", None)
+    if previous_order_id and previous_order_id != instance.order_id:
+        refresh_order_summary(previous_order_id, create=False)
+
+
+@receiver(post_delete, sender=LineItem)
+def remove_from_order_summary(sender, instance, **kwargs):
+    refresh_order_summary(instance.order_id, create=False)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance, **kwargs):
+    instance._previous_price = None
+    if instance.pk:
+        instance._previous_price = Product.objects.filter(pk=instance.pk).values_list("price", flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def reprice_order_summaries(sender, instance, created, **kwargs):
+    if not created and instance._previous_price != instance.price:
+        # recomputing every order of a popular product would hold up the save, see rebuild_stale_order_summaries
+        mark_order_summaries_stale(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_catalog(sender, **kwargs):
+    # after the commit, or other workers could reload the old rows under the new version
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Customer)
+def index_customer(sender, instance, **kwargs):
+    index_names([(instance.pk, instance.first_name, instance.last_name)])
+
+
+@receiver(post_delete, sender=Customer)
+def unindex_customer(sender, instance, **kwargs):
+    unindex_customers([instance.pk])
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_responses(sender, **kwargs):
+    invalidate("users")
@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import LineItem, Order, OrderSummary
+
+
+def aggregate_line_items(order_ids):
+    totals = (
+        LineItem.objects.filter(order_id__in=order_ids)
+        .values("order_id")
+        .annotate(
+            total_amount=Sum(F("quantity") * F("product__price")),
+            item_count=Sum("quantity"),
+            distinct_products=Count("product_id", distinct=True),
+        )
+        .order_by()
+    )
+    return {row.pop("order_id"): row for row in totals}
+
+
+def refresh_order_summary(order_id, create=True):
+    values = aggregate_line_items([order_id]).get(order_id, {"total_amount": 0, "item_count": 0, "distinct_products": 0})
+    values["stale"] = False
+    if create:
+        OrderSummary.objects.update_or_create(order_id=order_id, defaults=values)
+    else:
+        # used on deletes, where the order itself may be on its way out in the same cascade
+        OrderSummary.objects.filter(order_id=order_id).update(**values)
+
+
+def build_order_summaries(order_ids):
+    totals = aggregate_line_items(order_ids)
+    summaries = [OrderSummary(order_id=order_id, **totals.get(order_id, {})) for order_id in order_ids]
+    with transaction.atomic():
+        OrderSummary.objects.filter(order_id__in=order_ids).delete()
+        OrderSummary.objects.bulk_create(summaries)
+    return len(summaries)
+
+
+def rebuild_order_summaries(orders=None, chunk_size=10000):
+    orders = Order.objects.all() if orders is None else orders
+    ids = orders.order_by("id").values_list("id", flat=True).distinct()
+
+    rebuilt = 0
+    last_id = 0
+    while True:
+        chunk = list(ids.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return rebuilt
+        rebuilt += build_order_summaries(chunk)
+        last_id = chunk[-1]
+
+
+def mark_order_summaries_stale(product_id):
+    """Flag the summaries of every order with `product_id`, one UPDATE instead of recomputing them."""
+    return OrderSummary.objects.filter(order__lineitem__product_id=product_id).update(stale=True)
+
+
+def rebuild_stale_order_summaries(chunk_size=10000):
+    return rebuild_order_summaries(Order.objects.filter(summary__stale=True), chunk_size)
@@ -1,13 +1,93 @@
+import asyncio
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import numpy
 import pytest
-from django.contrib.auth.models import User
-from django.test import TestCase
-from django.urls import reverse
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, Q, Sum
+from django.http import HttpResponse
+from django.test import AsyncClient, TestCase
+from django.urls import path, reverse
+from django.utils import timezone
+from products import admin as products_admin
+from products import affinity
+from products.affinity import count_pairs
+from products.analytics import cohort_retention, customer_metrics, quintiles, snapshots
+from products.api.client import close_http_client
+from products.archive import read_line_items, read_orders
+from products.catalog import ProductCatalog
+from products.catalog import catalog as product_catalog
+from products.fulfilment import enqueue, enqueue_due, process_batch
+from products.ingest import allocate_ids, create_orders
+from products.management.commands.seed_data import (
+    chunked_tasks,
+    generate,
+    generate_customer_rows,
+)
+from products.models import (
+    ArchivedLineItem,
+    ArchivedOrder,
+    Customer,
+    DailyCouponSales,
+    DailyProductSales,
+    FulfilmentJob,
+    LineItem,
+    Order,
+    OrderSummary,
+    Product,
+    ProductCooccurrence,
+    ProductNeighbour,
+    Watermark,
+)
+from products.pagination import encode_cursor, keyset_filter
+from products.purge import purge_customers
+from products.rollups import refresh_sales_rollups
+from products.summaries import rebuild_order_summaries
+from products.updates import OrderUpdateConflict, update_locked, update_order
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from benchmarks.analytics import orm_metrics
+from benchmarks.run import compare, percentile
+from benchmarks.startup import ROOT_DIR, slowest_imports
+from utils.db import atomic_snapshot, atomic_write
+from utils.nplusone import NPlusOneDetector, NPlusOneError
+from utils.profiling import metrics
+from utils.pytest_testdb import fingerprint
+from utils.queries import recording
+from utils.routers import health, replica_scope
+
 pytestmark = pytest.mark.django_db
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
 class TestAuthTestView(TestCase):
     def test_anonymous_cannot_see_page(self):
         response = self.client.get(reverse("test"))
@@ -73,8 +153,10 @@ class TestUsersSecondApproachAPI:
 
 
 class TestCasePytest(TestCase):
-    def setUp(self):
-        self.instance = 3
+    @classmethod
+    def setUpTestData(cls):
+        # once per class, each test runs in a transaction rolled back to it
+        cls.instance = 3
         User.objects.create(username="test", email="test@gmail.com", password="password")
 
     def test_setup_works(self):
@@ -85,3 +167,1635 @@ class TestCasePytest(TestCase):
 
     def test_setup_2(self):
         assert User.objects.all().count() == 1
+
+
+class TestSeedData:
+    def test_creates_requested_rows(self):
+        call_command("seed_data", customers=20, orders=50, products=5, line_items_per_order=2, seed=1, stdout=StringIO())
+        assert Customer.objects.count() == 20
+        assert Product.objects.count() == 5
+        assert Order.objects.count() == 50
+        assert 50 <= LineItem.objects.count() <= 100
+        assert not Order.objects.filter(lineitem__isnull=True).exists()
+
+    def test_seed_is_deterministic_across_workers(self):
+        tasks = [(7, index, first, size) for index, first, size in chunked_tasks(30, 10, 0)]
+        serial = list(generate(generate_customer_rows, tasks, 1, (array("q"), [], 0)))
+        parallel = list(generate(generate_customer_rows, tasks, 2, (array("q"), [], 0)))
+        assert serial == parallel
+
+    def test_reseeding_after_deletes_keeps_emails_unique(self):
+        call_command("seed_data", customers=10, orders=0, products=0, seed=1, stdout=StringIO())
+        Customer.objects.filter(pk__in=Customer.objects.order_by("id").values("pk")[:5]).delete()
+        call_command("seed_data", customers=10, orders=0, products=0, seed=1, stdout=StringIO())
+        # numbered from the row count, the new emails would reuse the numbers of the 5 remaining ones
+        numbers = [int(re.search(r"(\d+)@", email).group(1)) for email in Customer.objects.values_list("email", flat=True)]
+        assert len(numbers) == len(set(numbers)) == 15
+
+    # archiving moves one chunk after another
+    @pytest.mark.allow_repeated_queries
+    def test_reseeding_after_archiving_skips_archived_ids(self, settings, tmp_path):
+        settings.ARCHIVE_EXPORT_DIR = tmp_path / "archive"
+        call_command("seed_data", customers=5, orders=20, products=3, seed=1, stdout=StringIO())
+        Order.objects.update(shipped_date=F("order_date"), delivered_date=F("order_date"))
+        call_command("archive_orders", before=date(2100, 1, 1), stdout=StringIO())
+        call_command("seed_data", customers=0, orders=10, products=0, seed=2, stdout=StringIO())
+        assert not set(Order.objects.values_list("id", flat=True)) & set(ArchivedOrder.objects.values_list("id", flat=True))
+        Order.objects.update(shipped_date=F("order_date"), delivered_date=F("order_date"))
+        call_command("archive_orders", before=date(2100, 1, 1), stdout=StringIO())
+        assert ArchivedOrder.objects.count() == 30
+
+    @pytest.mark.parametrize("option", ["batch_size", "chunk_size", "workers", "line_items_per_order"])
+    def test_rejects_sizes_below_one(self, option):
+        with pytest.raises(CommandError, match="must be at least 1"):
+            call_command("seed_data", customers=1, orders=0, products=0, stdout=StringIO(), **{option: 0})
+
+    def test_orders_require_customers(self):
+        with pytest.raises(CommandError):
+            call_command("seed_data", customers=0, orders=5, products=1, stdout=StringIO())
+
+
+class TestOrderSummary:
+    @pytest.fixture
+    def order(self):
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe", email="jane@dev.io")
+        return Order.objects.create(customer=customer, order_date="2023-01-01")
+
+    def test_line_item_changes_update_summary(self, order):
+        pen = Product.objects.create(name="Pen", price=10)
+        ink = Product.objects.create(name="Ink", price=25)
+
+        LineItem.objects.create(order=order, product=pen, quantity=2)
+        line_item = LineItem.objects.create(order=order, product=ink, quantity=1)
+        summary = OrderSummary.objects.get(order=order)
+        assert (summary.total_amount, summary.item_count, summary.distinct_products) == (45, 3, 2)
+
+        line_item.quantity = 3
+        line_item.save()
+        summary.refresh_from_db()
+        assert (summary.total_amount, summary.item_count, summary.distinct_products) == (95, 5, 2)
+
+        line_item.delete()
+        summary.refresh_from_db()
+        assert (summary.total_amount, summary.item_count, summary.distinct_products) == (20, 2, 1)
+
+    def test_price_changes_mark_summaries_stale(self, order, django_assert_max_num_queries):
+        pen = Product.objects.create(name="Pen", price=10)
+        LineItem.objects.create(order=order, product=pen, quantity=2)
+
+        pen.price = 15
+        # the previous price, the product and one UPDATE of the summaries
+        with django_assert_max_num_queries(3):
+            pen.save()
+        summary = OrderSummary.objects.get(order=order)
+        assert (summary.total_amount, summary.stale) == (20, True)
+
+        call_command("rebuild_order_summaries", stale=True, stdout=StringIO())
+        summary.refresh_from_db()
+        assert (summary.total_amount, summary.stale) == (30, False)
+
+    def test_sales_rollups_rebuild_stale_summaries(self, order):
+        pen = Product.objects.create(name="Pen", price=10)
+        LineItem.objects.create(order=order, product=pen, quantity=2)
+        pen.price = 15
+        pen.save()
+        refresh_sales_rollups()
+        assert DailyCouponSales.objects.get().revenue == 30
+
+    def test_deleting_order_removes_summary(self, order):
+        LineItem.objects.create(order=order, product=Product.objects.create(name="Pen", price=10), quantity=1)
+        order.delete()
+        assert not OrderSummary.objects.exists()
+
+    def test_rebuild_command_backfills_bulk_created_rows(self, order):
+        pen = Product.objects.create(name="Pen", price=10)
+        LineItem.objects.bulk_create([LineItem(order=order, product=pen, quantity=4)])
+        OrderSummary.objects.all().delete()
+
+        call_command("rebuild_order_summaries", chunk_size=1, stdout=StringIO())
+        assert OrderSummary.objects.get(order=order).total_amount == 40
+
+    def test_seed_data_builds_summaries(self):
+        call_command("seed_data", customers=5, orders=10, products=3, seed=1, stdout=StringIO())
+        assert OrderSummary.objects.count() == 10
+        assert OrderSummary.objects.filter(item_count=0).count() == 0
+
+
+class TestOrdersIndex:
+    @pytest.fixture
+    def orders(self):
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe", email="jane@dev.io")
+        return Order.objects.bulk_create([Order(customer=customer, order_date=f"2023-01-{day % 3 + 1:02d}") for day in range(7)])
+
+    def test_pages_follow_cursor(self, client, orders, django_assert_max_num_queries):
+        seen = []
+        url = reverse("index") + "?page_size=3"
+        while url:
+            with django_assert_max_num_queries(1):
+                response = client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            seen += [(order.order_date, order.pk) for order in response.context["orders"]]
+            next_cursor = response.context["next_cursor"]
+            url = next_cursor and reverse("index") + f"?page_size=3&after={next_cursor}"
+
+        assert len(seen) == 7
+        assert seen == sorted(seen, reverse=True)
+        assert b"Jane Doe" in response.content
+
+    def test_invalid_cursor(self, client):
+        assert client.get(reverse("index") + "?after=nope").status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_exports_need_a_login(self, client, orders):
+        # orders are exported by orders/export/ only, the index renders its page as usual
+        assert not client.get(reverse("index") + "?export=csv").streaming
+        assert client.get(reverse("orders-export")).status_code == status.HTTP_302_FOUND
+
+
+class StandInUpstream(BaseHTTPRequestHandler):
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"origin": "127.0.0.1", "headers": dict(self.headers)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops some of the concurrent connections, their retry comes a second later
+    request_queue_size = 64
+
+
+@pytest.fixture
+def upstream(settings):
+    server = StandInServer(("127.0.0.1", 0), StandInUpstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    settings.UPSTREAM_IP_URL = f"{url}/ip"
+    settings.UPSTREAM_HEADERS_URL = f"{url}/headers"
+    # sync only middleware would run every async view on the same thread
+    settings.MIDDLEWARE = [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar")]
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+class TestAsyncUserUpstreamViews:
+    def get_concurrently(self, path, count):
+        async def run():
+            client = AsyncClient()
+            responses = await asyncio.gather(*(client.get(path) for _ in range(count)))
+            await close_http_client()
+            return responses
+
+        return asyncio.run(run())
+
+    def test_ip(self, upstream):
+        (response,) = self.get_concurrently(reverse("users-ip"), 1)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"result": "127.0.0.1"}
+
+    def test_concurrent_requests_overlap(self, upstream):
+        started = time.perf_counter()
+        responses = self.get_concurrently(reverse("users-headers"), 4)
+        elapsed = time.perf_counter() - started
+
+        assert [response.json() for response in responses] == [{"result": "ok"}] * 4
+        # 8 upstream calls of 0.3s each would take 2.4s back to back
+        assert elapsed < 1.2
+
+    def test_per_call_loops_close_their_client(self, upstream, client, monkeypatch):
+        import httpx
+
+        closed = []
+        aclose = httpx.AsyncClient.aclose
+
+        async def record_aclose(self):
+            closed.append(self)
+            await aclose(self)
+
+        monkeypatch.setattr(httpx.AsyncClient, "aclose", record_aclose)
+        # the sync test client runs the view in a new loop per request, as WSGI does
+        for _ in range(2):
+            assert client.get(reverse("users-ip")).status_code == status.HTTP_200_OK
+        assert len(closed) == 2
+        assert all(http_client.is_closed for http_client in closed)
+
+    def test_upstream_timeout(self, upstream, settings):
+        settings.UPSTREAM_HTTP_CLIENT = {**settings.UPSTREAM_HTTP_CLIENT, "TIMEOUT": 0.05}
+        (response,) = self.get_concurrently(reverse("users-ip"), 1)
+        assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+
+
+# representative ORM queries of the hot access paths, each must be answered from an index
+QUERY_PLAN_CATALOGUE = {
+    "undelivered orders": lambda: Order.objects.filter(delivered_date__isnull=True).order_by("order_date"),
+    "orders by coupon in date range": lambda: Order.objects.filter(coupon_code="50OFF", order_date__range=(date(2023, 1, 1), date(2023, 2, 1))),
+    "orders shipped in date range": lambda: Order.objects.filter(shipped_date__range=(date(2023, 1, 1), date(2023, 2, 1))),
+    "orders delivered before cutoff": lambda: Order.objects.filter(delivered_date__lt=date(2023, 1, 1)),
+    "oldest orders to archive": lambda: Order.objects.filter(delivered_date__lt=date(2023, 1, 1)).order_by("delivered_date", "id")[:1000],
+    "archived orders of a month": lambda: ArchivedOrder.objects.filter(order_date__gte=date(2023, 1, 1), order_date__lt=date(2023, 2, 1)).order_by(
+        "id"
+    ),
+    "archived line items per order": lambda: ArchivedLineItem.objects.filter(order_id__in=[1, 2, 3]),
+    "orders index page": lambda: keyset_filter(Order.objects.all(), encode_cursor(date(2023, 1, 1), 10))[:51],
+    "line items per order": lambda: LineItem.objects.filter(order_id=1),
+    "line item of order and product": lambda: LineItem.objects.filter(order_id=1, product_id=1),
+    "order summaries": lambda: OrderSummary.objects.filter(order_id__in=[1, 2, 3]),
+    "customers in city and postcode": lambda: Customer.objects.filter(city="London", postcode="N1 1AA").order_by("id")[:21],
+    "customers in postcode": lambda: Customer.objects.filter(postcode="N1 1AA").order_by("id")[:21],
+    "claimable fulfilment jobs": lambda: FulfilmentJob.objects.filter(
+        Q(status=FulfilmentJob.PENDING) | Q(status=FulfilmentJob.CLAIMED, claimed_at__lt=datetime(2023, 1, 1, tzinfo=timezone.utc))
+    ).order_by("id")[:500],
+    "recently finished fulfilment jobs": lambda: FulfilmentJob.objects.filter(finished_at__gte=datetime(2023, 1, 1, tzinfo=timezone.utc)),
+}
+
+FULL_SCAN = re.compile(r"\bSCAN (TABLE )?\w+$", re.MULTILINE)
+
+
+# without table statistics SQLite picks an index whenever one fits, PostgreSQL
+# plans a full scan of the small test tables even when the right index exists
+@pytest.mark.skipif(connection.vendor != "sqlite", reason="the plans of empty PostgreSQL tables don't show missing indexes")
+@pytest.mark.parametrize("name", QUERY_PLAN_CATALOGUE)
+def test_query_plan_uses_an_index(name):
+    plan = QUERY_PLAN_CATALOGUE[name]().explain()
+    assert not FULL_SCAN.search(plan), f"{name} degraded to a full table scan:\n{plan}"
+
+
+class TestSalesAnalytics:
+    @pytest.fixture
+    def admin_api_client(self, api_client):
+        api_client.force_authenticate(User.objects.create_superuser("analyst", "analyst@dev.io", "some_pass"))
+        return api_client
+
+    @pytest.fixture
+    def sales(self):
+        call_command("seed_data", customers=10, orders=40, products=4, seed=2, stdout=StringIO())
+        call_command("refresh_sales_rollups", stdout=StringIO())
+
+    def test_revenue_matches_line_items(self, admin_api_client, sales):
+        response = admin_api_client.get(reverse("analytics-revenue"))
+        assert response.status_code == status.HTTP_200_OK
+        live = LineItem.objects.aggregate(revenue=Sum(F("quantity") * F("product__price")))["revenue"]
+        assert sum(row["revenue"] for row in response.data) == live
+        assert sum(row["orders"] for row in response.data) == 40
+
+        weekly = admin_api_client.get(reverse("analytics-revenue"), {"period": "week"}).data
+        assert sum(row["revenue"] for row in weekly) == live
+        assert len(weekly) <= len(response.data)
+
+    def test_top_products(self, admin_api_client, sales):
+        response = admin_api_client.get(reverse("analytics-top-products"), {"by": "units", "limit": 2})
+        live = LineItem.objects.values("product_id").annotate(units=Sum("quantity")).order_by("-units", "product_id")[:2]
+        assert [(row["product_id"], row["units"]) for row in response.data] == [(row["product_id"], row["units"]) for row in live]
+
+    def test_coupon_uplift(self, admin_api_client, sales):
+        rows = {row["coupon_code"]: row for row in admin_api_client.get(reverse("analytics-coupons")).data}
+        assert rows[""]["uplift"] == 0
+        assert sum(row["orders"] for row in rows.values()) == 40
+
+    def test_refresh_only_touches_new_orders(self, sales):
+        assert refresh_sales_rollups() == 0
+
+        order = Order.objects.create(customer=Customer.objects.first(), order_date=date(2020, 5, 1), coupon_code="50OFF")
+        LineItem.objects.create(order=order, product=Product.objects.first(), quantity=2)
+        assert refresh_sales_rollups() == 1
+        assert DailyCouponSales.objects.get(day=date(2020, 5, 1)).revenue == OrderSummary.objects.get(order=order).total_amount
+
+    def test_invalid_query(self, admin_api_client):
+        assert admin_api_client.get(reverse("analytics-top-products"), {"limit": 0}).status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_requires_an_admin(self, api_client):
+        assert api_client.get(reverse("analytics-revenue")).status_code == status.HTTP_403_FORBIDDEN
+        api_client.force_authenticate(User.objects.create_user("jane", "jane@dev.io", "some_pass"))
+        assert api_client.get(reverse("analytics-coupons")).status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestUsersAPICaching:
+    def test_list_is_paginated_and_hides_password(self, api_client):
+        User.objects.create_user("jane", "jane@dev.io", "some_pass")
+        response = api_client.get(reverse("users-list"))
+        assert response.data["count"] == 1
+        assert "password" not in response.data["results"][0]
+
+    def test_stores_passwords_hashed(self, api_client):
+        api_client.post(reverse("users-list"), data={"username": "john", "password": "FakePassword1234567890!"})
+        user = User.objects.get(username="john")
+        assert user.password != "FakePassword1234567890!"
+        assert user.check_password("FakePassword1234567890!")
+
+    def test_unchanged_list_returns_304_without_queries(self, api_client, django_assert_num_queries):
+        User.objects.create_user("jane", "jane@dev.io", "some_pass")
+        etag = api_client.get(reverse("users-list"))["ETag"]
+
+        with django_assert_num_queries(0):
+            response = api_client.get(reverse("users-list"), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_writes_invalidate_cached_responses(self, api_client):
+        user = User.objects.create_user("jane", "jane@dev.io", "some_pass")
+        detail_url = reverse("users-detail", args=[user.pk])
+        list_etag = api_client.get(reverse("users-list"))["ETag"]
+        detail_etag = api_client.get(detail_url)["ETag"]
+
+        api_client.post(reverse("users-list"), data={"username": "john", "password": "FakePassword1234567890!"})
+        response = api_client.get(reverse("users-list"), HTTP_IF_NONE_MATCH=list_etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["count"] == 2
+
+        api_client.patch(detail_url, data={"first_name": "Janet"})
+        response = api_client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["first_name"] == "Janet"
+
+        User.objects.filter(pk=user.pk).first().delete()
+        assert api_client.get(detail_url).status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestProfilingMiddleware:
+    @pytest.fixture(autouse=True)
+    def profiled(self, settings):
+        settings.MIDDLEWARE = ["utils.profiling.ProfilingMiddleware"] + [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar")]
+        metrics.reset()
+
+    def test_records_queries_and_latency_per_route(self, client):
+        call_command("seed_data", customers=3, orders=5, products=2, seed=1, stdout=StringIO())
+        for _ in range(3):
+            client.get(reverse("index"))
+
+        stats = client.get(reverse("metrics")).json()[""]
+        assert stats["requests"] == 3
+        assert stats["queries"]["p50"] > 0
+        assert stats["latency"]["p99"] >= stats["latency"]["p50"] > 0
+        assert stats["response_bytes"] > 0
+
+    def test_reports_repeated_query_shapes(self):
+        call_command("seed_data", customers=3, orders=5, products=2, seed=1, stdout=StringIO())
+        with recording() as recorder:
+            [order.customer.full_name for order in Order.objects.all()]
+        assert recorder.count == 6
+        assert list(recorder.duplicates().values()) == [5]
+
+    def test_prometheus_output(self, client):
+        client.get(reverse("index"))
+        body = client.get(reverse("metrics"), {"format": "prometheus"}).content.decode()
+        assert 'django_request_duration_seconds_bucket{route="",le="+Inf"} 1' in body
+        assert 'django_request_queries_count{route=""} 1' in body
+
+    def test_logs_slow_requests(self, client, settings, caplog):
+        settings.PROFILING = {**settings.PROFILING, "SLOW_REQUEST_THRESHOLD": 0}
+        with caplog.at_level(logging.WARNING, logger="utils.profiling"):
+            client.get(reverse("index"))
+        assert '"route": ""' in caplog.text
+
+    def test_metrics_are_internal(self, client):
+        assert client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1").status_code == status.HTTP_403_FORBIDDEN
+
+
+def lazy_customer_names(request):
+    return HttpResponse(", ".join(order.customer.full_name for order in Order.objects.all()))
+
+
+def count_customers_around_write(request):
+    before = Customer.objects.count()
+    Customer.objects.create(first_name="Ada", last_name="Lovelace", email=request.GET["email"])
+    return HttpResponse(f"{before},{Customer.objects.count()}")
+
+
+urlpatterns = [path("lazy/", lazy_customer_names), path("count-around-write/", count_customers_around_write)]
+
+
+class TestNPlusOneDetection:
+    @pytest.fixture(autouse=True)
+    def orders(self):
+        call_command("seed_data", customers=3, orders=5, products=2, seed=1, stdout=StringIO())
+
+    @pytest.fixture
+    def lazy_view(self, settings):
+        settings.ROOT_URLCONF = __name__
+        settings.MIDDLEWARE = ["utils.profiling.ProfilingMiddleware"] + [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar")]
+
+    def test_flags_lazy_foreign_keys(self):
+        with recording(NPlusOneDetector()) as detector:
+            [order.customer.full_name for order in Order.objects.all()]
+        (violation,) = detector.violations()
+        assert violation["count"] == 5
+        assert 'FROM "products_customer"' in violation["query"]
+        assert "tests.py" in violation["call_site"]
+
+    def test_flags_lazy_reverse_relations(self):
+        with recording(NPlusOneDetector()) as detector:
+            [list(order.lineitem_set.all()) for order in Order.objects.all()]
+        assert [violation["count"] for violation in detector.violations()] == [5]
+
+    def test_eager_loading_passes(self):
+        with recording(NPlusOneDetector()) as detector:
+            [order.customer.full_name for order in Order.objects.select_related("customer")]
+            [list(order.lineitem_set.all()) for order in Order.objects.prefetch_related("lineitem_set")]
+        assert detector.violations() == []
+
+    def test_flags_per_row_range_and_list_lookups(self):
+        customers = list(Customer.objects.all())
+        with recording(NPlusOneDetector()) as detector:
+            [Order.objects.filter(customer=customer, order_date__gte=date(2000, 1, 1)).count() for customer in customers]
+            [list(Order.objects.filter(customer_id__in=[customer.pk])) for customer in customers]
+        assert [violation["count"] for violation in detector.violations()] == [3, 3]
+
+    @pytest.mark.parametrize("runs, flagged", [(2, False), (3, True)])
+    def test_threshold_means_the_same_to_the_profiler(self, settings, runs, flagged):
+        threshold = settings.PROFILING["DUPLICATE_QUERY_THRESHOLD"]
+        with recording(NPlusOneDetector()) as detector:
+            for _ in range(runs):
+                Customer.objects.filter(pk=1).exists()
+        assert bool(detector.violations()) is bool(detector.duplicates(threshold)) is flagged
+
+    def test_walks_the_stack_of_repeated_statements_only(self, monkeypatch):
+        walks = []
+        monkeypatch.setattr("utils.nplusone.call_site", lambda: walks.append(1) or "here")
+        with recording(NPlusOneDetector()) as detector:
+            list(Order.objects.all())
+            list(Customer.objects.all())
+            [order.customer.full_name for order in Order.objects.all()]
+        # the second list of orders and the four customer loads after the first
+        assert len(walks) == 5
+        assert detector.violations()[0]["count"] == 5
+
+    def test_pytest_fixture_sees_test_queries(self, nplusone_detector):
+        [order.customer.full_name for order in Order.objects.all()]
+        assert nplusone_detector.violations()
+        # the fixture would otherwise fail this test on teardown
+        nplusone_detector.selects.clear()
+
+    def test_middleware_logs_structured_warning(self, client, lazy_view, caplog):
+        with caplog.at_level(logging.WARNING, logger="utils.nplusone"):
+            assert client.get("/lazy/").status_code == status.HTTP_200_OK
+        record = json.loads(caplog.records[0].args[0])
+        assert record["path"] == "/lazy/"
+        assert record["count"] == 5
+
+    def test_middleware_raises_in_strict_mode(self, client, lazy_view, settings):
+        settings.PROFILING = {**settings.PROFILING, "NPLUSONE": "raise"}
+        with pytest.raises(NPlusOneError):
+            client.get("/lazy/")
+
+
+class TestOrderBatchAPI:
+    @pytest.fixture
+    def staff_client(self, api_client):
+        api_client.force_authenticate(User.objects.create_user("importer", "importer@dev.io", "some_pass"))
+        return api_client
+
+    @pytest.fixture
+    def catalog(self):
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe", email="jane@dev.io")
+        Product.objects.bulk_create([Product(name="Pen", price=10), Product(name="Ink", price=25)])
+        return customer, list(Product.objects.order_by("id"))
+
+    def make_order(self, customer_id, product_ids, **fields):
+        return {"customer": customer_id, "order_date": "2023-01-05", "line_items": [{"product": pk, "quantity": 2} for pk in product_ids], **fields}
+
+    def test_creates_batch_with_constant_queries(self, staff_client, catalog, django_assert_max_num_queries):
+        customer, products = catalog
+        batch = [self.make_order(customer.id, [product.id for product in products], coupon_code="50OFF") for _ in range(50)]
+
+        with django_assert_max_num_queries(20):
+            response = staff_client.post(reverse("orders-batch"), batch, format="json")
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["created"] == 50
+        assert Order.objects.count() == 50
+        assert LineItem.objects.count() == 100
+        assert set(OrderSummary.objects.values_list("total_amount", flat=True)) == {70}
+
+    def test_checks_products_against_the_database(self, staff_client, catalog):
+        customer, products = catalog
+        product_catalog.get_many([product.id for product in products])
+        # written around the catalog, e.g. by another worker
+        Product.objects.filter(pk=products[1].pk).delete()
+        added = Product.objects.bulk_create([Product(name="Nib", price=5)]) and Product.objects.get(name="Nib")
+
+        response = staff_client.post(
+            reverse("orders-batch"), [self.make_order(customer.id, [products[1].id]), self.make_order(customer.id, [added.id])], format="json"
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["created"] == 1
+        assert response.data["errors"] == [{"index": 0, "errors": {"line_items": [f"Product {products[1].id} does not exist."]}}]
+
+    def test_accepts_ndjson(self, staff_client, catalog):
+        customer, products = catalog
+        body = "\n".join(json.dumps(self.make_order(customer.id, [products[0].id])) for _ in range(3))
+        response = staff_client.post(reverse("orders-batch"), body, content_type="application/x-ndjson")
+        assert response.status_code == status.HTTP_201_CREATED
+        assert Order.objects.count() == 3
+
+    def test_reports_errors_per_record(self, staff_client, catalog):
+        customer, products = catalog
+        batch = [
+            self.make_order(customer.id, [products[0].id]),
+            self.make_order(999, [products[0].id]),
+            self.make_order(customer.id, [999]),
+            {"customer": customer.id, "line_items": []},
+        ]
+        response = staff_client.post(reverse("orders-batch"), batch, format="json")
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["created"] == 1
+        assert [error["index"] for error in response.data["errors"]] == [1, 2, 3]
+        assert "customer" in response.data["errors"][0]["errors"]
+        assert "line_items" in response.data["errors"][1]["errors"]
+        assert {"order_date", "line_items"} <= set(response.data["errors"][2]["errors"])
+
+    def test_all_or_nothing(self, staff_client, catalog):
+        customer, products = catalog
+        batch = [self.make_order(customer.id, [products[0].id]), self.make_order(999, [products[0].id])]
+        response = staff_client.post(reverse("orders-batch") + "?all_or_nothing=1", batch, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    def test_reserves_ids_from_the_watermark(self, catalog):
+        customer, _ = catalog
+        Watermark.objects.create(name="products_order_ids", value=500)
+        with atomic_write():
+            assert allocate_ids(Order, 2) == range(501, 503)
+            Order.objects.create(id=503, customer=customer, order_date=date(2023, 1, 5))
+            # rows created past the counter are skipped
+            assert allocate_ids(Order, 2) == range(504, 506)
+        assert Watermark.objects.get(name="products_order_ids").value == 505
+
+    def test_requires_authentication(self, api_client):
+        assert api_client.post(reverse("orders-batch"), [], format="json").status_code == status.HTTP_403_FORBIDDEN
+
+
+# the exports read line items one chunk of orders at a time
+@pytest.mark.allow_repeated_queries
+class TestOrderExport:
+    @pytest.fixture(autouse=True)
+    def orders(self):
+        call_command("seed_data", customers=5, orders=30, products=4, seed=3, stdout=StringIO())
+
+    def test_csv_has_one_row_per_line_item(self, tmp_path):
+        output = tmp_path / "orders.csv"
+        call_command("export_orders", output=str(output), chunk_size=7, stderr=StringIO())
+        rows = list(csv.DictReader(output.open()))
+        assert len(rows) == LineItem.objects.count()
+        line_item = LineItem.objects.select_related("order__customer", "product").get(pk=rows[0]["line_item_id"])
+        assert rows[0]["customer_email"] == line_item.order.customer.email
+        assert int(rows[0]["price"]) == line_item.product.price
+
+    def test_ndjson_filters_by_status_and_date(self):
+        stdout = StringIO()
+        call_command("export_orders", format="ndjson", status="delivered", since=date(2000, 1, 1), chunk_size=4, stdout=stdout, stderr=StringIO())
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert len(records) == Order.objects.filter(delivered_date__isnull=False).count()
+        assert all(record["delivered_date"] and record["line_items"] for record in records)
+
+    def test_parquet(self, tmp_path):
+        parquet = pytest.importorskip("pyarrow.parquet")
+        output = tmp_path / "orders.parquet"
+        call_command("export_orders", format="parquet", output=str(output), chunk_size=10, stderr=StringIO())
+        table = parquet.read_table(output)
+        assert table.num_rows == LineItem.objects.count()
+        assert parquet.ParquetFile(output).num_row_groups == 3
+
+    def test_http_export_streams(self, client, django_assert_max_num_queries):
+        client.force_login(User.objects.create_user("ops", "ops@dev.io", "some_pass"))
+        with django_assert_max_num_queries(8):
+            response = client.get(reverse("orders-export"), {"format": "ndjson", "status": "pending"})
+            body = b"".join(response.streaming_content)
+        assert response["Content-Type"] == "application/x-ndjson"
+        assert len(body.splitlines()) == Order.objects.filter(shipped_date__isnull=True).count()
+
+    def test_http_export_rejects_unknown_format(self, client):
+        client.force_login(User.objects.create_user("ops", "ops@dev.io", "some_pass"))
+        assert client.get(reverse("orders-export"), {"format": "xml"}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestBenchmarkComparison:
+    def make_results(self, throughput=100.0, p95=0.05, queries=2, errors=0, rss=100000):
+        scenario = {
+            "requests": 10,
+            "errors": errors,
+            "throughput": throughput,
+            "latency": {"p50": p95 / 2, "p95": p95, "p99": p95},
+            "queries": {"mean": queries, "max": queries},
+        }
+        return {"modes": {"client": {"index": scenario, "server_metrics": {}}}, "peak_rss_kb": rss}
+
+    def test_within_tolerance(self):
+        assert compare(self.make_results(throughput=85, p95=0.055, rss=110000), self.make_results(), tolerance=0.2) == []
+
+    def test_flags_each_regression(self):
+        regressions = compare(self.make_results(throughput=50, p95=0.2, queries=3, errors=1, rss=200000), self.make_results(), tolerance=0.2)
+        assert len(regressions) == 5
+
+    def test_percentile(self):
+        assert percentile(list(range(1, 101)), 95) == 95
+        assert percentile([], 50) is None
+
+
+class TestStartup:
+    def test_prod_boot_skips_dev_and_optional_modules(self):
+        code = "\n".join(
+            [
+                "import json, sys",
+                "from django_playground.wsgi import application",
+                "from django.template import engines",
+                "from django.urls import resolve",
+                "resolve('/')",
+                "loader = engines['django'].engine.template_loaders[0]",
+                "print(json.dumps({'modules': sorted(sys.modules), 'loader': type(loader).__module__}))",
+            ]
+        )
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(ROOT_DIR),
+            "DJANGO_SETTINGS_MODULE": "django_playground.settings.prod",
+            "DJANGO_SECRET_KEY": "test",
+            "DJANGO_CACHE_BACKEND": "file",
+        }
+        booted = json.loads(subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout)
+
+        assert not {"debug_toolbar", "django_extensions", "httpx", "numpy", "pyarrow"} & set(booted["modules"])
+        assert booted["loader"] == "django.template.loaders.cached"
+
+    def test_prod_requires_a_secret_key(self):
+        env = {key: value for key, value in os.environ.items() if key != "DJANGO_SECRET_KEY"}
+        env.update(PYTHONPATH=str(ROOT_DIR), DJANGO_SETTINGS_MODULE="django_playground.settings.prod")
+        booted = subprocess.run(
+            [sys.executable, "-c", "from django_playground.wsgi import application"], env=env, cwd=ROOT_DIR, capture_output=True, text=True
+        )
+        assert booted.returncode
+        assert "Set DJANGO_SECRET_KEY" in booted.stderr
+
+    def test_prod_requires_a_shared_cache(self):
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(ROOT_DIR),
+            "DJANGO_SETTINGS_MODULE": "django_playground.settings.prod",
+            "DJANGO_SECRET_KEY": "test",
+            "DJANGO_CACHE_BACKEND": "locmem",
+        }
+        booted = subprocess.run(
+            [sys.executable, "-c", "from django_playground.wsgi import application"], env=env, cwd=ROOT_DIR, capture_output=True, text=True
+        )
+        assert booted.returncode
+        assert "Set DJANGO_CACHE_BACKEND" in booted.stderr
+
+    def test_benchmarks_use_their_own_postgres_database(self):
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(ROOT_DIR),
+            "DJANGO_SETTINGS_MODULE": "benchmarks.settings",
+            "DJANGO_SECRET_KEY": "test",
+            "DJANGO_CACHE_BACKEND": "file",
+            "DJANGO_DB_ENGINE": "postgresql",
+            "DJANGO_DB_NAME": "django_playground",
+        }
+        code = "from django.conf import settings; print(settings.DATABASES['default']['NAME'])"
+        booted = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT_DIR, capture_output=True, text=True)
+        assert booted.stdout.strip() == "django_playground_benchmark"
+
+    def test_slowest_imports(self):
+        importtime = "\n".join(
+            [
+                "import time: self [us] | cumulative | imported package",
+                "import time:       100 |        100 |   encodings.utf_8",
+                "import time:       200 |        300 | encodings",
+                "import time:      1000 |       5000 | django",
+                "import time:        50 |         50 | site",
+            ]
+        )
+        assert slowest_imports(importtime, 2) == [(5000, "django"), (300, "encodings")]
+
+
+class TestTestDatabase:
+    def test_starts_from_the_migrated_template(self):
+        # applied through the squashed migration, which records the ones it replaces
+        executor = MigrationExecutor(connection)
+        assert ("products", "0001_squashed_0008_customer_search") in executor.loader.graph.nodes
+        assert ("products", "0001_initial") not in executor.loader.graph.nodes
+        assert not executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+    def test_fingerprint_covers_the_seed(self):
+        assert fingerprint(connection, None) == fingerprint(connection, None)
+        assert fingerprint(connection, None) != fingerprint(connection, settings.TEST_DATABASE_SEED)
+
+
+def copy_database(name):
+    """
+    Copy the test database, which lives in memory, to the SQLite file `name`.
+    Needs a transactional test, the backup waits for open transactions.
+    """
+    connection.ensure_connection()
+    with sqlite3.connect(name) as target:
+        connection.connection.backup(target)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestReplicaRouting:
+    @pytest.fixture
+    def replicas(self, settings, tmp_path):
+        """Add SQLite aliases that are file copies of the primary at the time they are added."""
+        added = []
+
+        def add(alias, snapshot=True):
+            name = tmp_path / f"{alias}.sqlite3"
+            if snapshot:
+                copy_database(name)
+            else:
+                name = tmp_path / "missing" / name.name
+            connections.databases[alias] = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(name)}
+            added.append(alias)
+            settings.DATABASE_REPLICAS = list(added)
+
+        health.reset()
+        yield add
+        health.reset()
+        for alias in added:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+
+    @pytest.fixture
+    def customers(self):
+        Customer.objects.bulk_create(Customer(first_name="Grace", last_name="Hopper", email=f"grace{index}@dev.io") for index in range(3))
+
+    def test_reads_use_replica_until_first_write(self, replicas, customers):
+        replicas("replica")
+        Customer.objects.create(first_name="Alan", last_name="Turing", email="alan@dev.io")
+
+        with replica_scope():
+            assert Customer.objects.all().db == "replica"
+            assert Customer.objects.count() == 3
+            Customer.objects.create(first_name="Ada", last_name="Lovelace", email="ada@dev.io")
+            assert Customer.objects.all().db == "default"
+            assert Customer.objects.count() == 5
+
+        # outside of a request scope nothing is routed
+        assert Customer.objects.all().db == "default"
+
+    def test_atomic_blocks_read_from_primary(self, replicas, customers):
+        replicas("replica")
+        with replica_scope(), transaction.atomic():
+            assert Customer.objects.all().db == "default"
+
+    def test_unhealthy_replicas_are_skipped(self, replicas, customers):
+        replicas("broken", snapshot=False)
+        replicas("replica")
+        with replica_scope():
+            assert {Customer.objects.all().db for _ in range(10)} == {"replica"}
+
+        connections["replica"].close()
+        connections.databases["replica"]["NAME"] = connections.databases["broken"]["NAME"]
+        health.reset()
+        with replica_scope():
+            assert Customer.objects.all().db == "default"
+
+    def test_only_products_and_users_are_routed(self, replicas):
+        replicas("replica")
+        with replica_scope():
+            assert User.objects.all().db == "replica"
+            assert Group.objects.all().db == "default"
+
+    def test_request_reads_replica_then_sticks_to_primary(self, replicas, customers, client, settings):
+        settings.ROOT_URLCONF = __name__
+        replicas("replica")
+        Customer.objects.create(first_name="Alan", last_name="Turing", email="alan@dev.io")
+        assert client.get("/count-around-write/", {"email": "ada@dev.io"}).content == b"3,5"
+        # the next request starts on the replica again
+        assert client.get("/count-around-write/", {"email": "ada2@dev.io"}).content == b"3,6"
+
+
+class TestDatabaseConfiguration:
+    @pytest.fixture
+    def sqlite_files(self, settings, tmp_path):
+        """Open aliases on one SQLite file with the project engine and a short lock timeout."""
+        for alias in ("first", "second"):
+            connections.databases[alias] = {
+                **settings.DATABASES["default"],
+                "NAME": str(tmp_path / "db.sqlite3"),
+                "OPTIONS": {"timeout": 0.1},
+            }
+        with connections["first"].cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (value integer)")
+            cursor.execute("INSERT INTO counter VALUES (0)")
+        yield connections["first"], connections["second"]
+        for alias in ("first", "second"):
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+
+    def test_sqlite_pragmas(self, sqlite_files):
+        with sqlite_files[0].cursor() as cursor:
+            assert cursor.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+            assert cursor.execute("PRAGMA synchronous").fetchone() == (1,)
+            assert cursor.execute("PRAGMA cache_size").fetchone() == (settings.SQLITE_PRAGMAS["cache_size"],)
+
+    def test_write_transactions_take_the_write_lock_up_front(self, sqlite_files):
+        first, second = sqlite_files
+        with atomic_write(using="first"):
+            with first.cursor() as cursor:
+                cursor.execute("SELECT value FROM counter")
+            with pytest.raises(OperationalError, match="locked"), second.cursor() as cursor:
+                cursor.execute("UPDATE counter SET value = value + 1")
+
+    def test_read_transactions_leave_writers_alone(self, sqlite_files):
+        first, second = sqlite_files
+        with transaction.atomic(using="first"):
+            with first.cursor() as cursor:
+                cursor.execute("SELECT value FROM counter")
+            with second.cursor() as cursor:
+                cursor.execute("UPDATE counter SET value = value + 1")
+            # still reading the snapshot it began with
+            with first.cursor() as cursor:
+                assert cursor.execute("SELECT value FROM counter").fetchone() == (0,)
+
+    def test_snapshot_transactions_keep_their_first_read(self, sqlite_files):
+        first, second = sqlite_files
+        with atomic_snapshot(using="first"):
+            with first.cursor() as cursor:
+                cursor.execute("SELECT value FROM counter")
+            with second.cursor() as cursor:
+                cursor.execute("UPDATE counter SET value = value + 1")
+            with first.cursor() as cursor:
+                assert cursor.execute("SELECT value FROM counter").fetchone() == (0,)
+        with first.cursor() as cursor:
+            assert cursor.execute("SELECT value FROM counter").fetchone() == (1,)
+
+    def test_dead_persistent_connections_are_closed_on_request_start(self, sqlite_files, monkeypatch):
+        first, second = sqlite_files
+        second.ensure_connection()
+        monkeypatch.setattr(type(first), "is_usable", lambda connection: connection is not first)
+        request_started.send(sender=None)
+        assert first.connection is None
+        assert second.connection is not None
+
+
+@pytest.fixture
+def file_db(settings, tmp_path):
+    """A file copy of the test database, threads can't share the in memory one."""
+    copy_database(tmp_path / "stress.sqlite3")
+    connections.databases["stress"] = {**settings.DATABASES["default"], "NAME": str(tmp_path / "stress.sqlite3")}
+    yield "stress"
+    connections["stress"].close()
+    del connections["stress"]
+    del connections.databases["stress"]
+
+
+def run_threads(count, target, using):
+    errors = []
+
+    def worker(index):
+        try:
+            target(index)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections[using].close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+@pytest.mark.django_db(transaction=True)
+class TestOrderUpdates:
+    @pytest.fixture
+    def order(self):
+        return Order.objects.create(customer=Customer.objects.create(email="ada@dev.io"), order_date=date(2021, 1, 1))
+
+    def append_coupon(self, order):
+        order.coupon_code = (order.coupon_code or "") + "x"
+
+    def test_update_bumps_version(self, order):
+        updated = update_order(order.pk, self.append_coupon, ["coupon_code"])
+        order.refresh_from_db()
+        assert (order.coupon_code, order.version) == ("x", 1) == (updated.coupon_code, updated.version)
+
+    def test_atomic_view_writes_through_versions(self, client, monkeypatch):
+        Order.objects.create(id=1, customer=Customer.objects.create(email="ada@dev.io"), order_date=date(2021, 1, 1))
+        writes = []
+        monkeypatch.setattr("products.views.update_order", lambda *args, **kwargs: writes.append(args) or update_order(*args, **kwargs))
+        client.force_login(User.objects.create_user("ada"))
+        assert client.get(reverse("atomic")).status_code == status.HTTP_200_OK
+        assert [(order_id, fields) for order_id, _, fields in writes] == [(1, ["coupon_code"])]
+        # the missing order rolls the coupon and its version back
+        assert Order.objects.filter(pk=1, coupon_code=None, version=0).exists()
+
+    @pytest.mark.allow_repeated_queries
+    def test_conflicts_are_retried_then_reported(self, order):
+        def change_elsewhere(stale):
+            # a concurrent writer that always commits between our read and write
+            Order.objects.filter(pk=stale.pk).update(version=F("version") + 1)
+            self.append_coupon(stale)
+
+        with pytest.raises(OrderUpdateConflict):
+            update_order(order.pk, change_elsewhere, ["coupon_code"], retries=2, backoff=0)
+        order.refresh_from_db()
+        assert (order.coupon_code, order.version) == (None, 3)
+
+    def test_concurrent_optimistic_updates_lose_nothing(self, order, file_db):
+        threads, updates = 4, 10
+
+        def worker(index):
+            for _ in range(updates):
+                update_order(order.pk, self.append_coupon, ["coupon_code"], retries=100, backoff=0.001, using=file_db)
+
+        started = time.perf_counter()
+        run_threads(threads, worker, file_db)
+        stressed = Order.objects.using(file_db).get(pk=order.pk)
+        assert (len(stressed.coupon_code), stressed.version) == (threads * updates, threads * updates)
+        assert time.perf_counter() - started < 10
+
+    def test_locked_batches_are_processed_once(self, file_db):
+        customer = Customer.objects.using(file_db).create(email="queue@dev.io")
+        Order.objects.using(file_db).bulk_create(Order(customer_id=customer.pk, order_date=date(2021, 1, 1)) for _ in range(60))
+        processed = []
+
+        def ship(order):
+            processed.append(order.pk)
+            order.shipped_date = date(2021, 1, 2)
+
+        def worker(index):
+            while update_locked(Order.objects.filter(shipped_date__isnull=True), ship, ["shipped_date"], batch_size=7, using=file_db):
+                pass
+
+        run_threads(4, worker, file_db)
+        assert sorted(processed) == sorted(Order.objects.using(file_db).values_list("pk", flat=True))
+        assert set(Order.objects.using(file_db).values_list("version", flat=True)) == {1}
+
+
+@pytest.mark.allow_repeated_queries
+class TestFulfilment:
+    @pytest.fixture
+    def orders(self):
+        call_command("seed_data", customers=5, orders=40, products=3, seed=4, stdout=StringIO())
+
+    @pytest.fixture
+    def queued(self, orders):
+        enqueue_due()
+
+    def test_workers_ship_and_deliver(self, orders):
+        unshipped = Order.objects.filter(shipped_date__isnull=True).count()
+        in_transit = Order.objects.filter(shipped_date__isnull=False, delivered_date__isnull=True).count()
+        delivered = Order.objects.filter(delivered_date__isnull=False).count()
+
+        stdout = StringIO()
+        call_command("run_workers", enqueue=True, until_empty=True, batch_size=7, stdout=stdout)
+        assert f"Processed {unshipped + in_transit} jobs ({unshipped + in_transit} done, 0 failed)" in stdout.getvalue()
+        assert not Order.objects.filter(shipped_date__isnull=True).exists()
+        assert Order.objects.filter(delivered_date__isnull=False).count() == delivered + in_transit
+        assert Order.objects.filter(version=1).count() == unshipped + in_transit
+
+    def test_enqueue_skips_orders_with_open_jobs(self, orders):
+        enqueue_due()
+        queued = FulfilmentJob.objects.count()
+        enqueue_due(chunk_size=3)
+        assert FulfilmentJob.objects.count() == queued == Order.objects.filter(delivered_date__isnull=True).count()
+
+    def test_delivering_an_unshipped_order_fails(self, orders):
+        order = Order.objects.filter(shipped_date__isnull=True).first()
+        enqueue([order.pk], "deliver")
+        assert process_batch("worker", 10)["failed"] == 1
+        assert FulfilmentJob.objects.get().status == FulfilmentJob.FAILED
+        order.refresh_from_db()
+        assert order.delivered_date is None
+
+    def test_abandoned_claims_are_reclaimed(self, orders, settings):
+        order = Order.objects.filter(shipped_date__isnull=True).first()
+        enqueue([order.pk], "ship")
+        FulfilmentJob.objects.update(
+            status=FulfilmentJob.CLAIMED, worker="gone", claimed_at=timezone.now() - timedelta(seconds=settings.FULFILMENT_CLAIM_TIMEOUT + 1)
+        )
+        assert process_batch("worker", 10)["done"] == 1
+        assert FulfilmentJob.objects.get().worker == "worker"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_workers_claim_disjoint_batches(self, queued, file_db):
+        jobs = FulfilmentJob.objects.using(file_db)
+        finished = []
+
+        def worker(index):
+            while True:
+                stats = process_batch(f"worker-{index}", 3, using=file_db)
+                if stats is None:
+                    return
+                finished.append(stats["jobs"])
+
+        run_threads(4, worker, file_db)
+        assert sum(finished) == jobs.count() == jobs.filter(status=FulfilmentJob.DONE).count()
+        assert set(Order.objects.using(file_db).filter(fulfilment_jobs__isnull=False).values_list("version", flat=True)) == {1}
+
+    def test_stats_endpoint(self, api_client, queued):
+        assert api_client.get(reverse("fulfilment-stats")).status_code == status.HTTP_403_FORBIDDEN
+        api_client.force_authenticate(User.objects.create_superuser("ops", "ops@dev.io", "some_pass"))
+        stats = api_client.get(reverse("fulfilment-stats")).data
+        assert stats["pending"] == FulfilmentJob.objects.count()
+        assert stats["lag"] >= 0
+
+
+class TestProductCatalog:
+    @pytest.fixture
+    def products(self):
+        Product.objects.bulk_create(Product(name=f"Product {index}", price=10 * index) for index in range(1, 6))
+        return list(Product.objects.order_by("id"))
+
+    def test_warm_lookups_cost_no_queries(self, products, django_assert_num_queries):
+        catalog = ProductCatalog()
+        with django_assert_num_queries(1):
+            assert catalog.get(products[0].pk).name == "Product 1"
+        with django_assert_num_queries(0):
+            assert catalog.get_by_name("Product 2").price == 20
+            assert catalog.get_many([product.pk for product in products] + [0]).keys() == {product.pk for product in products}
+            assert catalog.get_by_name("missing") is None
+        assert catalog.stats()["hits"] == 7
+        assert catalog.stats()["misses"] == 2
+
+    @pytest.mark.allow_repeated_queries
+    def test_product_writes_reload_every_catalog(self, products, django_capture_on_commit_callbacks):
+        first, second = ProductCatalog(), ProductCatalog()
+        assert first.get(products[0].pk).price == second.get(products[0].pk).price == 10
+        with django_capture_on_commit_callbacks(execute=True):
+            products[0].price = 15
+            products[0].save()
+        assert first.get(products[0].pk).price == second.get(products[0].pk).price == 15
+        with django_capture_on_commit_callbacks(execute=True):
+            products[1].delete()
+        assert first.get_by_name("Product 2") is None
+        assert first.stats()["reloads"] == 3
+
+    def test_bounded_catalog_evicts_least_recently_used(self, products, django_assert_num_queries):
+        catalog = ProductCatalog(max_size=2)
+        first, second, third = products[:3]
+        catalog.get_many([first.pk, second.pk])
+        catalog.get(first.pk)
+        with django_assert_num_queries(1):
+            assert catalog.get_by_name(third.name) == third
+        # second was the least recently used
+        assert catalog.stats()["size"] == 2
+        assert catalog.stats()["evictions"] == 1
+        with django_assert_num_queries(0):
+            catalog.get_many([first.pk, third.pk])
+        with django_assert_num_queries(1):
+            catalog.get(second.pk)
+
+    def test_stats_endpoint(self, api_client):
+        assert api_client.get(reverse("catalog-stats")).status_code == status.HTTP_403_FORBIDDEN
+        api_client.force_authenticate(User.objects.create_superuser("ops", "ops@dev.io", "some_pass"))
+        assert api_client.get(reverse("catalog-stats")).data.keys() >= {"hits", "misses", "size"}
+
+
+class TestCustomerSearch:
+    @pytest.fixture
+    def customers(self):
+        people = [
+            ("Ada", "Lovelace", "London", "N1 1AA"),
+            ("Adam", "Smith", "London", "N1 1AA"),
+            ("Alan", "Turing", "Wilmslow", "SK9 1AA"),
+            ("Grace", "Hopper", "New York", "10001"),
+            ("Adrian", "Lovell", "London", "E1 6AN"),
+        ]
+        for first, last, city, postcode in people:
+            Customer.objects.create(first_name=first, last_name=last, city=city, postcode=postcode, email=f"{first}.{last}@dev.io".lower())
+
+    @pytest.fixture
+    def search(self, api_client):
+        api_client.force_authenticate(User.objects.create_superuser("support", "support@dev.io", "some_pass"))
+
+        def get(**params):
+            response = api_client.get(reverse("customers-search"), params)
+            assert response.status_code == status.HTTP_200_OK, response.data
+            return response.data
+
+        return get
+
+    def names(self, data):
+        return [f"{row['first_name']} {row['last_name']}" for row in data["results"]]
+
+    def test_names_containing_every_word(self, customers, search):
+        assert sorted(self.names(search(q="ada"))) == ["Ada Lovelace", "Adam Smith"]
+        assert self.names(search(q="LOVEL ada")) == ["Ada Lovelace"]
+
+    def test_typos_rank_the_closest_name_first(self, customers, search):
+        assert self.names(search(q="lovelase"))[0] == "Ada Lovelace"
+
+    def test_exact_filters(self, customers, search):
+        assert sorted(self.names(search(q="lov", city="London"))) == ["Ada Lovelace", "Adrian Lovell"]
+        assert self.names(search(city="London", postcode="N1 1AA")) == ["Ada Lovelace", "Adam Smith"]
+        assert self.names(search(email="grace.hopper@dev.io")) == ["Grace Hopper"]
+        assert self.names(search(email="grace.hopper@dev")) == []
+
+    def test_pagination(self, customers, search):
+        first = search(city="London", page_size=2)
+        assert len(first["results"]) == 2
+        assert "page=2" in first["next"]
+        last = search(city="London", page_size=2, page=2)
+        assert self.names(last) == ["Adrian Lovell"]
+        assert last["next"] is None
+
+    def test_index_follows_writes(self, customers, search):
+        Customer.objects.filter(last_name="Hopper").first().delete()
+        assert self.names(search(q="hopper")) == []
+        alan = Customer.objects.get(last_name="Turing")
+        alan.last_name = "Kay"
+        alan.save()
+        assert self.names(search(q="turing")) == []
+        assert self.names(search(q="kay alan")) == ["Alan Kay"]
+
+    def test_seeded_customers_are_searchable_and_rebuilt(self, search):
+        call_command("seed_data", customers=30, orders=0, products=1, seed=5, chunk_size=7, stdout=StringIO())
+        customer = Customer.objects.last()
+        assert customer.id in [row["id"] for row in search(q=customer.last_name, page_size=100)["results"]]
+
+        stdout = StringIO()
+        call_command("rebuild_customer_search", chunk_size=8, stdout=stdout)
+        assert "Indexed 30 customers" in stdout.getvalue()
+        assert customer.id in [row["id"] for row in search(q=customer.last_name, page_size=100)["results"]]
+
+    def test_invalid_queries(self, api_client, search):
+        assert api_client.get(reverse("customers-search"), {"q": "ab"}).status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get(reverse("customers-search")).status_code == status.HTTP_400_BAD_REQUEST
+        api_client.force_authenticate(None)
+        assert api_client.get(reverse("customers-search"), {"q": "ada"}).status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestAdmin:
+    @pytest.fixture
+    def orders(self):
+        call_command("seed_data", customers=5, orders=12, products=3, seed=6, stdout=StringIO())
+
+    @pytest.fixture
+    def changelist(self, admin_client, django_assert_max_num_queries):
+        def get(model, query=""):
+            # session, user, rows and their relations, count and date range, never a query per row
+            with django_assert_max_num_queries(10) as captured:
+                response = admin_client.get(reverse(f"admin:products_{model}_changelist") + query)
+            assert response.status_code == status.HTTP_200_OK
+            return response, [query["sql"] for query in captured.captured_queries]
+
+        return get
+
+    @pytest.mark.parametrize("model", ["order", "lineitem", "customer", "product"])
+    def test_changelists_make_a_bounded_number_of_queries(self, changelist, orders, model):
+        changelist(model)
+
+    def test_order_pages_follow_cursor_without_counting_the_table(self, changelist, orders, monkeypatch):
+        monkeypatch.setattr(products_admin.OrderAdmin, "list_per_page", 5)
+        seen = []
+        query = ""
+        while query is not None:
+            response, queries = changelist("order", query)
+            cl = response.context["cl"]
+            seen += [(order.order_date, order.pk) for order in cl.result_list]
+            query = cl.next_page_url
+            assert all("LIMIT" in sql for sql in queries if "COUNT(" in sql)
+            assert not any("OFFSET" in sql or "DISTINCT" in sql for sql in queries)
+
+        assert seen == sorted(seen, reverse=True)
+        assert len(seen) == Order.objects.count() == 12
+        assert cl.count_label == "12"
+        assert b"First page" in response.content
+
+    def test_count_is_capped(self, changelist, orders, settings):
+        settings.ADMIN_COUNT_LIMIT = 10
+        response, _ = changelist("lineitem")
+        assert response.context["cl"].count_label == "10+"
+        assert b"10+ line items" in response.content
+
+    def test_invalid_cursor(self, admin_client):
+        response = admin_client.get(reverse("admin:products_order_changelist") + "?cursor=nope")
+        assert response.status_code == status.HTTP_302_FOUND
+        assert response.url.endswith("?e=1")
+
+    def test_date_hierarchy_lists_the_days_between_the_first_and_last_order(self, changelist, orders):
+        first = Order.objects.order_by("order_date").first().order_date
+        last = Order.objects.filter(order_date__year=first.year, order_date__month=first.month).order_by("-order_date").first().order_date
+        response, queries = changelist("order", f"?order_date__year={first.year}&order_date__month={first.month}")
+        days = re.findall(r"order_date__day=(\d+)", response.content.decode())
+        assert [int(day) for day in days] == list(range(first.day, last.day + 1))
+        assert not any("DISTINCT" in sql for sql in queries)
+        assert all(order.order_date.month == first.month for order in response.context["cl"].result_list)
+
+    def test_searches_use_exact_or_indexed_lookups(self, changelist, orders):
+        order = Order.objects.first()
+        response, _ = changelist("order", f"?q={order.pk}")
+        assert list(response.context["cl"].result_list) == [order]
+
+        customer = Customer.objects.first()
+        response, queries = changelist("customer", f"?q={customer.last_name}")
+        assert customer in response.context["cl"].result_list
+        assert any("products_customer_search" in sql for sql in queries)
+        response, _ = changelist("customer", f"?q={customer.email}")
+        assert list(response.context["cl"].result_list) == [customer]
+
+    def test_autocomplete_counts_are_bounded(self, admin_client, orders, settings):
+        settings.ADMIN_COUNT_LIMIT = 3
+        params = {"app_label": "products", "model_name": "order", "field_name": "customer", "term": ""}
+        response = admin_client.get(reverse("admin:autocomplete"), params)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["results"]) == 3
+
+
+# archiving moves one chunk after another on purpose
+@pytest.mark.allow_repeated_queries
+class TestOrderArchive:
+    @pytest.fixture
+    def orders(self, settings, tmp_path):
+        settings.ARCHIVE_EXPORT_DIR = tmp_path / "archive"
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe", email="jane@dev.io")
+        products = [Product.objects.create(name="Apple", price=3), Product.objects.create(name="Pear", price=5)]
+        dates = [
+            # order, shipped and delivered dates
+            ("2021-01-05", "2021-01-06", "2021-01-08"),
+            ("2021-01-20", "2021-01-21", "2021-01-25"),
+            ("2021-02-03", "2021-02-04", "2021-02-10"),
+            ("2021-02-14", "2021-02-15", "2021-03-02"),
+            # same day as the first, still on its way
+            ("2021-01-05", "2021-01-06", None),
+            ("2023-06-01", None, None),
+        ]
+        # created one by one, bulk_create doesn't set the ids on SQLite
+        orders = [
+            Order.objects.create(customer=customer, order_date=ordered, shipped_date=shipped, delivered_date=delivered)
+            for ordered, shipped, delivered in dates
+        ]
+        LineItem.objects.bulk_create(
+            [LineItem(order=order, product=product, quantity=index + 1) for index, order in enumerate(orders) for product in products]
+        )
+        rebuild_order_summaries()
+        return orders
+
+    def archive(self, *args, **options):
+        stdout = StringIO()
+        call_command("archive_orders", *args, before=date(2022, 1, 1), stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_ingest_after_archiving_the_newest_orders(self, orders):
+        Order.objects.filter(pk__in=[orders[4].pk, orders[5].pk]).update(
+            order_date=date(2021, 3, 1), shipped_date=date(2021, 3, 2), delivered_date=date(2021, 3, 3)
+        )
+        self.archive()
+        assert not Order.objects.exists()
+
+        product = Product.objects.first()
+        records = [
+            {
+                "customer": orders[0].customer_id,
+                "order_date": date(2021, 4, 1),
+                "delivered_date": date(2021, 4, 2),
+                "line_items": [{"product": product.pk, "quantity": 1}],
+            }
+        ]
+        (order,) = create_orders(records)
+        assert order.pk > orders[5].pk
+        assert "Archived 1 orders" in self.archive()
+        assert ArchivedOrder.objects.count() == 7
+
+    def test_archive_tables_mirror_the_hot_tables(self):
+        for hot, archive in ((Order, ArchivedOrder), (LineItem, ArchivedLineItem)):
+            assert [field.column for field in archive._meta.concrete_fields] == [field.column for field in hot._meta.concrete_fields]
+
+    def test_moves_old_deliveries_with_their_line_items(self, orders):
+        assert "Archived 4 orders and 8 line items" in self.archive(chunk_size=3)
+
+        assert sorted(ArchivedOrder.objects.values_list("id", flat=True)) == [order.pk for order in orders[:4]]
+        assert ArchivedOrder.objects.get(pk=orders[3].pk).delivered_date == date(2021, 3, 2)
+        assert sorted(Order.objects.values_list("id", flat=True)) == [order.pk for order in orders[4:]]
+        assert ArchivedLineItem.objects.filter(order_id=orders[0].pk).count() == 2
+        assert not LineItem.objects.filter(order_id__in=[order.pk for order in orders[:4]]).exists()
+        assert OrderSummary.objects.count() == 2
+        assert "Archived 0 orders" in self.archive()
+
+    def test_interrupted_runs_resume(self, orders):
+        assert "Archived 2 orders" in self.archive(chunk_size=2, max_chunks=1)
+        assert ArchivedOrder.objects.count() == 2
+        assert "Archived 2 orders" in self.archive(chunk_size=2)
+        assert ArchivedOrder.objects.count() == 4
+
+    def test_reads_hot_or_hot_and_archived_orders(self, orders):
+        self.archive()
+        customer = orders[0].customer_id
+        assert [row["id"] for row in read_orders("id", customer_id=customer).order_by("id")] == [order.pk for order in orders[4:]]
+        everything = read_orders("id", "order_date", include_archive=True, customer_id=customer).order_by("-order_date", "-id")
+        assert [row["id"] for row in everything] == [
+            order.pk for order in sorted(orders, key=lambda order: (order.order_date, order.pk), reverse=True)
+        ]
+        assert len(everything[:3]) == 3
+        pears = read_line_items("order_id", include_archive=True, product__name="Pear", order__order_date__lt=date(2021, 2, 1))
+        assert sorted(row["order_id"] for row in pears) == sorted(order.pk for order in orders if order.order_date < "2021-02-01")
+
+    def test_rollups_include_archived_orders(self, orders):
+        refresh_sales_rollups(full=True)
+        before = set(DailyProductSales.objects.values_list("day", "product_id", "units", "revenue", "orders"))
+        coupons = set(DailyCouponSales.objects.values_list("day", "coupon_code", "orders", "units", "revenue"))
+        self.archive()
+
+        refresh_sales_rollups(since=date(2021, 1, 1), until=date(2021, 12, 31))
+        assert set(DailyProductSales.objects.values_list("day", "product_id", "units", "revenue", "orders")) == before
+        assert set(DailyCouponSales.objects.values_list("day", "coupon_code", "orders", "units", "revenue")) == coupons
+
+    def test_exports_one_compressed_partition_per_month(self, orders, settings, django_capture_on_commit_callbacks):
+        self.archive(chunk_size=2, max_chunks=1)
+        assert "Exported 1 monthly partitions" in self.archive("--export", max_chunks=0)
+        january = settings.ARCHIVE_EXPORT_DIR / "orders-2021-01.ndjson.gz"
+        with gzip.open(january, "rt") as partition:
+            assert [json.loads(line)["order_id"] for line in partition] == [orders[0].pk, orders[1].pk]
+
+        # February gets its file, January is complete and left alone
+        assert "Exported 1 monthly partitions" in self.archive("--export")
+        assert sorted(path.name for path in settings.ARCHIVE_EXPORT_DIR.iterdir()) == ["orders-2021-01.ndjson.gz", "orders-2021-02.ndjson.gz"]
+        with gzip.open(settings.ARCHIVE_EXPORT_DIR / "orders-2021-02.ndjson.gz", "rt") as partition:
+            records = [json.loads(line) for line in partition]
+        assert [record["order_id"] for record in records] == [orders[2].pk, orders[3].pk]
+        assert [item["quantity"] for item in records[1]["line_items"]] == [4, 4]
+
+        # archiving more of January discards its partition, the next export rewrites it whole
+        Order.objects.filter(pk=orders[4].pk).update(delivered_date=date(2021, 6, 1))
+        with django_capture_on_commit_callbacks(execute=True):
+            self.archive()
+        assert not january.exists()
+        self.archive("--export")
+        with gzip.open(january, "rt") as partition:
+            assert [json.loads(line)["order_id"] for line in partition] == [orders[0].pk, orders[1].pk, orders[4].pk]
+
+
+@pytest.mark.allow_repeated_queries
+class TestCustomerPurge:
+    @pytest.fixture
+    def customers(self, settings, tmp_path):
+        settings.ARCHIVE_EXPORT_DIR = tmp_path / "archive"
+        call_command("seed_data", customers=10, orders=80, products=4, seed=7, stdout=StringIO())
+        enqueue_due()
+        call_command("archive_orders", before=date.today(), chunk_size=20, max_chunks=1, stdout=StringIO())
+        return list(Customer.objects.order_by("id").values_list("id", flat=True)[:5])
+
+    def table_state(self):
+        models = [Customer, Order, LineItem, OrderSummary, FulfilmentJob, ArchivedOrder, ArchivedLineItem]
+        state = {model._meta.label: sorted(model.objects.values_list("pk", flat=True)) for model in models}
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM products_customer_search ORDER BY rowid")
+            state["search"] = cursor.fetchall()
+        return state
+
+    def test_same_end_state_as_the_orm_cascade(self, customers, settings, django_capture_on_commit_callbacks):
+        assert ArchivedOrder.objects.filter(customer_id__in=customers).exists()
+        assert FulfilmentJob.objects.filter(order__customer_id__in=customers).exists()
+        with transaction.atomic():
+            _, cascaded = Customer.objects.filter(id__in=customers).delete()
+            expected = self.table_state()
+            transaction.set_rollback(True)
+
+        call_command("archive_orders", "--export", max_chunks=0, stdout=StringIO())
+        exported = {path.name for path in settings.ARCHIVE_EXPORT_DIR.iterdir()}
+        purged = {
+            f"orders-{order_date:%Y-%m}.ndjson.gz"
+            for order_date in ArchivedOrder.objects.filter(customer_id__in=customers).values_list("order_date", flat=True)
+        }
+        with django_capture_on_commit_callbacks(execute=True):
+            deleted = purge_customers(Customer.objects.filter(id__in=customers), chunk_size=2)
+        assert deleted == {label: count for label, count in cascaded.items() if count}
+        assert self.table_state() == expected
+        # exported partitions holding the purged customers' orders are gone until the next export
+        assert {path.name for path in settings.ARCHIVE_EXPORT_DIR.iterdir()} == exported - purged
+
+    def test_deletes_are_set_based(self, customers, django_assert_max_num_queries):
+        # the same statements whatever the number of orders and line items
+        with django_assert_max_num_queries(15) as captured:
+            purge_customers(Customer.objects.filter(id__in=customers), chunk_size=len(customers))
+        assert not any(query["sql"].startswith('SELECT "products_lineitem"') for query in captured.captured_queries)
+
+    def test_command_reports_progress_and_dry_runs(self, customers):
+        orders = Order.objects.filter(customer_id__in=customers).count()
+        stdout = StringIO()
+        call_command("purge_customers", *map(str, customers), dry_run=True, stdout=stdout)
+        assert f"{orders} products.Order" in stdout.getvalue()
+        assert "5 products.Customer" in stdout.getvalue()
+        assert Customer.objects.filter(id__in=customers).count() == 5
+
+        stdout = StringIO()
+        call_command("purge_customers", *map(str, customers), chunk_size=2, stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        assert [line.split(":")[0] for line in lines[:3]] == ["2/5 customers", "4/5 customers", "5/5 customers"]
+        assert "Purged 5 customers" in lines[-1] and f"{orders} products.Order" in lines[-1]
+        assert not Customer.objects.filter(id__in=customers).exists()
+
+    def test_requires_ids(self):
+        with pytest.raises(CommandError):
+            call_command("purge_customers", stdout=StringIO())
+
+
+# counting reads one window of order ids after another
+@pytest.mark.allow_repeated_queries
+class TestProductAffinity:
+    @pytest.fixture
+    def products(self):
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe", email="jane@dev.io")
+        products = {name: Product.objects.create(name=name, price=price) for name, price in (("Tea", 3), ("Milk", 2), ("Sugar", 1), ("Soap", 4))}
+
+        def order(*names):
+            order = Order.objects.create(customer=customer, order_date=date(2023, 1, 1))
+            LineItem.objects.bulk_create([LineItem(order=order, product=products[name], quantity=1) for name in names])
+
+        for basket in [("Tea", "Milk")] * 3 + [("Tea", "Milk", "Sugar"), ("Tea", "Sugar"), ("Milk", "Sugar", "Sugar"), ("Soap",), ("Soap", "Tea")]:
+            order(*basket)
+        products["order"] = order
+        return products
+
+    def neighbours(self):
+        return list(ProductNeighbour.objects.order_by("product_id", "rank").values_list("product_id", "neighbour_id", "orders", "lift"))
+
+    def test_vectorised_counts_match_a_count_per_order(self):
+        rng = random.Random(3)
+        lines = [(rng.randrange(40), rng.randrange(12)) for _ in range(400)]
+        expected = Counter()
+        baskets = {}
+        for order_id, product_id in lines:
+            baskets.setdefault(order_id, set()).add(product_id)
+        for basket in baskets.values():
+            expected.update(itertools.combinations_with_replacement(sorted(basket), 2))
+
+        keys, counts, orders = count_pairs(*zip(*lines))
+        assert orders == len(baskets)
+        assert {(int(key) >> 32, int(key) & 0xFFFFFFFF): int(count) for key, count in zip(keys, counts)} == expected
+
+    def test_neighbours_ranked_by_lift(self, products):
+        stdout = StringIO()
+        call_command("build_product_affinity", min_orders=1, stdout=stdout)
+        assert "Counted 8 orders" in stdout.getvalue()
+
+        tea, milk, sugar, soap = (products[name].pk for name in ("Tea", "Milk", "Sugar", "Soap"))
+        # 8 orders: tea in 6, milk in 5, sugar in 3, soap in 2
+        assert ProductCooccurrence.objects.get(product_id=min(tea, milk), other_id=max(tea, milk)).orders == 4
+        assert [(neighbour, orders) for product, neighbour, orders, _ in self.neighbours() if product == sugar] == [(milk, 2), (tea, 2)]
+        lifts = {(product, neighbour): lift for product, neighbour, _, lift in self.neighbours()}
+        assert lifts[tea, milk] == lifts[milk, tea] == pytest.approx(4 * 8 / (6 * 5))
+        assert lifts[soap, tea] == pytest.approx(1 * 8 / (2 * 6))
+
+        call_command("build_product_affinity", stdout=StringIO())
+        assert (soap, tea) not in {(product, neighbour) for product, neighbour, *_ in self.neighbours()}
+
+    def test_incremental_runs_match_a_full_count(self, products):
+        call_command("build_product_affinity", min_orders=1, chunk_size=3, stdout=StringIO())
+        products["order"]("Soap", "Milk")
+        products["order"]("Tea", "Milk")
+        stdout = StringIO()
+        call_command("build_product_affinity", min_orders=1, chunk_size=3, stdout=stdout)
+        assert "Counted 2 orders" in stdout.getvalue()
+        incremental = self.neighbours(), set(ProductCooccurrence.objects.values_list("product_id", "other_id", "orders"))
+
+        call_command("build_product_affinity", full=True, min_orders=1, stdout=StringIO())
+        assert (self.neighbours(), set(ProductCooccurrence.objects.values_list("product_id", "other_id", "orders"))) == incremental
+
+    def test_full_count_includes_archived_orders(self, products):
+        call_command("build_product_affinity", full=True, min_orders=1, stdout=StringIO())
+        before = self.neighbours()
+        Order.objects.filter(pk__in=Order.objects.order_by("id").values("pk")[:4]).update(
+            shipped_date=date(2023, 1, 2), delivered_date=date(2023, 1, 3)
+        )
+        call_command("archive_orders", before=date(2024, 1, 1), stdout=StringIO())
+        assert ArchivedOrder.objects.count() == 4
+
+        call_command("build_product_affinity", full=True, min_orders=1, stdout=StringIO())
+        assert self.neighbours() == before
+
+    def test_first_run_counts_archived_orders(self, products):
+        Order.objects.filter(pk__in=Order.objects.order_by("id").values("pk")[:4]).update(
+            shipped_date=date(2023, 1, 2), delivered_date=date(2023, 1, 3)
+        )
+        call_command("archive_orders", before=date(2024, 1, 1), stdout=StringIO())
+        stdout = StringIO()
+        call_command("build_product_affinity", min_orders=1, stdout=stdout)
+        assert "Counted 8 orders" in stdout.getvalue()
+
+    def test_concurrent_runs_count_orders_once(self, products, monkeypatch):
+        call_command("build_product_affinity", min_orders=1, stdout=StringIO())
+        products["order"]("Tea", "Milk")
+        stream_counts = affinity.stream_counts
+
+        def finished_elsewhere(*args, **kwargs):
+            counts = stream_counts(*args, **kwargs)
+            # another run saved the same window while this one counted
+            Watermark.objects.filter(name=affinity.AFFINITY_WATERMARK).update(value=F("value") + 1)
+            return counts
+
+        monkeypatch.setattr(affinity, "stream_counts", finished_elsewhere)
+        before = set(ProductCooccurrence.objects.values_list("product_id", "other_id", "orders"))
+        with pytest.raises(CommandError, match="Another product affinity run"):
+            call_command("build_product_affinity", min_orders=1, stdout=StringIO())
+        assert set(ProductCooccurrence.objects.values_list("product_id", "other_id", "orders")) == before
+
+    def test_endpoint_serves_neighbours_in_one_query(self, client, products, django_assert_num_queries):
+        call_command("build_product_affinity", stdout=StringIO())
+        url = reverse("product-neighbours", args=[products["Sugar"].pk])
+        client.get(url)
+        # the product catalog is loaded, only the neighbours are read
+        with django_assert_num_queries(1):
+            response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert [row["name"] for row in response.json()["results"]] == ["Milk", "Tea"]
+        assert response.json()["results"][0]["orders"] == 2
+        assert client.get(reverse("product-neighbours", args=[0])).status_code == status.HTTP_404_NOT_FOUND
+
+
+# the snapshot reads one window of order ids after another
+@pytest.mark.allow_repeated_queries
+class TestCustomerAnalytics:
+    @pytest.fixture
+    def snapshot(self, settings, tmp_path):
+        settings.ANALYTICS_SNAPSHOT_DIR = tmp_path / "snapshots"
+        call_command("seed_data", customers=12, orders=80, products=4, seed=7, stdout=StringIO())
+        call_command("customer_analytics", refresh=True, chunk_size=7, stdout=StringIO())
+        return snapshots.get()
+
+    def metrics(self, snapshot):
+        metrics = customer_metrics(snapshot)
+        return [
+            (int(customer), int(frequency), (snapshot.as_of - numpy.timedelta64(int(recency), "D")).item(), int(monetary))
+            for customer, frequency, recency, monetary in zip(metrics["customer"], metrics["frequency"], metrics["recency"], metrics["monetary"])
+        ]
+
+    def test_metrics_match_orm_aggregation(self, snapshot):
+        assert snapshot.meta["orders"] == 80
+        assert self.metrics(snapshot) == orm_metrics()
+
+    def test_quintiles_score_ties_together(self):
+        assert quintiles(numpy.array([1, 1, 1, 1, 1, 1, 2, 3, 8, 9])).tolist() == [1, 1, 1, 1, 1, 1, 4, 4, 5, 5]
+        assert quintiles(numpy.array([], dtype=numpy.int64)).tolist() == []
+
+    def test_includes_archived_orders(self, snapshot):
+        before = orm_metrics()
+        Order.objects.filter(pk__in=Order.objects.order_by("id").values("pk")[:30]).update(
+            shipped_date=F("order_date"), delivered_date=F("order_date")
+        )
+        call_command("archive_orders", before=date(2100, 1, 1), stdout=StringIO())
+        call_command("customer_analytics", refresh=True, stdout=StringIO())
+        assert self.metrics(snapshots.get()) == before
+        assert orm_metrics() == before
+
+    def test_cohort_retention(self, snapshot):
+        months = {}
+        for customer, day, amount in Order.objects.annotate(amount=Sum(F("lineitem__quantity") * F("lineitem__product__price"))).values_list(
+            "customer_id", "order_date", "amount"
+        ):
+            months.setdefault(customer, []).append((day.year * 12 + day.month - 1, amount or 0))
+        cohorts = {}
+        for orders in months.values():
+            first = min(month for month, _ in orders)
+            cohort = cohorts.setdefault(first, {"customers": 0, "active": Counter(), "revenue": Counter()})
+            cohort["customers"] += 1
+            cohort["active"].update({month - first for month, _ in orders})
+            for month, amount in orders:
+                cohort["revenue"][month - first] += amount
+
+        results = cohort_retention(snapshot, months=6)
+        assert [row["cohort"] for row in results] == [f"{first // 12}-{first % 12 + 1:02}" for first in sorted(cohorts)]
+        for row, first in zip(results, sorted(cohorts)):
+            cohort = cohorts[first]
+            assert row["customers"] == cohort["customers"]
+            assert row["retention"] == [round(cohort["active"][offset] / cohort["customers"], 4) for offset in range(len(row["retention"]))]
+            assert row["value"][-1] == round(sum(cohort["revenue"][offset] for offset in range(len(row["value"]))) / cohort["customers"], 2)
+
+    def test_reloads_a_refreshed_snapshot(self, snapshot, settings):
+        assert snapshots.get() is snapshot
+        assert isinstance(snapshot.customer, numpy.memmap)
+        for _ in range(2):
+            call_command("customer_analytics", refresh=True, stdout=StringIO())
+        assert snapshots.get() is not snapshot
+        # the current version and the one before it
+        assert len([path for path in settings.ANALYTICS_SNAPSHOT_DIR.iterdir() if path.is_dir()]) == 2
+
+    def test_command_reports(self, snapshot):
+        stdout = StringIO()
+        call_command("customer_analytics", stdout=stdout)
+        assert "RFM segments" in stdout.getvalue()
+        assert "Monthly cohort retention" in stdout.getvalue()
+
+    def test_api(self, snapshot, admin_client, settings, tmp_path):
+        response = admin_client.get(reverse("customer-analytics-rfm"))
+        assert response.status_code == status.HTTP_200_OK
+        segments = response.json()["results"]
+        assert sum(row["customers"] for row in segments) == snapshot.meta["customers"]
+        assert sum(row["revenue"] for row in segments) == sum(row[3] for row in orm_metrics())
+        assert "metrics" in snapshot.results
+
+        customer, frequency, last_order, monetary = orm_metrics()[0]
+        row = admin_client.get(reverse("customer-analytics-rfm"), {"customer": customer}).json()
+        assert (row["frequency"], row["monetary"], row["recency"]) == (frequency, monetary, (snapshot.as_of.item() - last_order).days)
+        assert 1 <= row["r"] <= 5 and row["clv"] > 0
+        assert admin_client.get(reverse("customer-analytics-rfm"), {"customer": 999999}).status_code == status.HTTP_404_NOT_FOUND
+
+        cohorts = admin_client.get(reverse("customer-analytics-cohorts"), {"months": 3}).json()["results"]
+        assert all(len(row["retention"]) <= 3 and row["retention"][0] == 1 for row in cohorts)
+
+        settings.ANALYTICS_SNAPSHOT_DIR = tmp_path / "missing"
+        assert admin_client.get(reverse("customer-analytics-cohorts")).status_code == status.HTTP_503_SERVICE_UNAVAILABLE
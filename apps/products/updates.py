@@ -0,0 +1,56 @@
+import random
+import time
+
+from django.db import router
+from django.db.models import F
+
+from utils.db import atomic_write
+
+from .models import Order
+
+
+class OrderUpdateConflict(Exception):
+    pass
+
+
+def update_order(order_id, change, fields, retries=5, backoff=0.01, using=None):
+    """
+    Apply `change(order)` without holding a lock: the new values of `fields`
+    are written with `UPDATE ... WHERE version = <read version>`, and if
+    another writer got there first the order is read again and `change`
+    reapplied, at most `retries` more times.
+    """
+    using = using or router.db_for_write(Order)
+    for attempt in range(retries + 1):
+        # read where the write goes, a lagging replica would never match the version
+        order = Order.objects.using(using).get(pk=order_id)
+        change(order)
+        updated = (
+            Order.objects.using(using)
+            .filter(pk=order_id, version=order.version)
+            .update(version=F("version") + 1, **{field: getattr(order, field) for field in fields})
+        )
+        if updated:
+            order.version += 1
+            return order
+        if attempt < retries:
+            # full jitter keeps the losers of a race from colliding again
+            time.sleep(random.uniform(0, backoff * 2**attempt))
+    raise OrderUpdateConflict(f"Order {order_id} kept changing, gave up after {retries + 1} attempts.")
+
+
+def update_locked(orders, change, fields, batch_size=100, using=None):
+    """
+    Lock up to `batch_size` of `orders` with `SELECT ... FOR UPDATE SKIP
+    LOCKED`, apply `change` to each and save them in the same transaction.
+    Concurrent workers skip each other's rows instead of queueing behind them;
+    SQLite has no row locks, its transactions take the database write lock.
+    """
+    using = using or router.db_for_write(Order)
+    with atomic_write(using=using):
+        batch = list(orders.using(using).select_for_update(skip_locked=True).order_by("id")[:batch_size])
+        for order in batch:
+            change(order)
+            order.version += 1
+        Order.objects.using(using).bulk_update(batch, [*fields, "version"])
+    return batch
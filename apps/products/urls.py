@@ -1,15 +1,37 @@
 from django.urls import path
-from products.api.views import UserViewSet
+from products.api.views import (
+    CatalogStatsView,
+    CustomerAnalyticsViewSet,
+    CustomerSearchView,
+    FulfilmentStatsView,
+    OrderBatchView,
+    ProductNeighboursView,
+    SalesAnalyticsViewSet,
+    UserViewSet,
+    user_headers,
+    user_ip,
+)
 from rest_framework import routers
 
 from . import views
 
 urlpatterns = [
-    path("", views.index),
+    path("", views.index, name="index"),
     path("atomic/", views.atomic_test, name="atomic"),
     path("test/", views.test_view, name="test"),
+    # async views, kept at the paths of the former UserViewSet actions
+    path("users/ip/", user_ip, name="users-ip"),
+    path("users/headers/", user_headers, name="users-headers"),
+    path("orders/batch/", OrderBatchView.as_view(), name="orders-batch"),
+    path("orders/export/", views.export_orders, name="orders-export"),
+    path("customers/search/", CustomerSearchView.as_view(), name="customers-search"),
+    path("catalog/stats/", CatalogStatsView.as_view(), name="catalog-stats"),
+    path("products/<int:pk>/neighbours/", ProductNeighboursView.as_view(), name="product-neighbours"),
+    path("fulfilment/stats/", FulfilmentStatsView.as_view(), name="fulfilment-stats"),
 ]
 
 router = routers.SimpleRouter()
 router.register(r"users", UserViewSet, basename="users")
+router.register(r"analytics/customers", CustomerAnalyticsViewSet, basename="customer-analytics")
+router.register(r"analytics", SalesAnalyticsViewSet, basename="analytics")
 urlpatterns += router.urls
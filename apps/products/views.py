@@ -1,38 +1,69 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db.models import Avg, F, Sum
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.dateparse import parse_date
 
+from utils.db import atomic_write
+
+from .export import CONTENT_TYPES, STATUSES, WRITERS, filter_orders, iter_chunks
 from .models import Customer, LineItem, Order, Product
+from .pagination import InvalidCursor, keyset_page
+from .updates import update_order
+
+INDEX_FIELDS = ["id", "order_date", "customer__first_name", "customer__last_name"]
 
 
 def index(request):
-    orders = Order.objects.select_related("customer").all()
+    try:
+        page_size = min(int(request.GET.get("page_size", settings.ORDERS_PAGE_SIZE)), settings.ORDERS_MAX_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid page_size")
+    if page_size < 1:
+        return HttpResponseBadRequest("Invalid page_size")
 
-    for order in orders:
-        print(order.customer.full_name)
+    orders = Order.objects.select_related("customer").only(*INDEX_FIELDS)
+    try:
+        orders, next_cursor = keyset_page(orders, request.GET.get("after"), page_size)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
 
-    return render(request, "products/index.html", {"orders": orders})
+    return render(request, "products/index.html", {"orders": orders, "next_cursor": next_cursor, "page_size": page_size})
 
 
 @login_required
 def atomic_test(request):
-    with transaction.atomic():
-        orders = Order.objects.select_related("customer").get(pk=1)
-        orders.coupon_code = "DISCOUNT2021"
-        orders.save()
-        try:
-            # pass
-            failed_query = Order.objects.select_related("customer").get(pk=999999)
-        except Order.DoesNotExist:
-            print("Failed")
+    with atomic_write():
+        # a versioned write, so a concurrent update_order of this order retries instead of being overwritten
+        order = update_order(1, lambda order: setattr(order, "coupon_code", "DISCOUNT2021"), ["coupon_code"])
+        if not Order.objects.filter(pk=999999).exists():
             transaction.set_rollback(True)
 
-    return render(request, "products/index.html", {"orders": [orders]})
+    return render(request, "products/index.html", {"orders": [order]})
 
 
 @login_required
 def test_view(request):
     return render(request, "products/index.html", {"orders": []})
+
+
+@login_required
+def export_orders(request):
+    export_format = request.GET.get("format", "csv")
+    status = request.GET.get("status") or None
+    if export_format not in WRITERS or (status and status not in STATUSES):
+        return HttpResponseBadRequest("Invalid format or status")
+    try:
+        since = parse_date(request.GET.get("since", ""))
+        until = parse_date(request.GET.get("until", ""))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid date")
+
+    chunks = iter_chunks(filter_orders(since, until, status), settings.ORDERS_EXPORT_CHUNK_SIZE)
+    response = StreamingHttpResponse(WRITERS[export_format](chunks), content_type=CONTENT_TYPES[export_format])
+    response["Content-Disposition"] = f'attachment; filename="orders.{export_format}"'
+    return response
@@ -0,0 +1,126 @@
+"""
+Compare customer RFM inputs aggregated through the ORM with the NumPy
+snapshot of products.analytics, on a seeded benchmark database.
+
+    python -m benchmarks.analytics --scale medium
+    python -m benchmarks.analytics --skip-seed --runs 5
+
+The ORM side is the `annotate()` queries a report would run per request over
+the hot and archived orders, the snapshot side is split into refreshing it
+(the command's job), mapping it in a fresh worker and computing the metrics
+and cohorts. Both must agree on every customer. Results are written to
+benchmarks/analytics.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+# the prod profile requires a key and a shared cache, a throwaway key is fine for a local database
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark-only-secret-key")
+os.environ.setdefault("DJANGO_CACHE_BACKEND", "file")
+
+
+def orm_metrics():
+    from django.db.models import Count, F, Max, Sum
+    from products.models import Customer
+
+    # one aggregation per table, joining both in one query would multiply the rows
+    metrics = {}
+    for orders in ("order", "archived_orders"):
+        rows = (
+            Customer.objects.filter(**{f"{orders}__isnull": False})
+            .annotate(
+                frequency=Count(orders, distinct=True),
+                last_order=Max(f"{orders}__order_date"),
+                monetary=Sum(F(f"{orders}__lineitem__quantity") * F(f"{orders}__lineitem__product__price")),
+            )
+            .values_list("id", "frequency", "last_order", "monetary")
+        )
+        for customer, frequency, last_order, monetary in rows:
+            total_frequency, total_last_order, total_monetary = metrics.get(customer, (0, last_order, 0))
+            metrics[customer] = (total_frequency + frequency, max(total_last_order, last_order), total_monetary + (monetary or 0))
+    return [(customer, *metrics[customer]) for customer in sorted(metrics)]
+
+
+def snapshot_metrics():
+    from products.analytics import SnapshotCache, cohort_retention, customer_metrics
+
+    # a new cache maps the files like a worker that just started
+    snapshot = SnapshotCache().get()
+    metrics = customer_metrics(snapshot)
+    cohort_retention(snapshot)
+    return snapshot, metrics
+
+
+def timed(function, runs):
+    """Median seconds of `runs` calls and the peak Python heap of one, with the last result."""
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median": statistics.median(seconds), "min": min(seconds), "peak_kb": peak // 1024}, result
+
+
+def main(argv=None):
+    from benchmarks.run import SCALES, seed
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per side")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the database of the previous run")
+    parser.add_argument("--output", type=Path, default=BENCHMARKS_DIR / "analytics.json")
+    args = parser.parse_args(argv)
+
+    import django
+
+    django.setup()
+
+    from products.analytics import refresh_snapshot
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(args.scale)
+        print(f"Seeded {args.scale} dataset in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = {"scale": args.scale, "runs": args.runs, "python": platform.python_version()}
+    results["orm"], expected = timed(orm_metrics, args.runs)
+    results["refresh"], meta = timed(refresh_snapshot, 1)
+    results["snapshot"], (snapshot, metrics) = timed(snapshot_metrics, args.runs)
+    results["orders"], results["customers"] = meta["orders"], meta["customers"]
+    results["snapshot_kb"] = sum(column.nbytes for column in (snapshot.customer, snapshot.day, snapshot.amount)) // 1024
+
+    last_orders = snapshot.as_of - metrics["recency"].astype("timedelta64[D]")
+    actual = [
+        (int(customer), int(frequency), last_order.item(), int(monetary))
+        for customer, frequency, last_order, monetary in zip(metrics["customer"], metrics["frequency"], last_orders, metrics["monetary"])
+    ]
+    if actual != expected:
+        print("The snapshot metrics differ from the ORM aggregation", file=sys.stderr)
+        return 1
+
+    args.output.write_text(json.dumps(results, indent=2))
+    for name in ("orm", "refresh", "snapshot"):
+        print(f"{name:>9} {results[name]['median'] * 1000:10.1f}ms  peak heap {results[name]['peak_kb']:>8}KB")
+    print(
+        f"{results['orders']} orders by {results['customers']} customers in {results['snapshot_kb']}KB of columns, "
+        f"{results['orm']['median'] / results['snapshot']['median']:.1f}x faster than the ORM, results in {args.output}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
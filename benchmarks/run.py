@@ -0,0 +1,335 @@
+"""
+Load test the products views and the user API against a seeded local database.
+
+    python -m benchmarks.run --scale small --mode client --mode wsgi --concurrency 4
+    python -m benchmarks.run --save-baseline      # record benchmarks/baseline.json
+    python -m benchmarks.run --tolerance 0.2      # fail on regressions over 20%
+
+Results are written as JSON and compared with the stored baseline: throughput,
+p95 latency and peak RSS may regress by `--tolerance`, query counts not at all.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+# the prod profile requires a key and a shared cache, a throwaway key is fine for a local database
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark-only-secret-key")
+os.environ.setdefault("DJANGO_CACHE_BACKEND", "file")
+
+SCALES = {
+    "tiny": {"customers": 20, "orders": 100, "products": 10, "users": 20},
+    "small": {"customers": 1000, "orders": 10000, "products": 10, "users": 500},
+    "medium": {"customers": 20000, "orders": 200000, "products": 50, "users": 5000},
+    "large": {"customers": 200000, "orders": 2000000, "products": 100, "users": 50000},
+}
+
+# name, path, needs a logged in user
+SCENARIOS = [
+    ("index", "/", False),
+    ("index_page", "/?page_size=200", False),
+    ("atomic", "/atomic/", True),
+    ("users_list", "/users/", False),
+    ("users_detail", "/users/1/", False),
+]
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(len(ordered) * percent / 100) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors, queries=None):
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": (len(latencies) - errors) / elapsed if elapsed else 0,
+        "latency": {f"p{percent}": percentile(latencies, percent) for percent in (50, 95, 99)},
+    }
+    if queries is not None:
+        summary["queries"] = {"mean": sum(queries) / len(queries), "max": max(queries)}
+    return summary
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if platform.system() == "Darwin" else peak
+
+
+def seed(scale):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    sizes = SCALES[scale]
+    call_command("migrate", verbosity=0)
+    call_command("flush", interactive=False, verbosity=0)
+    call_command("seed_data", customers=sizes["customers"], orders=sizes["orders"], products=sizes["products"], seed=1)
+    User.objects.bulk_create(User(username=f"user{index}", email=f"user{index}@bench.local") for index in range(sizes["users"]))
+    User.objects.create_user("bench", "bench@bench.local", "bench")
+
+
+def drive(fetch, path, total, concurrency):
+    """
+    Run `total` requests over `concurrency` threads. `fetch` returns the query
+    count or None, and raises on a failed request.
+    """
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(count):
+        local = []
+        local_queries = []
+        local_errors = []
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                count_queries = fetch(path)
+            except Exception as exc:
+                local_errors.append(repr(exc))
+                count_queries = None
+            local.append(time.perf_counter() - started)
+            if count_queries is not None:
+                local_queries.append(count_queries)
+        with lock:
+            latencies.extend(local)
+            queries.extend(local_queries)
+            errors.extend(local_errors)
+
+    shares = [total // concurrency + (index < total % concurrency) for index in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, shares))
+    if errors:
+        print(f"{path}: {len(errors)} failed requests, e.g. {errors[0]}", file=sys.stderr)
+    return summarize(latencies, time.perf_counter() - started, len(errors), queries or None)
+
+
+def run_client(requests, concurrency):
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    from utils.queries import recording
+
+    user = User.objects.get(username="bench")
+    clients = threading.local()
+
+    def client_for(login):
+        key = "authenticated" if login else "anonymous"
+        if not hasattr(clients, key):
+            client = Client()
+            if login:
+                client.force_login(user)
+            setattr(clients, key, client)
+        return getattr(clients, key)
+
+    results = {}
+    for name, path, login in SCENARIOS:
+
+        def fetch(path, login=login):
+            with recording() as recorder:
+                response = client_for(login).get(path)
+            assert response.status_code == 200, f"{path} returned {response.status_code}"
+            return recorder.count
+
+        results[name] = drive(fetch, path, requests, concurrency)
+    return results
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def session_cookie():
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    client = Client()
+    client.force_login(User.objects.get(username="bench"))
+    return {name: morsel.value for name, morsel in client.cookies.items()}
+
+
+def run_http(base_url, requests, concurrency):
+    import httpx
+
+    cookies = session_cookie()
+    clients = threading.local()
+
+    def client_for(login):
+        key = "authenticated" if login else "anonymous"
+        if not hasattr(clients, key):
+            setattr(clients, key, httpx.Client(base_url=base_url, cookies=cookies if login else None, timeout=60))
+        return getattr(clients, key)
+
+    results = {}
+    for name, path, login in SCENARIOS:
+
+        def fetch(path, login=login):
+            response = client_for(login).get(path)
+            assert response.status_code == 200, f"{path} returned {response.status_code}"
+
+        results[name] = drive(fetch, path, requests, concurrency)
+    # query counts come from the server side profiler
+    results["server_metrics"] = httpx.get(f"{base_url}/__metrics__/").json()
+    return results
+
+
+def run_wsgi(requests, concurrency):
+    from django_playground.wsgi import application
+    from utils.profiling import metrics
+
+    metrics.reset()
+    server = make_server("127.0.0.1", 0, application, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_http(f"http://127.0.0.1:{server.server_port}", requests, concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_asgi(requests, concurrency):
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        print("Skipping asgi mode, uvicorn is not installed", file=sys.stderr)
+        return None
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "django_playground.asgi:application", "--port", str(port), "--log-level", "warning"],
+        cwd=BENCHMARKS_DIR.parent,
+        env={**os.environ, "PYTHONPATH": str(BENCHMARKS_DIR.parent)},
+    )
+    try:
+        wait_for_port(port)
+        results = run_http(f"http://127.0.0.1:{port}", requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+    results["server_peak_rss_kb"] = peak_rss_kb(resource.RUSAGE_CHILDREN)
+    return results
+
+
+MODES = {"client": run_client, "wsgi": run_wsgi, "asgi": run_asgi}
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` against `baseline`."""
+    regressions = []
+    for mode, scenarios in baseline["modes"].items():
+        for name, expected in scenarios.items():
+            actual = results["modes"].get(mode, {}).get(name)
+            if not actual or "throughput" not in expected:
+                continue
+            label = f"{mode}:{name}"
+            if actual["errors"] > expected.get("errors", 0):
+                regressions.append(f"{label} {actual['errors']} failed requests > baseline {expected.get('errors', 0)}")
+            if actual["throughput"] < expected["throughput"] * (1 - tolerance):
+                regressions.append(f"{label} throughput {actual['throughput']:.1f}/s < baseline {expected['throughput']:.1f}/s")
+            if actual["latency"]["p95"] > expected["latency"]["p95"] * (1 + tolerance):
+                regressions.append(
+                    f"{label} p95 latency {actual['latency']['p95'] * 1000:.1f}ms > baseline {expected['latency']['p95'] * 1000:.1f}ms"
+                )
+            if "queries" in expected and actual.get("queries", {}).get("max", 0) > expected["queries"]["max"]:
+                regressions.append(f"{label} max queries {actual['queries']['max']} > baseline {expected['queries']['max']}")
+    if results["peak_rss_kb"] > baseline["peak_rss_kb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {results['peak_rss_kb']}KB > baseline {baseline['peak_rss_kb']}KB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--mode", choices=MODES, action="append", help="client, wsgi and/or asgi (default: client and wsgi)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the database of the previous run")
+    parser.add_argument("--output", type=Path, default=BENCHMARKS_DIR / "results.json")
+    parser.add_argument("--baseline", type=Path, default=BENCHMARKS_DIR / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    import django
+
+    django.setup()
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(args.scale)
+        print(f"Seeded {args.scale} dataset in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    results = {"scale": args.scale, "concurrency": args.concurrency, "requests": args.requests, "python": platform.python_version(), "modes": {}}
+    for mode in args.mode or ["client", "wsgi"]:
+        outcome = MODES[mode](args.requests, args.concurrency)
+        if outcome is not None:
+            results["modes"][mode] = outcome
+    results["peak_rss_kb"] = peak_rss_kb()
+
+    args.output.write_text(json.dumps(results, indent=2))
+    for mode, scenarios in results["modes"].items():
+        for name, summary in scenarios.items():
+            if "throughput" in summary:
+                print(
+                    f"{mode:>6} {name:<14} {summary['throughput']:8.1f} req/s  p95 {summary['latency']['p95'] * 1000:8.2f}ms  {summary['errors']} errors"
+                )
+    print(f"peak RSS {results['peak_rss_kb']}KB, results in {args.output}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print("No baseline to compare with, run with --save-baseline first")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
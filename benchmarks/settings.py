@@ -0,0 +1,20 @@
+import os
+
+from django_playground.settings.prod import *  # noqa: F401
+
+# a dedicated database so benchmark runs never touch the development data,
+# seeding flushes it. DJANGO_DB_ENGINE=postgresql benchmarks the configured
+# server, in its own DJANGO_BENCHMARK_DB_NAME database
+DATABASES = {"default": DATABASES["default"]}
+if DATABASE_ENGINE == "sqlite":
+    DATABASES["default"] = {**DATABASES["default"], "NAME": BASE_DIR / "benchmarks" / "bench.sqlite3"}
+else:
+    DATABASES["default"] = {**DATABASES["default"], "NAME": os.environ.get("DJANGO_BENCHMARK_DB_NAME", "django_playground_benchmark")}
+
+ANALYTICS_SNAPSHOT_DIR = BASE_DIR / "benchmarks" / "snapshots"
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["127.0.0.1", "localhost", "testserver"]
+
+PROFILING = {**PROFILING, "NPLUSONE": "off"}
@@ -0,0 +1,104 @@
+"""
+Measure how long a fresh worker takes to start and how much memory it holds
+once started, per settings profile.
+
+    python -m benchmarks.startup --profile dev --profile prod --runs 5
+    python -m benchmarks.startup --importtime 15      # slowest imports of each boot
+
+`check` runs `manage.py check`, `wsgi` imports the WSGI application and
+resolves a URL, which loads the URLconf and every view module like the first
+request of a worker would. Results are written to benchmarks/startup.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARKS_DIR.parent
+
+TARGETS = {
+    "check": [str(ROOT_DIR / "manage.py"), "check"],
+    "wsgi": ["-c", "from django_playground.wsgi import application\nfrom django.urls import resolve\nresolve('/')"],
+}
+
+PROFILES = ["dev", "test", "prod"]
+
+
+def run_once(target, profile, importtime=False):
+    """Start `target` under `profile`, returns (seconds, peak RSS in KB, stderr)."""
+    env = {
+        "DJANGO_SECRET_KEY": "benchmark-only-secret-key",
+        "DJANGO_CACHE_BACKEND": "file",
+        **os.environ,
+        "PYTHONPATH": str(ROOT_DIR),
+        "DJANGO_SETTINGS_MODULE": f"django_playground.settings.{profile}",
+    }
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), *TARGETS[target]]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    # wait4 returns the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"{target} ({profile}) exited with {process.returncode}:\n{stderr}")
+    # macOS reports bytes, Linux kilobytes
+    rss_kb = usage.ru_maxrss // 1024 if platform.system() == "Darwin" else usage.ru_maxrss
+    return elapsed, rss_kb, stderr
+
+
+def slowest_imports(importtime, count):
+    """The `count` slowest top level imports of `python -X importtime` output, as (microseconds, module)."""
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # nested imports are indented, their time is part of the importing module's
+        if not name[1:].startswith(" "):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def measure(target, profile, runs):
+    timings = [run_once(target, profile)[:2] for _ in range(runs)]
+    seconds = [elapsed for elapsed, _ in timings]
+    return {"runs": runs, "median": statistics.median(seconds), "min": min(seconds), "max": max(seconds), "rss_kb": max(rss for _, rss in timings)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=PROFILES, action="append", help="Settings profiles to compare (default: dev and prod)")
+    parser.add_argument("--target", choices=TARGETS, action="append", help="check and/or wsgi (default: both)")
+    parser.add_argument("--runs", type=int, default=5, help="Process starts per target and profile")
+    parser.add_argument("--importtime", type=int, default=0, metavar="COUNT", help="Also list the COUNT slowest imports")
+    parser.add_argument("--output", type=Path, default=BENCHMARKS_DIR / "startup.json")
+    args = parser.parse_args(argv)
+
+    results = {"python": platform.python_version(), "targets": {}}
+    for target in args.target or list(TARGETS):
+        for profile in args.profile or ["dev", "prod"]:
+            summary = measure(target, profile, args.runs)
+            if args.importtime:
+                summary["slowest_imports"] = slowest_imports(run_once(target, profile, importtime=True)[2], args.importtime)
+            results["targets"].setdefault(target, {})[profile] = summary
+            print(
+                f"{target:>6} {profile:<5} median {summary['median'] * 1000:7.1f}ms  max {summary['max'] * 1000:7.1f}ms  peak RSS {summary['rss_kb']}KB"
+            )
+            for microseconds, name in summary.get("slowest_imports", []):
+                print(f"{'':>13}{microseconds / 1000:7.1f}ms  {name}")
+
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Results in {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
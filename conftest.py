@@ -0,0 +1 @@
+pytest_plugins = ["utils.pytest_nplusone", "utils.pytest_testdb", "utils.pytest_timings"]
@@ -0,0 +1,305 @@
+import os
+import sys
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, os.path.join(BASE_DIR, "apps"))
+
+# Settings shared by every profile, manage.py loads .dev, pytest .test and
+# the WSGI/ASGI entry points .prod unless DJANGO_SETTINGS_MODULE says otherwise
+# See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
+
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+# see the debug toolbar and /__metrics__/
+INTERNAL_IPS = [
+    "127.0.0.1",
+]
+
+# Application definition
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "products",
+    "rest_framework",
+    "utils",
+]
+
+MIDDLEWARE = [
+    "utils.routers.ReplicaRoutingMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+PROFILING = {
+    # seconds after which a request is logged as slow
+    "SLOW_REQUEST_THRESHOLD": 1.0,
+    # runs of a query shape after its first one in a request (or from one call
+    # site, for the N+1 detector) that make it a duplicate: 2 flags the third run
+    "DUPLICATE_QUERY_THRESHOLD": 2,
+    # "off", "warn" (log) or "raise" when a request lazy loads rows one at a time
+    "NPLUSONE": "warn",
+    # regexes of query shapes that may repeat, e.g. framework internals
+    "NPLUSONE_IGNORE": [r'FROM "django_session"'],
+}
+
+ROOT_URLCONF = "django_playground.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = "django_playground.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+
+# DJANGO_DB_ENGINE picks "sqlite" (default) or "postgresql", the other
+# DJANGO_DB_* variables fill in the connection
+
+DATABASE_ENGINES = {
+    "sqlite": "utils.backends.sqlite3",
+    "postgresql": "django.db.backends.postgresql",
+}
+
+DATABASE_ENGINE = os.environ.get("DJANGO_DB_ENGINE", "sqlite")
+
+DATABASES = {
+    "default": {
+        "ENGINE": DATABASE_ENGINES[DATABASE_ENGINE],
+        # seconds a connection is reused across requests, 0 closes it after each request
+        "CONN_MAX_AGE": int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", 60)),
+        # ping reused connections when a request starts, see utils.db
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+if DATABASE_ENGINE == "postgresql":
+    DATABASES["default"].update(
+        {
+            "NAME": os.environ.get("DJANGO_DB_NAME", "django_playground"),
+            "USER": os.environ.get("DJANGO_DB_USER", ""),
+            "PASSWORD": os.environ.get("DJANGO_DB_PASSWORD", ""),
+            "HOST": os.environ.get("DJANGO_DB_HOST", ""),
+            "PORT": os.environ.get("DJANGO_DB_PORT", ""),
+            # .iterator() streams through named cursors, turn off behind a transaction pooler
+            "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("DJANGO_DB_DISABLE_SERVER_SIDE_CURSORS") == "1",
+        }
+    )
+else:
+    DATABASES["default"].update(
+        {
+            "NAME": os.environ.get("DJANGO_DB_NAME", BASE_DIR / "db.sqlite3"),
+            # seconds a write waits for the lock held by another connection
+            "OPTIONS": {"timeout": float(os.environ.get("DJANGO_DB_TIMEOUT", 20))},
+        }
+    )
+
+# applied to every new SQLite connection, see utils.db
+SQLITE_PRAGMAS = {
+    # readers never block the writer and the writer never blocks readers
+    "journal_mode": "wal",
+    # fsync at checkpoints only, still durable against application crashes
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    # negative values are KiB
+    "cache_size": -64 * 1024,
+    "temp_store": "memory",
+}
+
+# read only copies of "default", database paths for SQLite and hosts for
+# PostgreSQL, e.g. DJANGO_DB_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+for index, location in enumerate(filter(None, os.environ.get("DJANGO_DB_REPLICAS", "").split(",")), 1):
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "NAME" if DATABASE_ENGINE == "sqlite" else "HOST": location,
+        "TEST": {"MIRROR": "default"},
+    }
+
+# reads of products models and auth.User go to a healthy replica until the
+# request writes, see utils.routers
+DATABASE_ROUTERS = ["utils.routers.ReplicaRouter"]
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+
+# seconds a replica health check is trusted
+DATABASE_REPLICA_HEALTH_INTERVAL = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "django-playground",
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache",
+    },
+    "memcached": {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "127.0.0.1:11211"),
+    },
+    "dummy": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    },
+}
+
+# locmem is per process, prod requires a shared backend, see prod.py
+CACHES = {"default": CACHE_BACKENDS[os.environ.get("DJANGO_CACHE_BACKEND", "locmem")]}
+
+API_CACHE_TIMEOUT = 300
+
+# products kept per process by products.catalog, None keeps the whole table
+PRODUCT_CATALOG_MAX_SIZE = None
+
+
+# Password validation
+# https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "PAGE_SIZE": 50,
+}
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/3.2/topics/i18n/
+
+LANGUAGE_CODE = "en-us"
+
+TIME_ZONE = "UTC"
+
+USE_I18N = True
+
+USE_L10N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/3.2/howto/static-files/
+
+STATIC_URL = "/static/"
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Orders index pagination
+
+ORDERS_PAGE_SIZE = 50
+
+ORDERS_MAX_PAGE_SIZE = 500
+
+ORDERS_EXPORT_CHUNK_SIZE = 2000
+
+ORDERS_INGEST_MAX_BATCH = 10000
+
+
+# Admin changelists
+
+# rows counted at most for a changelist, larger results show "10,000+"
+ADMIN_COUNT_LIMIT = 10000
+
+ADMIN_COUNT_TIMEOUT = 300
+
+
+# Order archive, see products.archive
+
+# orders delivered longer ago than this are moved out of the hot tables
+ARCHIVE_AFTER_DAYS = 365
+
+# one compressed file per month of archived orders
+ARCHIVE_EXPORT_DIR = BASE_DIR / "archive"
+
+
+# Product affinity, see products.affinity
+
+# neighbours kept per product
+PRODUCT_AFFINITY_TOP_K = 10
+
+# pairs bought together in fewer orders are too rare to recommend
+PRODUCT_AFFINITY_MIN_ORDERS = 2
+
+
+# Customer analytics, see products.analytics
+
+# memory mapped columns of every order, rewritten by `customer_analytics --refresh`
+ANALYTICS_SNAPSHOT_DIR = BASE_DIR / "snapshots"
+
+# years of spend a customer's lifetime value projects
+ANALYTICS_CLV_YEARS = 3
+
+
+# Fulfilment workers, see products.fulfilment
+
+FULFILMENT_BATCH_SIZE = 500
+
+FULFILMENT_POLL_INTERVAL = 1.0
+
+# seconds after which a job claimed by a silent worker is handed out again
+FULFILMENT_CLAIM_TIMEOUT = 300
+
+
+# Outbound HTTP used by the async user API views
+
+UPSTREAM_IP_URL = "http://httpbin.org/ip"
+
+UPSTREAM_HEADERS_URL = "http://httpbin.org/headers"
+
+UPSTREAM_HTTP_CLIENT = {
+    "TIMEOUT": 5.0,
+    "MAX_CONNECTIONS": 20,
+    "MAX_KEEPALIVE_CONNECTIONS": 10,
+    "KEEPALIVE_EXPIRY": 30.0,
+}
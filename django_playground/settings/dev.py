@@ -0,0 +1,16 @@
+import os
+
+from .base import *  # noqa: F401
+
+# a public key, only fit for local profiles, prod requires DJANGO_SECRET_KEY
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", "django-insecure-!tmmd5hmu4v0$f#w$nubxxnseoauk)*^*e)avu-6r%zv9yd_2*")
+
+DEBUG = True
+
+INSTALLED_APPS += [
+    "debug_toolbar",
+    "django_extensions",
+]
+
+# sync only, it would pin every async view to a single thread outside of development
+MIDDLEWARE = ["debug_toolbar.middleware.DebugToolbarMiddleware", *MIDDLEWARE]
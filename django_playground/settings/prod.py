@@ -0,0 +1,42 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401
+
+# SECURITY WARNING: keep the secret key used in production secret!
+try:
+    SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+except KeyError:
+    raise ImproperlyConfigured("Set DJANGO_SECRET_KEY, the prod profile has no default secret key.")
+
+# API response generations and the product catalog version live in the
+# cache, a per process one would leave the other workers serving stale data
+if CACHES["default"]["BACKEND"] == CACHE_BACKENDS["locmem"]["BACKEND"]:
+    raise ImproperlyConfigured("Set DJANGO_CACHE_BACKEND to a shared cache (file or memcached), locmem is per process.")
+
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
+
+# lightweight request timings and N+1 detection, see utils.profiling
+MIDDLEWARE = ["utils.profiling.ProfilingMiddleware", *MIDDLEWARE]
+
+# templates are compiled once per process instead of on every render
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "APP_DIRS": False,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    ["django.template.loaders.filesystem.Loader", "django.template.loaders.app_directories.Loader"],
+                ),
+            ],
+        },
+    },
+]
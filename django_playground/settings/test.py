@@ -0,0 +1,20 @@
+import os
+
+from .base import *  # noqa: F401
+
+# a public key, only fit for local profiles, prod requires DJANGO_SECRET_KEY
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", "django-insecure-!tmmd5hmu4v0$f#w$nubxxnseoauk)*^*e)avu-6r%zv9yd_2*")
+
+# tests that need the profiler add utils.profiling.ProfilingMiddleware themselves
+
+# the default hasher is slow on purpose, tests create users all the time
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+# nothing uses serialized_rollback, skip dumping the database after setup
+DATABASES["default"]["TEST"] = {"SERIALIZE": False}
+
+# migrated template databases copied into each test session, see utils.pytest_testdb
+TEST_DATABASE_CACHE_DIR = BASE_DIR / ".test_db"
+
+# rows of the template used with --seeded-db
+TEST_DATABASE_SEED = {"customers": 100, "orders": 500, "products": 10, "seed": 1}
@@ -1,15 +1,22 @@
-import debug_toolbar
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from utils.profiling import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("products.urls")),
-    path("__debug__/", include(debug_toolbar.urls)),
+    path("__metrics__/", metrics_view, name="metrics"),
 ]
 
+# only installed by the dev settings
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    import debug_toolbar
+
+    urlpatterns.append(path("__debug__/", include(debug_toolbar.urls)))
+
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class UtilsConfig(AppConfig):
+    name = "utils"
+
+    def ready(self):
+        from . import db  # noqa: F401
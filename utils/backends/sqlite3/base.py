@@ -0,0 +1,15 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # set by utils.db.atomic_write for the transaction it begins
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self):
+        if not self.begin_immediate:
+            # readers keep to a WAL snapshot and never wait for writers
+            return super()._start_transaction_under_autocommit()
+        # take the write lock up front: in WAL mode a deferred transaction that
+        # read before writing can't wait for the lock and fails at once with
+        # "database is locked" when another writer committed in between
+        self.cursor().execute("BEGIN IMMEDIATE")
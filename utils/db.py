@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    # straight on the driver connection, so the pragmas never show up as request queries
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(request_started)
+def check_connection_health(**kwargs):
+    """
+    Persistent connections can be dropped by the server between requests, ping
+    the open ones with CONN_HEALTH_CHECKS so a request never starts on a dead one.
+    """
+    for connection in connections.all():
+        if connection.connection is not None and connection.settings_dict.get("CONN_HEALTH_CHECKS") and not connection.is_usable():
+            connection.close()
+
+
+@contextmanager
+def atomic_write(using=None):
+    """
+    `transaction.atomic()` for transactions that read before they write: on
+    SQLite it begins with `BEGIN IMMEDIATE`, so the write lock is waited for
+    up front instead of failing the first write. Plain `atomic()` stays
+    deferred, readers don't queue behind writers. Nested in another atomic
+    block it is only a savepoint of the transaction already begun.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
+
+
+@contextmanager
+def atomic_snapshot(using=None):
+    """
+    `transaction.atomic()` whose reads all see the database as of the first
+    one. SQLite in WAL mode keeps that snapshot for any transaction, while
+    PostgreSQL's default READ COMMITTED takes a new one per statement, so the
+    transaction is made REPEATABLE READ there. Nested in another atomic block
+    it reads with the isolation of the transaction already begun.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield
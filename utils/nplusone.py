@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+from collections import Counter
+
+from django.conf import settings
+
+from .queries import QueryRecorder, fingerprint
+
+logger = logging.getLogger(__name__)
+
+# frames from the standard library, installed packages and this package are
+# never the interesting call site
+LIBRARY_PATHS = tuple(
+    {sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"], os.path.dirname(__file__)}
+)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def call_site():
+    """The chain of project frames that led to the current query."""
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(LIBRARY_PATHS) and not filename.startswith("<"):
+            frames.append(f"{filename}:{frame.f_lineno}")
+        frame = frame.f_back
+    return " <- ".join(frames) or "<unknown>"
+
+
+class NPlusOneDetector(QueryRecorder):
+    """
+    Record SELECTs by shape and call site. The same shape issued again and
+    again from the same place within one scope (a request or a test) is the
+    lazy loading loop of an N+1. Loops that are meant to repeat a query, like
+    chunked batches, go in `NPLUSONE_IGNORE` or the test's
+    `allow_repeated_queries` marker.
+    """
+
+    def __init__(self, threshold=None):
+        super().__init__()
+        self.threshold = threshold or settings.PROFILING["DUPLICATE_QUERY_THRESHOLD"]
+        self.scope = 0
+        self.seen = Counter()
+        # repeats of a statement by call site, the first run isn't in here
+        self.selects = Counter()
+
+    def record(self, sql, duration):
+        super().record(sql, duration)
+        if sql.lstrip()[:6].upper() == "SELECT":
+            self.seen[(self.scope, sql)] += 1
+            # walking the stack is the expensive part, only statements that repeat need their call site
+            if self.seen[(self.scope, sql)] > 1:
+                self.selects[(self.scope, sql, call_site())] += 1
+
+    def new_scope(self):
+        self.scope += 1
+
+    def violations(self):
+        shapes = Counter()
+        for (scope, sql, site), count in self.selects.items():
+            shapes[(scope, fingerprint(sql), site)] += count
+
+        ignored = [re.compile(pattern) for pattern in settings.PROFILING["NPLUSONE_IGNORE"]]
+        # the first run of a statement has no call site, a loop shows in the runs after it
+        return [
+            {"query": shape, "call_site": site, "count": count + 1}
+            for (scope, shape, site), count in shapes.items()
+            if count >= self.threshold and not any(pattern.search(shape) for pattern in ignored)
+        ]
+
+
+def format_violations(violations):
+    return "\n".join(f"{violation['count']}x {violation['query']}\n    at {violation['call_site']}" for violation in violations)
+
+
+def report(violations, **context):
+    for violation in violations:
+        logger.warning("N+1 queries %s", json.dumps({**context, **violation}))
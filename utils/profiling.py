@@ -0,0 +1,205 @@
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+
+from .nplusone import NPlusOneDetector, NPlusOneError, format_violations, report
+from .queries import QueryRecorder, recording
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# the most repeated query shapes kept per route
+MAX_DUPLICATES = 20
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, percent):
+        """Estimate a percentile by interpolating inside its bucket."""
+        if not self.total:
+            return None
+        rank = self.total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            running += count
+            yield bound, running
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.response_bytes = 0
+        self.slow = 0
+        self.duplicates = Counter()
+
+    def as_dict(self):
+        return {
+            "requests": self.latency.total,
+            "slow_requests": self.slow,
+            "latency": {f"p{percent}": self.latency.percentile(percent) for percent in (50, 95, 99)},
+            "queries": {f"p{percent}": self.queries.percentile(percent) for percent in (50, 95, 99)},
+            "db_time": self.db_time,
+            "response_bytes": self.response_bytes,
+            "duplicate_queries": dict(self.duplicates.most_common(MAX_DUPLICATES)),
+        }
+
+
+class Metrics:
+    """Per process aggregates of every profiled request, grouped by route."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def observe(self, route, duration, recorder, size, slow):
+        duplicates = recorder.duplicates(settings.PROFILING["DUPLICATE_QUERY_THRESHOLD"]) if recorder.count else {}
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.latency.observe(duration)
+            stats.queries.observe(recorder.count)
+            stats.db_time += recorder.duration
+            stats.response_bytes += size
+            stats.slow += slow
+            # counts the requests in which a query shape repeated
+            stats.duplicates.update(duplicates.keys())
+            if len(stats.duplicates) > MAX_DUPLICATES * 2:
+                stats.duplicates = Counter(dict(stats.duplicates.most_common(MAX_DUPLICATES)))
+
+    def as_dict(self):
+        with self.lock:
+            return {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+
+    def as_prometheus(self):
+        lines = []
+        with self.lock:
+            for route, stats in sorted(self.routes.items()):
+                label = route.replace("\\", "\\\\").replace('"', '\\"')
+                for name, histogram in (("request_duration_seconds", stats.latency), ("request_queries", stats.queries)):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'django_{name}_bucket{{route="{label}",le="{bound}"}} {count}')
+                    lines.append(f'django_{name}_sum{{route="{label}"}} {histogram.sum}')
+                    lines.append(f'django_{name}_count{{route="{label}"}} {histogram.total}')
+                lines.append(f'django_request_db_seconds_total{{route="{label}"}} {stats.db_time}')
+                lines.append(f'django_response_bytes_total{{route="{label}"}} {stats.response_bytes}')
+                lines.append(f'django_slow_requests_total{{route="{label}"}} {stats.slow}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+
+metrics = Metrics()
+
+
+def get_route(request):
+    match = getattr(request, "resolver_match", None)
+    return match.route if match else "<unresolved>"
+
+
+def make_recorder():
+    if settings.PROFILING["NPLUSONE"] == "off":
+        return QueryRecorder()
+    return NPlusOneDetector()
+
+
+def finish(request, response, started, recorder):
+    duration = time.perf_counter() - started
+    size = 0 if response.streaming else len(response.content)
+    route = get_route(request)
+    slow = duration >= settings.PROFILING["SLOW_REQUEST_THRESHOLD"]
+    metrics.observe(route, duration, recorder, size, slow)
+
+    if slow:
+        logger.warning(
+            "Slow request %s",
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "route": route,
+                    "status": response.status_code,
+                    "duration": round(duration, 4),
+                    "queries": recorder.count,
+                    "db_time": round(recorder.duration, 4),
+                    "response_bytes": size,
+                    "duplicate_queries": recorder.duplicates(settings.PROFILING["DUPLICATE_QUERY_THRESHOLD"]),
+                }
+            ),
+        )
+
+    if isinstance(recorder, NPlusOneDetector):
+        violations = recorder.violations()
+        if violations and settings.PROFILING["NPLUSONE"] == "raise":
+            raise NPlusOneError(f"N+1 queries in {request.method} {request.path}:\n{format_violations(violations)}")
+        report(violations, method=request.method, path=request.path, route=route)
+
+
+def ProfilingMiddleware(get_response):
+    """
+    Record query count, DB time, repeated query shapes, duration and response
+    size of every request into `metrics`, and log the slow ones.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started = time.perf_counter()
+            with recording(make_recorder()) as recorder:
+                response = await get_response(request)
+            finish(request, response, started, recorder)
+            return response
+
+    else:
+
+        def middleware(request):
+            started = time.perf_counter()
+            with recording(make_recorder()) as recorder:
+                response = get_response(request)
+            finish(request, response, started, recorder)
+            return response
+
+    return middleware
+
+
+ProfilingMiddleware.sync_capable = True
+ProfilingMiddleware.async_capable = True
+
+
+def metrics_view(request):
+    if request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    if request.GET.get("format") == "prometheus":
+        return HttpResponse(metrics.as_prometheus(), content_type="text/plain; version=0.0.4")
+    return JsonResponse(metrics.as_dict())
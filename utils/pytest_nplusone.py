@@ -0,0 +1,33 @@
+import pytest
+from django.core.signals import request_started
+
+from .nplusone import NPlusOneDetector, NPlusOneError, format_violations
+from .queries import recording
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "allow_repeated_queries: do not fail the test on N+1 query patterns")
+
+
+@pytest.fixture(autouse=True)
+def nplusone_detector(request):
+    """Fail every test in which the same query shape repeats from the same call site."""
+    if request.node.get_closest_marker("allow_repeated_queries"):
+        yield None
+        return
+
+    detector = NPlusOneDetector()
+
+    def start_request_scope(**kwargs):
+        detector.new_scope()
+
+    request_started.connect(start_request_scope, weak=False)
+    try:
+        with recording(detector):
+            yield detector
+    finally:
+        request_started.disconnect(start_request_scope)
+
+    violations = detector.violations()
+    if violations:
+        raise NPlusOneError(f"N+1 queries detected:\n{format_violations(violations)}")
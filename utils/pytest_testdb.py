@@ -0,0 +1,135 @@
+"""
+Test databases loaded from a cached SQLite template instead of migrated per run.
+
+The template is migrated once into a file named after a fingerprint of every
+migration file, so editing a migration builds a new one. Each session, and
+each xdist worker, copies its pages into its own in memory test database.
+`--create-db` rebuilds it, `--seeded-db` uses one that also holds
+`settings.TEST_DATABASE_SEED` rows. Other database backends are set up the
+usual pytest-django way.
+"""
+import fcntl
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from io import StringIO
+from pathlib import Path
+
+import django
+import pytest
+from django.conf import settings
+
+from .pytest_timings import record_database_setup
+
+RUN_STARTED = pytest.StashKey[float]()
+
+
+def pytest_addoption(parser):
+    parser.getgroup("django").addoption(
+        "--seeded-db",
+        action="store_true",
+        help="Start from a template seeded with settings.TEST_DATABASE_SEED rows, for tests that don't need an empty database",
+    )
+
+
+def pytest_configure(config):
+    config.stash[RUN_STARTED] = config.workerinput["run_started"] if hasattr(config, "workerinput") else time.time()
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    # --create-db rebuilds the template once per run, not once per worker
+    node.workerinput["run_started"] = node.config.stash[RUN_STARTED]
+
+
+def fingerprint(connection, seed):
+    from django.db.migrations.loader import MigrationLoader
+
+    digest = hashlib.sha256(f"{django.get_version()} {connection.settings_dict['ENGINE']} {sorted(seed.items()) if seed else ''}".encode())
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    for key in sorted(loader.disk_migrations):
+        digest.update(Path(sys.modules[loader.disk_migrations[key].__module__].__file__).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def build_template(connection, path, seed):
+    from django.core.management import call_command
+
+    partial = path.with_name(f"{path.name}.{os.getpid()}")
+    name, test_name = connection.settings_dict["NAME"], connection.settings_dict["TEST"]["NAME"]
+    connection.settings_dict["TEST"]["NAME"] = str(partial)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        if seed:
+            call_command("seed_data", **seed, stdout=StringIO())
+    finally:
+        # closing the last connection checkpoints the WAL back into the file
+        connection.creation.destroy_test_db(name, verbosity=0, keepdb=True)
+        connection.settings_dict["TEST"]["NAME"] = test_name
+    os.replace(partial, path)
+
+
+def load_template(connection, seed, rebuild_before=None):
+    """
+    Copy the template into the test database, building it first when it is
+    missing or older than `rebuild_before`. Returns the sqlite3 connection
+    keeping the in memory copy alive and whether the template was built.
+    """
+    cache_dir = Path(settings.TEST_DATABASE_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = fingerprint(connection, seed)
+    template = cache_dir / f"template_{key}.sqlite3"
+
+    # xdist workers start together, one builds while the others wait
+    with open(cache_dir / f"template_{key}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        built = not template.exists() or (rebuild_before is not None and template.stat().st_mtime < rebuild_before)
+        if built:
+            build_template(connection, template, seed)
+
+    # an in memory database lives as long as a connection to it is open
+    target = sqlite3.connect(connection.creation._get_test_db_name(), uri=True)
+    source = sqlite3.connect(template)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+    return target, built
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_auto_num_workers(config):
+    # `-n auto` on a single CPU runs in process, one worker would only add its start up time
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return cpus if cpus > 1 else 0
+
+
+@pytest.fixture(scope="session")
+def django_db_setup(request, django_test_environment, django_db_blocker, django_db_keepdb, django_db_createdb):
+    """Replaces pytest-django's fixture of the same name."""
+    from django.db import connections
+    from django.test.utils import setup_databases, teardown_databases
+
+    connection = connections["default"]
+    copy = None
+    built = False
+    started = time.perf_counter()
+    with django_db_blocker.unblock():
+        if connection.vendor == "sqlite":
+            seed = settings.TEST_DATABASE_SEED if request.config.getoption("seeded_db") else None
+            copy, built = load_template(connection, seed, rebuild_before=request.config.stash[RUN_STARTED] if django_db_createdb else None)
+        # the copy is already migrated, keepdb makes migrate a no-op
+        keepdb = copy is not None or (django_db_keepdb and not django_db_createdb)
+        db_cfg = setup_databases(verbosity=request.config.option.verbose, interactive=False, keepdb=keepdb)
+    record_database_setup(request.config, time.perf_counter() - started, built)
+
+    yield
+
+    # a reused database of another backend is kept
+    if copy is not None or not django_db_keepdb:
+        with django_db_blocker.unblock():
+            teardown_databases(db_cfg, verbosity=request.config.option.verbose)
+    if copy is not None:
+        copy.close()
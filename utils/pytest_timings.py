@@ -0,0 +1,80 @@
+"""
+Per test timings summarised at the end of the run: the test database setup of
+every worker, the slowest tests and the slowest test classes or modules.
+`--timings N` sets how many are listed, `--timings-json PATH` saves them all.
+"""
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+DATABASE_SETUP = pytest.StashKey[list]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("timings")
+    group.addoption("--timings", type=int, default=0, metavar="N", help="Report the N slowest tests and test classes")
+    group.addoption("--timings-json", metavar="PATH", help="Write the setup, call and teardown time of every test to PATH")
+
+
+def pytest_configure(config):
+    config.stash[DATABASE_SETUP] = []
+    config.pluginmanager.register(TimingsReport(config), "timings_report")
+
+
+def record_database_setup(config, seconds, built_template):
+    setup = {"worker": os.environ.get("PYTEST_XDIST_WORKER", "main"), "seconds": seconds, "built_template": built_template}
+    if hasattr(config, "workeroutput"):
+        # handed to the controller when the worker shuts down
+        config.workeroutput["database_setup"] = setup
+    config.stash[DATABASE_SETUP].append(setup)
+
+
+class TimingsReport:
+    def __init__(self, config):
+        self.config = config
+        self.tests = defaultdict(dict)
+
+    def pytest_runtest_logreport(self, report):
+        self.tests[report.nodeid][report.when] = report.duration
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        setup = getattr(node, "workeroutput", {}).get("database_setup")
+        if setup:
+            self.config.stash[DATABASE_SETUP].append(setup)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        count = self.config.getoption("timings")
+        path = self.config.getoption("timings_json")
+        if hasattr(self.config, "workerinput") or not self.tests or not (count or path):
+            return
+
+        totals = {test: sum(phases.values()) for test, phases in self.tests.items()}
+        groups = defaultdict(list)
+        for test, seconds in totals.items():
+            # the class, or the module for plain test functions
+            groups[test.rsplit("::", 1)[0]].append(seconds)
+        databases = sorted(self.config.stash[DATABASE_SETUP], key=lambda setup: setup["worker"])
+
+        if path:
+            with open(path, "w") as output:
+                json.dump({"database_setup": databases, "tests": self.tests}, output, indent=2)
+        if not count:
+            return
+
+        write = terminalreporter.write_line
+        terminalreporter.section("test timings")
+        for setup in databases:
+            write(
+                f"database setup {setup['worker']}: {setup['seconds']:.2f}s ({'built the template' if setup['built_template'] else 'copied the template'})"
+            )
+        phases = {phase: sum(test.get(phase, 0) for test in self.tests.values()) for phase in ("setup", "call", "teardown")}
+        write(f"{len(self.tests)} tests: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items()))
+        write("slowest tests:")
+        for test, seconds in sorted(totals.items(), key=lambda item: -item[1])[:count]:
+            write(f"{seconds:8.2f}s  {test}")
+        write("slowest classes and modules:")
+        for group, times in sorted(groups.items(), key=lambda item: -sum(item[1]))[:count]:
+            write(f"{sum(times):8.2f}s  {group} ({len(times)} tests)")
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+_state = ContextVar("replica_routing", default=None)
+
+ROUTED_APPS = {"products"}
+ROUTED_MODELS = {("auth", "user")}
+
+
+class ReplicaHealth:
+    """Remember which replicas answered a `SELECT 1`, re-checked every interval."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            healthy, checked_at = self.checked.get(alias, (True, None))
+        if checked_at is not None and now - checked_at < settings.DATABASE_REPLICA_HEALTH_INTERVAL:
+            return healthy
+
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT 1")
+            healthy = True
+        except DatabaseError:
+            healthy = False
+        with self.lock:
+            self.checked[alias] = (healthy, now)
+        return healthy
+
+    def reset(self):
+        with self.lock:
+            self.checked = {}
+
+
+health = ReplicaHealth()
+
+
+@contextmanager
+def replica_scope():
+    """
+    Route reads to a replica until the first write, then keep the rest of the
+    scope on the primary so it reads its own writes. One scope per request.
+    """
+    token = _state.set({"pinned": False, "replica": None})
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def is_routed(model):
+    return model._meta.app_label in ROUTED_APPS or (model._meta.app_label, model._meta.model_name) in ROUTED_MODELS
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state["pinned"] or not settings.DATABASE_REPLICAS or not is_routed(model):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        # the replica is chosen once and kept for the request, so its reads are consistent
+        if state["replica"] is None or not health.is_healthy(state["replica"]):
+            healthy = [alias for alias in settings.DATABASE_REPLICAS if health.is_healthy(alias)]
+            state["replica"] = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return state["replica"]
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state["pinned"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def ReplicaRoutingMiddleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with replica_scope():
+                return await get_response(request)
+
+    else:
+
+        def middleware(request):
+            with replica_scope():
+                return get_response(request)
+
+    return middleware
+
+
+ReplicaRoutingMiddleware.sync_capable = True
+ReplicaRoutingMiddleware.async_capable = True